@@ -0,0 +1,171 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Persistent store of file content digests for folder comparisons
+
+Folder comparisons that read file contents record a digest of each
+file that they read in full, keyed by the file's device, inode, size
+and modification time. Re-comparing files that haven't changed since,
+in any pairing, then only needs a stat call for each file.
+
+Alongside the digest of a file's raw content, the store can hold
+digests of its content after normalisation (line endings, blank lines
+and text filters), with a separate digest for each normalisation
+configuration.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from typing import Iterable, List, Optional, Sequence
+
+from gi.repository import GLib
+
+log = logging.getLogger(__name__)
+
+#: Variant name for digests of unmodified file contents
+RAW = "raw"
+
+
+def new_digest():
+    """Return a new hash object for content digests"""
+    return hashlib.blake2b(digest_size=32)
+
+
+def content_digest(data) -> bytes:
+    """Return the digest of a bytes-like object"""
+    digest = new_digest()
+    digest.update(data)
+    return digest.digest()
+
+
+def normalisation_variant(ignore_blank_lines: bool, regexes) -> str:
+    """Return the variant name for a content normalisation configuration
+
+    :param ignore_blank_lines: whether blank lines are removed
+    :param regexes: compiled bytes regexes applied as text filters
+    """
+    config = repr((
+        ignore_blank_lines,
+        [(r.pattern, r.flags) for r in regexes],
+    ))
+    digest = hashlib.blake2b(config.encode("utf-8"), digest_size=16)
+    return "normalised-" + digest.hexdigest()
+
+
+class DigestStore:
+    """SQLite-backed store of per-file content digests
+
+    Digests are looked up by `os.stat_result`, so a file's entries
+    stop matching as soon as it's modified. The store is safe to use
+    from several threads; all access goes through a single connection.
+    """
+
+    #: Number of entries kept when the store is opened; the oldest
+    #: entries beyond this are dropped.
+    max_entries = 2000000
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            path, timeout=1, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS digests ("
+                " dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER,"
+                " variant TEXT, digest BLOB,"
+                " PRIMARY KEY (dev, ino, size, mtime_ns, variant))"
+            )
+            self._db.execute(
+                "DELETE FROM digests WHERE rowid <= "
+                "(SELECT MAX(rowid) FROM digests) - ?",
+                (self.max_entries,),
+            )
+
+    @staticmethod
+    def _key(stat_result: os.stat_result):
+        return (
+            stat_result.st_dev, stat_result.st_ino,
+            stat_result.st_size, stat_result.st_mtime_ns,
+        )
+
+    def get(
+        self, stats: Sequence[os.stat_result], variant: str = RAW,
+    ) -> List[Optional[bytes]]:
+        """Return the stored digest for each of 'stats', or None"""
+        digests = []
+        try:
+            with self._lock:
+                for s in stats:
+                    row = self._db.execute(
+                        "SELECT digest FROM digests WHERE dev = ? AND"
+                        " ino = ? AND size = ? AND mtime_ns = ? AND"
+                        " variant = ?",
+                        self._key(s) + (variant,),
+                    ).fetchone()
+                    digests.append(row[0] if row else None)
+        except sqlite3.Error as e:
+            log.debug("Couldn't read file digests: %s", e)
+            return [None] * len(stats)
+        return digests
+
+    def put(self, entries: Iterable, variant: str = RAW) -> None:
+        """Store digests for files
+
+        :param entries: (stat result, digest) pairs to store
+        :param variant: the normalisation variant of the digests
+        """
+        rows = [
+            self._key(s) + (variant, digest) for s, digest in entries]
+        try:
+            with self._lock, self._db:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO digests"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+        except sqlite3.Error as e:
+            log.debug("Couldn't store file digests: %s", e)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+_digest_store = None
+_digest_store_failed = False
+
+
+def get_digest_store() -> Optional[DigestStore]:
+    """Return the user's shared digest store, opening it if necessary
+
+    If the store can't be opened, a warning is logged and None is
+    returned; comparisons then carry on without it.
+    """
+    global _digest_store, _digest_store_failed
+    if _digest_store is None and not _digest_store_failed:
+        cache_dir = os.path.join(GLib.get_user_cache_dir(), "meld")
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            _digest_store = DigestStore(
+                os.path.join(cache_dir, "digests.sqlite3"))
+        except (OSError, sqlite3.Error) as e:
+            log.warning("Couldn't open file digest store: %s", e)
+            _digest_store_failed = True
+    return _digest_store
@@ -15,6 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import collections
+import concurrent.futures
 import copy
 import errno
 import functools
@@ -23,6 +24,7 @@ import os
 import shutil
 import stat
 import sys
+import threading
 import typing
 import unicodedata
 import time
@@ -37,12 +39,20 @@ from gi.repository import Gdk, Gio, GLib, GObject, Gtk
 from meld import misc, tree
 from meld.conf import _
 from meld.const import FILE_FILTER_ACTION_FORMAT, MISSING_TIMESTAMP
+from meld.digeststore import (
+    RAW,
+    content_digest,
+    get_digest_store,
+    new_digest,
+    normalisation_variant,
+)
 from meld.externalhelpers import open_files_external
 from meld.iohelpers import find_shared_parent_path, trash_or_confirm
 from meld.melddoc import MeldDoc
 from meld.misc import all_same, apply_text_filters, with_focused_pane, debug_print, performance_monitor
 from meld.recent import RecentType
 from meld.settings import bind_settings, get_meld_settings, settings
+from meld.task import pause
 from meld.treehelpers import refocus_deleted_path, tree_path_as_tuple
 from meld.ui.cellrenderers import (
     CellRendererByteSize,
@@ -88,14 +98,243 @@ class StatItem(namedtuple('StatItem', 'mode size time')):
         return mtime1 == mtime2
 
 
+class StatCache:
+    """Per-scan cache of stat results
+
+    A folder comparison looks at each path several times: once while
+    listing its parent, again while filtering rows by state, and again
+    while comparing contents and filling in row details. This cache
+    lets all of those share a single stat (and lstat) call per path.
+    Failures are cached too, and re-raised to match `os.stat()`.
+
+    The cache is a snapshot; it should only live as long as a single
+    scan or row update.
+    """
+
+    def __init__(self):
+        self._stats: Dict[str, typing.Union[os.stat_result, OSError]] = {}
+        self._lstats: Dict[str, typing.Union[os.stat_result, OSError]] = {}
+
+    @staticmethod
+    def _lookup(cache, path, stat_func):
+        result = cache.get(path)
+        if result is None:
+            try:
+                result = stat_func(path)
+            except OSError as err:
+                result = err
+            cache[path] = result
+        if isinstance(result, OSError):
+            raise result
+        return result
+
+    def add_entry(self, entry: os.DirEntry) -> os.stat_result:
+        """Seed the cache from a `os.scandir()` entry
+
+        Returns the entry's lstat result, raising `OSError` if it
+        couldn't be read.
+        """
+        lstat = self._lookup(
+            self._lstats, entry.path,
+            lambda path: entry.stat(follow_symlinks=False))
+        if not stat.S_ISLNK(lstat.st_mode):
+            self._stats.setdefault(entry.path, lstat)
+        return lstat
+
+    def stat(self, path: str) -> os.stat_result:
+        return self._lookup(self._stats, os.fspath(path), os.stat)
+
+    def lstat(self, path: str) -> os.stat_result:
+        return self._lookup(self._lstats, os.fspath(path), os.lstat)
+
+    def exists(self, path: str) -> bool:
+        try:
+            self.stat(path)
+        except OSError:
+            return False
+        return True
+
+    def isdir(self, path: str) -> bool:
+        try:
+            return stat.S_ISDIR(self.stat(path).st_mode)
+        except OSError:
+            return False
+
+
 CacheResult = namedtuple('CacheResult', 'stats result')
 
 
-_cache = {}
+class ComparisonCache:
+    """LRU cache of file comparison results, bounded by size
+
+    Results are keyed by the compared files and comparison options, and
+    are only valid while the files' stats match those stored with the
+    result. The size of each entry is estimated from its file paths,
+    and least-recently used entries are evicted once the total exceeds
+    `max_bytes`.
+
+    Entries are also indexed by file path, with a tree of the folders
+    containing those files, so that invalidating a path only visits the
+    entries for files at or under it.
+
+    Comparisons run in worker threads, so all access is locked.
+    """
+
+    #: Estimated size of a cache entry, excluding its file paths
+    ENTRY_BYTES = 400
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        #: Keys of the entries for each compared file
+        self.keys_by_path = {}
+        #: Paths directly inside each folder that contain, or are, files
+        #: with entries
+        self.children = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Optional[CacheResult]:
+        """Return the cached CacheResult for key, or None"""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, result: CacheResult):
+        files = key[0]
+        size = self.ENTRY_BYTES + sum(sys.getsizeof(f) for f in files)
+        with self._lock:
+            old_entry = self.entries.pop(key, None)
+            if old_entry is not None:
+                self.size -= old_entry[1]
+            if size > self.max_bytes:
+                if old_entry is not None:
+                    self._unindex(key)
+                return
+            if old_entry is None:
+                self._index(key)
+            self.entries[key] = (result, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                old_key, (_result, old_size) = self.entries.popitem(
+                    last=False)
+                self._unindex(old_key)
+                self.size -= old_size
+                self.evictions += 1
+
+    def _index(self, key):
+        for path in map(os.fspath, key[0]):
+            keys = self.keys_by_path.get(path)
+            if keys is None:
+                keys = self.keys_by_path[path] = set()
+                self._add_child(path)
+            keys.add(key)
+
+    def _unindex(self, key):
+        for path in map(os.fspath, key[0]):
+            keys = self.keys_by_path.get(path)
+            if keys is None:
+                continue
+            keys.discard(key)
+            if not keys:
+                del self.keys_by_path[path]
+                self._prune(path)
+
+    def _add_child(self, path):
+        # Link path into the folder tree, stopping at the first
+        # ancestor that's already there.
+        parent = os.path.dirname(path)
+        while parent != path:
+            children = self.children.get(parent)
+            if children is not None:
+                children.add(path)
+                return
+            self.children[parent] = {path}
+            path, parent = parent, os.path.dirname(parent)
+
+    def _prune(self, path):
+        # Unlink path, and any ancestors it leaves empty, from the tree
+        while path not in self.keys_by_path and not self.children.get(path):
+            self.children.pop(path, None)
+            parent = os.path.dirname(path)
+            siblings = self.children.get(parent)
+            if parent == path or siblings is None:
+                return
+            siblings.discard(path)
+            path = parent
+
+    def invalidate(self, paths):
+        """Drop results for any files in or under the given paths"""
+        todo = [os.fspath(p) for p in paths if p]
+        todo = [p.rstrip(os.sep) or p for p in todo]
+        with self._lock:
+            stale = set()
+            while todo:
+                path = todo.pop()
+                stale.update(self.keys_by_path.get(path, ()))
+                todo.extend(self.children.get(path, ()))
+            for key in stale:
+                _result, size = self.entries.pop(key)
+                self._unindex(key)
+                self.size -= size
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.keys_by_path.clear()
+            self.children.clear()
+            self.size = 0
+
+    def stats(self):
+        """Return a dictionary of cache usage counters"""
+        with self._lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+#: File comparison results, shared between all folder comparisons
+_cache = ComparisonCache()
 Same, SameFiltered, DodgySame, DodgyDifferent, Different, FileError = (
     list(range(6)))
 # TODO: Get the block size from os.stat
 CHUNK_SIZE = 4096
+# Block size for reading files when hashing their contents
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Content comparisons mostly wait on I/O, so we use more threads than
+# there are cores. The scan stops listing new folders while more than
+# MAX_PENDING_COMPARISONS are queued, so that it can't run far ahead.
+COMPARISON_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+MAX_PENDING_COMPARISONS = 256
+
+_comparison_pool = None
+
+
+def get_comparison_pool():
+    """Return the shared file comparison thread pool, creating it if needed"""
+    global _comparison_pool
+    if _comparison_pool is None:
+        _comparison_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=COMPARISON_WORKERS,
+            thread_name_prefix="meld-compare",
+        )
+    return _comparison_pool
 
 
 def remove_blank_lines(text):
@@ -130,7 +369,12 @@ def _files_contents(files, stats):
     return contents, mmaps, is_bin
 
 
-def _contents_same(contents, file_size):
+def _contents_same(contents, file_size, digest=None):
+    """Compare contents chunk-by-chunk, returning Different or None
+
+    If given, 'digest' is updated with each chunk as it's compared, so
+    that it holds the digest of the contents if they're the same.
+    """
     other_files_index = list(range(1, len(contents)))
     chunk_range = zip(
         range(0, file_size, CHUNK_SIZE),
@@ -142,6 +386,8 @@ def _contents_same(contents, file_size):
         for index in other_files_index:
             if not chunk == contents[index][start:end]:
                 return Different
+        if digest is not None:
+            digest.update(chunk)
 
 
 def _normalize(contents, ignore_blank_lines, regexes=()):
@@ -162,7 +408,8 @@ def _normalize(contents, ignore_blank_lines, regexes=()):
     return contents
 
 
-def _files_same(files, regexes, comparison_args):
+def _files_same(
+        files, regexes, comparison_args, stat_cache=None, digest_store=None):
     """Determine whether a list of files are the same.
 
     Possible results are:
@@ -171,13 +418,19 @@ def _files_same(files, regexes, comparison_args):
       DodgySame: The files are superficially the same (i.e., type, size, mtime)
       DodgyDifferent: The files are superficially different
       FileError: There was a problem reading one or more of the files
+
+    If given, 'stat_cache' is a StatCache used instead of stat-ing the
+    files again, and 'digest_store' is a DigestStore used to look up
+    and record the digests of file contents.
     """
 
     if all_same(files):
         return Same
 
+    stat_func = stat_cache.stat if stat_cache else os.stat
     files = tuple(files)
-    stats = tuple([StatItem._make(os.stat(f)) for f in files])
+    stat_results = [stat_func(f) for f in files]
+    stats = tuple([StatItem._make(s) for s in stat_results])
 
     shallow_comparison = comparison_args['shallow-comparison']
     time_resolution_ns = comparison_args['time-resolution']
@@ -214,6 +467,28 @@ def _files_same(files, regexes, comparison_args):
     if cache and cache.stats == stats:
         return cache.result
 
+    # For three-way rows, hash each file once instead of comparing the
+    # first file against each of the others.
+    if len(files) > 2:
+        try:
+            result = _files_same_hashed(
+                files, stat_results, same_size, need_contents,
+                ignore_blank_lines, regexes, digest_store)
+        except (MemoryError, OverflowError):
+            result = DodgySame if all_same(stats) else DodgyDifferent
+        except IOError:
+            return FileError
+        _cache.put(cache_key, CacheResult(stats, result))
+        return result
+
+    if digest_store:
+        variant = normalisation_variant(ignore_blank_lines, regexes)
+        result = _digests_same(
+            digest_store, stat_results, need_contents, variant)
+        if result is not None:
+            _cache.put(cache_key, CacheResult(stats, result))
+            return result
+
     # Open files and compare bit-by-bit
     result = None
 
@@ -223,16 +498,26 @@ def _files_same(files, regexes, comparison_args):
         try:
             contents, mmaps, is_bin = _files_contents(handles, stats)
 
-            # compare files chunk-by-chunk
+            # compare files chunk-by-chunk, hashing them as we go so
+            # that the digest can be stored if they're the same
             if same_size:
-                result = _contents_same(contents, stats[0].size)
+                digest = new_digest() if digest_store else None
+                result = _contents_same(contents, stats[0].size, digest)
+                if digest_store and result is None:
+                    digest = digest.digest()
+                    digest_store.put((s, digest) for s in stat_results)
             else:
                 result = Different
 
-            # normalize and compare files again
+            # normalize and compare files again, by their digests
             if result == Different and need_contents and not is_bin:
-                contents = _normalize(contents, ignore_blank_lines, regexes)
-                result = SameFiltered if all_same(contents) else Different
+                digests = [
+                    content_digest(c) for c in
+                    _normalize(contents, ignore_blank_lines, regexes)
+                ]
+                result = SameFiltered if all_same(digests) else Different
+                if digest_store:
+                    digest_store.put(zip(stat_results, digests), variant)
 
         # Files are too large; we can't apply filters
         except (MemoryError, OverflowError):
@@ -249,10 +534,108 @@ def _files_same(files, regexes, comparison_args):
     if result is None:
         result = Same
 
-    _cache[cache_key] = CacheResult(stats, result)
+    _cache.put(cache_key, CacheResult(stats, result))
     return result
 
 
+def _hash_file(path):
+    """Return the digest of a file's contents, read in large blocks"""
+    digest = new_digest()
+    block = bytearray(HASH_BLOCK_SIZE)
+    view = memoryview(block)
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            size = f.readinto(block)
+            if not size:
+                break
+            digest.update(view[:size])
+    return digest.digest()
+
+
+def _file_digests(files, stat_results, digest_store, variant, digest_func):
+    """Get a digest for each file, from 'digest_store' where possible
+
+    Digests that aren't stored are calculated with 'digest_func' and
+    then stored. If 'digest_func' returns None for any file, None is
+    returned without looking at the remaining files.
+    """
+    if digest_store:
+        digests = digest_store.get(stat_results, variant)
+    else:
+        digests = [None] * len(files)
+
+    new_digests = []
+    for i, path in enumerate(files):
+        if digests[i] is None:
+            digests[i] = digest_func(path)
+            if digests[i] is None:
+                return None
+            new_digests.append((stat_results[i], digests[i]))
+
+    if digest_store and new_digests:
+        digest_store.put(new_digests, variant)
+    return digests
+
+
+def _files_same_hashed(
+        files, stat_results, same_size, need_contents, ignore_blank_lines,
+        regexes, digest_store):
+    """Determine whether files are the same by comparing digests
+
+    Each file is read at most once for its raw digest and once more if
+    its normalised digest is needed, no matter how many files there
+    are. Results are as for `_files_same`.
+    """
+    if same_size:
+        digests = _file_digests(
+            files, stat_results, digest_store, RAW, _hash_file)
+        if all_same(digests):
+            return Same
+
+    if not need_contents:
+        return Different
+
+    def normalised_digest(path):
+        with open(path, "rb") as f:
+            data = f.read()
+        # Rough test to see whether files are binary.
+        if b"\0" in data[:CHUNK_SIZE]:
+            return None
+        contents, = _normalize([data], ignore_blank_lines, regexes)
+        return content_digest(contents)
+
+    variant = normalisation_variant(ignore_blank_lines, regexes)
+    digests = _file_digests(
+        files, stat_results, digest_store, variant, normalised_digest)
+    if digests is None:
+        # We don't apply filters to binary files
+        return Different
+    return SameFiltered if all_same(digests) else Different
+
+
+def _digests_same(digest_store, stat_results, need_contents, variant):
+    """Compare files using stored content digests
+
+    Returns the comparison result as for `_files_same`, or None if
+    the stored digests aren't enough to decide.
+    """
+    digests = digest_store.get(stat_results)
+    if all_same(digests) and digests[0] is not None:
+        return Same
+    if None in digests:
+        # Raw digests are only stored for files that were the same, but
+        # files of different sizes can't be.
+        if not need_contents or all_same(s.st_size for s in stat_results):
+            return None
+    elif not need_contents:
+        return Different
+
+    digests = digest_store.get(stat_results, variant)
+    if None in digests:
+        return None
+    return SameFiltered if all_same(digests) else Different
+
+
 EMBLEM_NEW = "emblem-new"
 EMBLEM_SELECTED = "emblem-default-symbolic"
 
@@ -334,6 +717,37 @@ class CanonicalListing:
         return sorted(filled(v) for v in self.items.values())
 
 
+class PendingRows(NamedTuple):
+    """File rows for a folder that are waiting on content comparisons
+
+    Each row is a (files, is_present, result) tuple, where result is
+    either a comparison result, a Future for one, or None if there was
+    nothing to compare.
+    """
+
+    parent: Gtk.TreeIter
+    roots: List[str]
+    differences: bool
+    has_dirs: bool
+    rows: List[Tuple[List[str], List[bool], typing.Any]]
+
+    def futures(self) -> List[concurrent.futures.Future]:
+        return [
+            result for _files, _present, result in self.rows
+            if isinstance(result, concurrent.futures.Future) and
+            not result.done()
+        ]
+
+    def done(self) -> bool:
+        return not self.futures()
+
+    def results(self):
+        for files, is_present, result in self.rows:
+            if isinstance(result, concurrent.futures.Future):
+                result = result.result()
+            yield files, is_present, result
+
+
 class ComparisonMarker(NamedTuple):
     """A stable row + pane marker
 
@@ -717,6 +1131,7 @@ class DirDiff(Gtk.Box, tree.TreeviewCommon, MeldDoc):
         self.state_filters = state_filters
 
         self._scan_in_progress = 0
+        self._comparison_futures = set()
 
         self.marked = None
 
@@ -732,7 +1147,8 @@ class DirDiff(Gtk.Box, tree.TreeviewCommon, MeldDoc):
             'ignore_blank_lines': self.props.ignore_blank_lines,
         }
         self.file_compare = functools.partial(
-            _files_same, comparison_args=comparison_args)
+            _files_same, comparison_args=comparison_args,
+            digest_store=get_digest_store())
         self.refresh()
 
     def update_treeview_columns(
@@ -855,6 +1271,7 @@ class DirDiff(Gtk.Box, tree.TreeviewCommon, MeldDoc):
         # is file still extant in other pane?
         it = self.model.get_iter(path)
         files = self.model.value_paths(it)
+        _cache.invalidate(files)
         is_present = [os.path.exists(f) for f in files]
         if 1 in is_present:
             self._update_item_state(it)
@@ -906,6 +1323,7 @@ class DirDiff(Gtk.Box, tree.TreeviewCommon, MeldDoc):
         self._update_item_state(child)
         self.recompute_label()
         self.scheduler.remove_all_tasks()
+        self._cancel_comparisons()
         self._scan_in_progress = 0
         self.recursively_update(Gtk.TreePath.new_first())
 
@@ -962,8 +1380,10 @@ class DirDiff(Gtk.Box, tree.TreeviewCommon, MeldDoc):
 
         yield _('[{label}] Scanning {folder}').format(
             label=self.label_text, folder='')
-        prefixlen = 1 + len(
-            self.model.value_path(self.model.get_iter(rootpath), 0))
+        root_folder = self.model.value_path(self.model.get_iter(rootpath), 0)
+        prefixlen = 1 + len(root_folder)
+        # The folder most recently scanned, for progress messages
+        folder = root_folder[prefixlen:]
         symlinks_followed = set()
         # TODO: This is horrible.
         if isinstance(rootpath, tuple):
@@ -981,8 +1401,83 @@ class DirDiff(Gtk.Box, tree.TreeviewCommon, MeldDoc):
             normalize_encoding=self.get_action_state(
                 'folder-normalize-encoding'),
         )
+        stat_cache = StatCache()
+        # Folders whose file rows are waiting on content comparisons
+        pending: List[PendingRows] = []
+
+        def is_pending(it):
+            path = self.model.get_path(it)
+            return any(self.model.get_path(p.parent) == path for p in pending)
+
+        def add_file_rows(listing):
+            it, roots, differences = (
+                listing.parent, listing.roots, listing.differences)
+            has_rows = listing.has_dirs and self.model.iter_has_child(it)
+            for curfiles, is_present, result in listing.results():
+                if not self._row_matches_state_filters(
+                        curfiles, is_present, result, stat_cache):
+                    continue
+                child = self.model.add_entries(it, curfiles)
+                differences |= self._update_item_state(
+                    child, stat_cache, comparison_result=result)
+                has_rows = True
+
+            if not has_rows:
+                # Our subtree is empty, or has been filtered to be empty
+                if (tree.STATE_NORMAL in self.state_filters or
+                        not all(stat_cache.isdir(f) for f in roots)):
+                    self.model.add_empty(it)
+                    if self.model.iter_parent(it) is None:
+                        expanded.add(tree_path_as_tuple(rootpath))
+                else:
+                    # At this point, we have an empty folder tree node; we can
+                    # prune this and any ancestors that then end up empty.
+                    # Ancestors still waiting on their own file rows are
+                    # left for those rows to deal with.
+                    while not self.model.iter_has_child(it):
+                        parent = self.model.iter_parent(it)
+
+                        # In our tree, there is always a top-level parent with
+                        # no siblings. If we're here, we have an empty tree.
+                        if parent is None:
+                            self.model.add_empty(it)
+                            break
+
+                        # Remove the current row, and then revalidate all
+                        # sibling paths on the stack by removing and
+                        # readding them.
+                        had_siblings = self.model.remove(it)
+                        if had_siblings:
+                            parent_path = self.model.get_path(parent)
+                            for path in todo:
+                                if parent_path.is_ancestor(path):
+                                    path.prev()
+
+                        it = parent
+                        if is_pending(it):
+                            break
+                    return
+
+            if differences:
+                expanded.add(tree_path_as_tuple(self.model.get_path(it)))
+
+        while todo or pending:
+            # Move any finished comparisons into the tree as a batch
+            done = [listing for listing in pending if listing.done()]
+            for listing in done:
+                pending.remove(listing)
+                add_file_rows(listing)
+
+            in_flight = sum(len(listing.futures()) for listing in pending)
+            if not todo or in_flight > MAX_PENDING_COMPARISONS:
+                if pending and not done:
+                    # Check back shortly, rather than waiting on the
+                    # comparisons here and holding up the main loop
+                    pause()
+                yield _('[{label}] Scanning {folder}').format(
+                    label=self.label_text, folder=folder)
+                continue
 
-        while len(todo):
             todo.sort()  # depth first
             path = todo.pop(0)
             it = self.model.get_iter(path)
@@ -990,11 +1485,12 @@ class DirDiff(Gtk.Box, tree.TreeviewCommon, MeldDoc):
 
             # Buggy ordering when deleting rows means that we sometimes try to
             # recursively update files; this fix seems the least invasive.
-            if not any(os.path.isdir(root) for root in roots):
+            if not any(stat_cache.isdir(root) for root in roots):
                 continue
 
+            folder = roots[0][prefixlen:]
             yield _('[{label}] Scanning {folder}').format(
-                label=self.label_text, folder=roots[0][prefixlen:])
+                label=self.label_text, folder=folder)
             differences = False
             encoding_errors = []
 
@@ -1002,11 +1498,12 @@ class DirDiff(Gtk.Box, tree.TreeviewCommon, MeldDoc):
             files = CanonicalListing(self.num_panes, comparison_options)
 
             for pane, root in enumerate(roots):
-                if not os.path.isdir(root):
+                if not stat_cache.isdir(root):
                     continue
 
                 try:
-                    entries = os.listdir(root)
+                    with os.scandir(root) as scanner:
+                        entries = list(scanner)
                 except OSError as err:
                     self.model.add_error(it, err.strerror, pane)
                     differences = True
@@ -1015,9 +1512,11 @@ class DirDiff(Gtk.Box, tree.TreeviewCommon, MeldDoc):
                 for f in self.name_filters:
                     if not f.active or f.filter is None:
                         continue
-                    entries = [e for e in entries if f.filter.match(e) is None]
+                    entries = [
+                        e for e in entries if f.filter.match(e.name) is None]
 
-                for e in entries:
+                for entry in entries:
+                    e = entry.name
                     try:
                         e.encode('utf8')
                     except UnicodeEncodeError:
@@ -1027,7 +1526,7 @@ class DirDiff(Gtk.Box, tree.TreeviewCommon, MeldDoc):
                         continue
 
                     try:
-                        s = os.lstat(os.path.join(root, e))
+                        s = stat_cache.add_entry(entry)
                     # Covers certain unreadable symlink cases; see bgo#585895
                     except OSError as err:
                         error_string = e + err.strerror
@@ -1042,7 +1541,7 @@ class DirDiff(Gtk.Box, tree.TreeviewCommon, MeldDoc):
                             continue
                         symlinks_followed.add(key)
                         try:
-                            s = os.stat(os.path.join(root, e))
+                            s = stat_cache.stat(entry.path)
                             if stat.S_ISREG(s.st_mode):
                                 files.add(pane, e)
                             elif stat.S_ISDIR(s.st_mode):
@@ -1071,56 +1570,27 @@ class DirDiff(Gtk.Box, tree.TreeviewCommon, MeldDoc):
             for pane, f in dirs.whitespace + files.whitespace:
                 whitespace_filenames.append((pane, roots[pane], f))
 
-            alldirs = self._filter_on_state(roots, dirs.get())
-            allfiles = self._filter_on_state(roots, files.get())
-
-            if alldirs or allfiles:
-                for names in alldirs:
-                    entries = [
-                        os.path.join(r, n) for r, n in zip(roots, names)]
-                    child = self.model.add_entries(it, entries)
-                    differences |= self._update_item_state(child)
-                    # Only add to todo if directory exists in multiple panes
-                    if sum(1 for e in entries if os.path.exists(e)) > 1:
-                        todo.append(self.model.get_path(child))
-                for names in allfiles:
-                    entries = [
-                        os.path.join(r, n) for r, n in zip(roots, names)]
-                    child = self.model.add_entries(it, entries)
-                    differences |= self._update_item_state(child)
-            else:
-                # Our subtree is empty, or has been filtered to be empty
-                if (tree.STATE_NORMAL in self.state_filters or
-                        not all(os.path.isdir(f) for f in roots)):
-                    self.model.add_empty(it)
-                    if self.model.iter_parent(it) is None:
-                        expanded.add(tree_path_as_tuple(rootpath))
-                else:
-                    # At this point, we have an empty folder tree node; we can
-                    # prune this and any ancestors that then end up empty.
-                    while not self.model.iter_has_child(it):
-                        parent = self.model.iter_parent(it)
-
-                        # In our tree, there is always a top-level parent with
-                        # no siblings. If we're here, we have an empty tree.
-                        if parent is None:
-                            self.model.add_empty(it)
-                            break
-
-                        # Remove the current row, and then revalidate all
-                        # sibling paths on the stack by removing and
-                        # readding them.
-                        had_siblings = self.model.remove(it)
-                        if had_siblings:
-                            parent_path = self.model.get_path(parent)
-                            for path in todo:
-                                if parent_path.is_ancestor(path):
-                                    path.prev()
-
-                        it = parent
-
-            if differences:
-                expanded.add(tree_path_as_tuple(path))
+            alldirs = self._filter_on_state(roots, dirs.get(), stat_cache)
+
+            for names in alldirs:
+                entries = [
+                    os.path.join(r, n) for r, n in zip(roots, names)]
+                child = self.model.add_entries(it, entries)
+                differences |= self._update_item_state(child, stat_cache)
+                # Only add to todo if directory exists in multiple panes
+                if sum(1 for e in entries if stat_cache.exists(e)) > 1:
+                    todo.append(self.model.get_path(child))
+
+            # File rows are only added once their contents have been
+            # compared, which happens in the comparison pool while we
+            # carry on scanning.
+            rows = [
+                [os.path.join(r, n) for r, n in zip(roots, names)]
+                for names in files.get()
+            ]
+            pending.append(PendingRows(
+                it, roots, differences, bool(alldirs),
+                self._queue_comparisons(rows, stat_cache)))
 
         duplicate_dirs = list(set(p for p in roots if roots.count(p) > 1))
         if any((invalid_filenames, shadowed_entries, whitespace_filenames)):
@@ -1284,6 +1754,7 @@ class DirDiff(Gtk.Box, tree.TreeviewCommon, MeldDoc):
                     if not os.path.exists(dstdir):
                         os.makedirs(dstdir)
                     misc.copy2(src, dstdir)
+                    _cache.invalidate([dst])
                     self.file_created(path, dst_pane)
                 elif os.path.isdir(src):
                     if os.path.exists(dst):
@@ -1309,6 +1780,7 @@ class DirDiff(Gtk.Box, tree.TreeviewCommon, MeldDoc):
                         if replace != Gtk.ResponseType.OK:
                             continue
                     misc.copytree(src, dst)
+                    _cache.invalidate([dst])
                     self.recursively_update(path)
             except (OSError, IOError, shutil.Error) as err:
                 misc.error_dialog(
@@ -1709,63 +2181,110 @@ class DirDiff(Gtk.Box, tree.TreeviewCommon, MeldDoc):
         assert pane is not None
         return self.treeview[pane].get_selection().get_selected_rows()[1]
 
-    def _filter_on_state(self, roots, fileslist):
+    def _filter_on_state(self, roots, fileslist, stat_cache=None):
         """Get state of 'files' for filtering purposes.
            Returns STATE_NORMAL, STATE_NOCHANGE, STATE_NEW or STATE_MODIFIED
 
                roots - array of root directories
                fileslist - array of filename tuples of length len(roots)
+               stat_cache - StatCache shared with the rest of the scan
         """
         ret = []
         regexes = [f.byte_filter for f in self.text_filters if f.active]
+        stat_cache = stat_cache or StatCache()
         for files in fileslist:
             curfiles = [os.path.join(r, f) for r, f in zip(roots, files)]
-            is_present = [os.path.exists(f) for f in curfiles]
-            if all(is_present):
-                comparison_result = self.file_compare(curfiles, regexes)
-                if comparison_result in (Same, DodgySame):
-                    states = {tree.STATE_NORMAL}
-                elif comparison_result == SameFiltered:
-                    states = {tree.STATE_NOCHANGE}
-                else:
-                    states = {tree.STATE_MODIFIED}
-            elif is_present.count(True) > 1:
-                # In a three-way comparison, we can have files in e.g., pane
-                # 1 and 2 be different to each other, and there be no file in
-                # pane 3. This row should be considered both modified (1 -> 2)
-                # and new (2 -> 3).
-                curfiles = [
-                    f for f, exists in zip(curfiles, is_present) if exists
-                ]
-                comparison_result = self.file_compare(curfiles, regexes)
-                if comparison_result in (Same, DodgySame, SameFiltered):
-                    states = {tree.STATE_NEW}
-                else:
-                    states = {tree.STATE_NEW, tree.STATE_MODIFIED}
-            else:
-                states = {tree.STATE_NEW}
-            # Always retain NORMAL folders for comparison; we remove these
-            # later if they have no children.
-            all_folders = all(os.path.isdir(f) for f in curfiles)
-            states_match_filters = bool(states & set(self.state_filters))
-            if states_match_filters or all_folders:
+            is_present = [stat_cache.exists(f) for f in curfiles]
+            comparison_result = self._compare_row(
+                curfiles, is_present, regexes, stat_cache)
+            if self._row_matches_state_filters(
+                    curfiles, is_present, comparison_result, stat_cache):
                 ret.append(files)
         return ret
 
-    def _update_item_state(self, it):
+    def _compare_row(self, curfiles, is_present, regexes, stat_cache):
+        """Compare the files present in a row
+
+        Returns None if fewer than two files are present. This is
+        called from the comparison pool, so mustn't touch the UI.
+        """
+        curfiles = [f for f, exists in zip(curfiles, is_present) if exists]
+        if len(curfiles) < 2:
+            return None
+        return self.file_compare(curfiles, regexes, stat_cache=stat_cache)
+
+    def _queue_comparisons(self, rows, stat_cache):
+        """Start comparing the file rows 'rows' in the comparison pool
+
+        Returns a list of (files, is_present, result) tuples, as used
+        by PendingRows.
+        """
+        pool = get_comparison_pool()
+        regexes = [f.byte_filter for f in self.text_filters if f.active]
+        queued = []
+        for curfiles in rows:
+            is_present = [stat_cache.exists(f) for f in curfiles]
+            result = None
+            if is_present.count(True) > 1:
+                result = pool.submit(
+                    self._compare_row, curfiles, is_present, regexes,
+                    stat_cache)
+                self._comparison_futures.add(result)
+                result.add_done_callback(self._comparison_futures.discard)
+            queued.append((curfiles, is_present, result))
+        return queued
+
+    def _cancel_comparisons(self):
+        for future in list(self._comparison_futures):
+            future.cancel()
+
+    def _row_matches_state_filters(
+            self, curfiles, is_present, comparison_result, stat_cache):
+        if all(is_present):
+            if comparison_result in (Same, DodgySame):
+                states = {tree.STATE_NORMAL}
+            elif comparison_result == SameFiltered:
+                states = {tree.STATE_NOCHANGE}
+            else:
+                states = {tree.STATE_MODIFIED}
+        elif is_present.count(True) > 1:
+            # In a three-way comparison, we can have files in e.g., pane
+            # 1 and 2 be different to each other, and there be no file in
+            # pane 3. This row should be considered both modified (1 -> 2)
+            # and new (2 -> 3).
+            curfiles = [
+                f for f, exists in zip(curfiles, is_present) if exists
+            ]
+            if comparison_result in (Same, DodgySame, SameFiltered):
+                states = {tree.STATE_NEW}
+            else:
+                states = {tree.STATE_NEW, tree.STATE_MODIFIED}
+        else:
+            states = {tree.STATE_NEW}
+        # Always retain NORMAL folders for comparison; we remove these
+        # later if they have no children.
+        all_folders = all(stat_cache.isdir(f) for f in curfiles)
+        return bool(states & set(self.state_filters)) or all_folders
+
+    def _update_item_state(self, it, stat_cache=None, comparison_result=None):
         """Update the state of a tree row
 
         All changes and updates to tree rows should happen here;
         structural changes happen elsewhere, but they only delete rows
         or add new rows with path information. This function is the
         only place where row details are changed.
+
+        If the row is being updated as part of a scan, 'stat_cache'
+        should be that scan's StatCache. If the files present in the row
+        have already been compared, 'comparison_result' is the result.
         """
         files = self.model.value_paths(it)
         regexes = [f.byte_filter for f in self.text_filters if f.active]
+        stat_cache = stat_cache or StatCache()
 
         def none_stat(f):
             try:
-                return os.stat(f)
+                return stat_cache.stat(f)
             except OSError:
                 return None
         stats = [none_stat(f) for f in files[:self.num_panes]]
@@ -1775,7 +2294,7 @@ class DirDiff(Gtk.Box, tree.TreeviewCommon, MeldDoc):
 
         def none_lstat(f):
             try:
-                return os.lstat(f)
+                return stat_cache.lstat(f)
             except OSError:
                 return None
 
@@ -1804,13 +2323,16 @@ class DirDiff(Gtk.Box, tree.TreeviewCommon, MeldDoc):
         else:
             newest = {i for i, t in enumerate(times) if t == newest_time}
 
+        if comparison_result is None:
+            present = [f for f, s in zip(files, stats) if s]
+            comparison_result = self.file_compare(
+                present, regexes, stat_cache=stat_cache)
         if all(stats):
-            all_same = self.file_compare(files, regexes)
+            all_same = comparison_result
             all_present_same = all_same
         else:
-            lof = [f for f, time in zip(files, times) if time]
             all_same = Different
-            all_present_same = self.file_compare(lof, regexes)
+            all_present_same = comparison_result
 
         # TODO: Differentiate the DodgySame case
         if all_same == Same or all_same == DodgySame:
@@ -1827,7 +2349,7 @@ class DirDiff(Gtk.Box, tree.TreeviewCommon, MeldDoc):
             state = tree.STATE_MODIFIED
         different = state not in {tree.STATE_NORMAL, tree.STATE_NOCHANGE}
 
-        isdir = [os.path.isdir(files[j]) for j in range(self.model.ntree)]
+        isdir = [stat_cache.isdir(files[j]) for j in range(self.model.ntree)]
         for j in range(self.model.ntree):
             if stats[j]:
                 self.model.set_path_state(
@@ -1891,6 +2413,7 @@ class DirDiff(Gtk.Box, tree.TreeviewCommon, MeldDoc):
     def refresh(self):
         debug_print("Starting directory view refresh")
         start_time = time.time()
+        log.debug("Folder comparison cache: %s", _cache.stats())
         self.model.clear()
         self.row_expansions.clear()
         self.marked = None
@@ -1937,6 +2460,7 @@ class DirDiff(Gtk.Box, tree.TreeviewCommon, MeldDoc):
         """
         model = self.model
         changed_paths = []
+        _cache.invalidate([changed_filename])
         # search each panes tree for changed_filename
         for pane in range(self.num_panes):
             it = model.get_iter_first()
@@ -2000,6 +2524,7 @@ class DirDiff(Gtk.Box, tree.TreeviewCommon, MeldDoc):
         self.refresh()
 
     def on_delete_event(self):
+        self._cancel_comparisons()
         meld_settings = get_meld_settings()
         for h in self.settings_handlers:
             meld_settings.disconnect(h)
@@ -14,8 +14,10 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import bisect
 import copy
 import functools
+import itertools
 import logging
 import math
 import time
@@ -39,12 +41,13 @@ from meld.externalhelpers import open_files_external
 from meld.gutterrendererchunk import GutterRendererChunkLines
 from meld.iohelpers import find_shared_parent_path, prompt_save_filename
 from meld.matchers.diffutil import Differ, merged_chunk_order
-from meld.matchers.helpers import CachedSequenceMatcher
+from meld.matchers.helpers import CachedSequenceMatcher, highlight_ranges
 from meld.matchers.merge import AutoMergeDiffer, Merger
 from meld.meldbuffer import (
     BufferDeletionAction,
     BufferInsertionAction,
     BufferLines,
+    FilteredBufferLines,
     MeldBufferState,
 )
 from meld.melddoc import ComparisonState, MeldDoc
@@ -52,7 +55,7 @@ from meld.menuhelpers import replace_menu_section
 from meld.misc import user_critical, with_focused_pane
 from meld.patchdialog import PatchDialog
 from meld.recent import RecentType
-from meld.settings import bind_settings, get_meld_settings
+from meld.settings import bind_settings, get_meld_settings, settings
 from meld.sourceview import (
     LanguageManager,
     TextviewLineAnimationType,
@@ -125,6 +128,11 @@ PANE_LEFT, PANE_RIGHT = -1, +1
 LOAD_PROGRESS_MARK = "meld-load-progress"
 #: Line length at which we'll cancel loads because of potential hangs
 LINE_LENGTH_LIMIT = 8 * 1024
+#: Time in seconds after which a comparison falls back to an approximate
+#: result, if speed-large-files is enabled
+DIFF_TIME_LIMIT = 5
+#: Number of inline highlight ranges tagged per main loop iteration
+INLINE_TAG_BATCH_SIZE = 500
 
 class CursorDetails:
     __slots__ = (
@@ -152,6 +160,8 @@ class FileDiff(Gtk.Box, MeldDoc):
 
     __gsettings_bindings_view__ = (
         ('ignore-blank-lines', 'ignore-blank-lines'),
+        ('speed-large-files', 'speed-large-files'),
+        ('diff-algorithm', 'diff-algorithm'),
         ('show-overview-map', 'show-overview-map'),
         ('overview-map-style', 'overview-map-style'),
     )
@@ -162,6 +172,18 @@ class FileDiff(Gtk.Box, MeldDoc):
         blurb="Whether to ignore blank lines when comparing file contents",
         default=False,
     )
+    speed_large_files = GObject.Property(
+        type=bool,
+        nick="Speed large files",
+        blurb="Whether to approximate comparisons that take too long",
+        default=False,
+    )
+    diff_algorithm = GObject.Property(
+        type=str,
+        nick="Comparison algorithm",
+        blurb="The algorithm used to compare file contents",
+        default="myers",
+    )
     show_overview_map = GObject.Property(type=bool, default=True)
     overview_map_style = GObject.Property(type=str, default='chunkmap')
 
@@ -231,10 +253,11 @@ class FileDiff(Gtk.Box, MeldDoc):
     }
 
     # Identifiers for MsgArea messages
-    (MSG_SAME, MSG_SLOW_HIGHLIGHT, MSG_SYNCPOINTS) = list(range(3))
+    (MSG_SAME, MSG_SLOW_HIGHLIGHT, MSG_SYNCPOINTS,
+     MSG_APPROXIMATE) = list(range(4))
     # Transient messages that should be removed if any file in the
     # comparison gets reloaded.
-    TRANSIENT_MESSAGES = {MSG_SAME, MSG_SLOW_HIGHLIGHT}
+    TRANSIENT_MESSAGES = {MSG_SAME, MSG_SLOW_HIGHLIGHT, MSG_APPROXIMATE}
 
     __gsignals__ = {
         'next-conflict-changed': (
@@ -303,7 +326,10 @@ class FileDiff(Gtk.Box, MeldDoc):
                 "text-filters-changed", self.on_text_filters_changed)
         ]
         self.buffer_filtered = [
-            BufferLines(b, self._filter_text) for b in self.textbuffer
+            FilteredBufferLines(
+                lines, self._filter_text, bulk_textfilter=self._filter_lines,
+                active=self._text_filters_active)
+            for lines in self.buffer_texts
         ]
         for (i, w) in enumerate(self.scrolledwindow):
             w.get_vadjustment().connect("value-changed", self._sync_vscroll, i)
@@ -319,7 +345,15 @@ class FileDiff(Gtk.Box, MeldDoc):
 
         self.syncpoints = Syncpoints(num_panes, get_mark_line)
         self.in_nested_textview_gutter_expose = False
-        self._cached_match = CachedSequenceMatcher(self.scheduler)
+        #: Lines of the middle pane currently shown, used to prioritise
+        #: inline highlighting of on-screen chunks
+        self._inline_visible_lines = (0, 0)
+        self._cached_match = CachedSequenceMatcher(
+            self.scheduler, settings.get_int('inline-matcher-workers'),
+            priority_func=self._inline_highlight_priority)
+        #: Scheduled inline tagging tasks, as
+        #: task -> (pane, buffers, start marks)
+        self._inline_tag_tasks = {}
 
         # Set up property actions for statusbar toggles
         sourceview_prop_actions = [
@@ -341,6 +375,7 @@ class FileDiff(Gtk.Box, MeldDoc):
         property_actions = (
             ('show-overview-map', self, 'show-overview-map'),
             ('lock-scrolling', self, 'lock_scrolling'),
+            ('diff-algorithm', self, 'diff-algorithm'),
         )
         for action_name, obj, prop_name in property_actions:
             action = Gio.PropertyAction.new(action_name, obj, prop_name)
@@ -534,6 +569,7 @@ class FileDiff(Gtk.Box, MeldDoc):
             t.line_renderer = renderer
 
         self.connect("notify::ignore-blank-lines", self.refresh_comparison)
+        self.connect("notify::diff-algorithm", self.refresh_comparison)
 
     def do_realize(self):
         Gtk.Box().do_realize(self)
@@ -1202,6 +1238,9 @@ class FileDiff(Gtk.Box, MeldDoc):
                 self.on_cursor_position_changed(self.textbuffer[focused_pane],
                                                 None, True)
 
+    def _text_filters_active(self):
+        return any(f.filter for f in self.text_filters if f.active)
+
     def _filter_text(self, txt, buf, txt_start_iter, txt_end_iter):
         dimmed_tag = buf.get_tag_table().lookup("dimmed")
         buf.remove_tag(dimmed_tag, txt_start_iter, txt_end_iter)
@@ -1229,6 +1268,67 @@ class FileDiff(Gtk.Box, MeldDoc):
 
         return txt
 
+    def _filter_lines(self, lines, buf, first_line):
+        """Filter a run of lines, as `_filter_text` does for one line
+
+        Filters are run over the text of all lines at once. Lines with
+        a filter match that spans a line break are filtered one by one
+        instead, as filters never match across lines then.
+        """
+        dimmed_tag = buf.get_tag_table().lookup("dimmed")
+        start = buf.get_iter_at_line_or_eof(first_line)
+        end = buf.get_iter_at_line_or_eof(first_line + len(lines) - 1)
+        if not end.ends_line():
+            end.forward_to_line_end()
+        buf.remove_tag(dimmed_tag, start, end)
+
+        regexes = [f.filter for f in self.text_filters if f.active]
+        if not any(regexes):
+            return lines
+        filter_ranges = misc.text_filter_ranges("\n".join(lines), regexes)
+        if not filter_ranges:
+            return lines
+
+        line_starts = [0, *itertools.accumulate(len(t) + 1 for t in lines)]
+        line_ranges = {}
+        multiline = set()
+        for range_start, range_end in filter_ranges:
+            line = bisect.bisect_right(line_starts, range_start) - 1
+            offset = line_starts[line]
+            if range_end > offset + len(lines[line]):
+                last = bisect.bisect_right(line_starts, range_end - 1) - 1
+                multiline.update(range(line, last + 1))
+                continue
+            line_ranges.setdefault(line, []).append(
+                (range_start - offset, range_end - offset))
+
+        filtered = list(lines)
+        for line, ranges in line_ranges.items():
+            if line in multiline:
+                continue
+            txt = lines[line]
+            kept = []
+            offset = 0
+            for range_start, range_end in ranges:
+                buf.apply_tag(
+                    dimmed_tag,
+                    buf.get_iter_at_line_offset(
+                        first_line + line, range_start),
+                    buf.get_iter_at_line_offset(first_line + line, range_end))
+                kept.append(txt[offset:range_start])
+                offset = range_end
+            kept.append(txt[offset:])
+            filtered[line] = "".join(kept)
+
+        for line in multiline:
+            line_start = buf.get_iter_at_line(first_line + line)
+            line_end = line_start.copy()
+            if not line_end.ends_line():
+                line_end.forward_to_line_end()
+            filtered[line] = self._filter_text(
+                lines[line], buf, line_start, line_end)
+        return filtered
+
     def after_text_insert_text(self, buf, it, newtext, textlen):
         start_mark = buf.get_mark("insertion-start")
         starting_at = buf.get_iter_at_mark(start_mark).get_line()
@@ -1329,8 +1429,12 @@ class FileDiff(Gtk.Box, MeldDoc):
             for buf in self.textbuffer:
                 buf.data.disconnect_monitor()
 
+            self.linediffer.cancel_background_match()
+
             try:
                 debug_print("Stopping cached match")
+                debug_print(
+                    f"Inline match cache: {self._cached_match.cache.stats()}")
                 match_start = time.time()
                 self._cached_match.stop()
                 self._cached_match = None
@@ -1612,6 +1716,9 @@ class FileDiff(Gtk.Box, MeldDoc):
         for buf in self.textbuffer:
             tag = buf.get_tag_table().lookup("inline")
             buf.remove_tag(tag, buf.get_start_iter(), buf.get_end_iter())
+            # Filtered lines are dimmed again as they're refiltered
+            tag = buf.get_tag_table().lookup("dimmed")
+            buf.remove_tag(tag, buf.get_start_iter(), buf.get_end_iter())
 
         for mgr in self.msgarea_mgr:
             if mgr.get_msg_id() in self.TRANSIENT_MESSAGES:
@@ -1902,9 +2009,38 @@ class FileDiff(Gtk.Box, MeldDoc):
         yield _("[%s] Computing differences") % self.label_text
         texts = self.buffer_filtered[:self.num_panes]
         self.linediffer.ignore_blanks = self.props.ignore_blank_lines
-        step = self.linediffer.set_sequences_iter(texts)
-        while next(step) is None:
-            yield 1
+        self.linediffer.algorithm = self.props.diff_algorithm
+        self.linediffer.time_limit = (
+            DIFF_TIME_LIMIT if self.props.speed_large_files else None)
+        step = self.linediffer.set_sequences_iter(
+            texts, background=True, stream=True)
+        shown_progress = None
+        shown_chunks = 0
+        for result in step:
+            if result is not None:
+                break
+            # Chunks for the start of the files may be ready before the
+            # rest; the chunk map and gutters update themselves, but the
+            # link maps and text views need redrawing.
+            if self.linediffer.diff_count() != shown_chunks:
+                shown_chunks = self.linediffer.diff_count()
+                self.queue_draw()
+            # Show which pair is being matched in the background
+            progress = self.linediffer.pairs_matched
+            if progress != shown_progress and \
+                    progress is not None and progress < self.num_panes - 1:
+                shown_progress = progress
+                yield _("[%s] Computing differences (%d of %d)") % (
+                    self.label_text, progress + 1, self.num_panes - 1)
+            else:
+                yield 1
+        else:
+            # Matching was cancelled, because the files are being
+            # reloaded or the comparison closed
+            return
+
+        if self.linediffer.approximate:
+            self._show_approximate_message()
 
         if not refresh:
             for buf in self.textbuffer:
@@ -1998,6 +2134,97 @@ class FileDiff(Gtk.Box, MeldDoc):
 
         self.set_action_enabled('merge-all', mergeable[0] or mergeable[1])
 
+    def _inline_highlight_priority(self, key):
+        # Keys are (pane, chunk), with the chunk's a-side in the middle
+        # pane. Visible chunks come first, then by distance from view.
+        _pane, chunk = key
+        first, last = self._inline_visible_lines
+        if chunk[2] < first:
+            return first - chunk[2]
+        if chunk[1] > last:
+            return chunk[1] - last
+        return 0
+
+    def _update_inline_visible_lines(self):
+        if self.num_panes < 2 or self._cached_match is None:
+            return
+        textview = self.textview[1]
+        area = textview.get_visible_rect()
+        first = textview.get_line_at_y(area.y).target_iter.get_line()
+        last = textview.get_line_at_y(
+            area.y + area.height).target_iter.get_line()
+        if (first, last) != self._inline_visible_lines:
+            self._inline_visible_lines = (first, last)
+            self._cached_match.reprioritise()
+
+    def _queue_inline_tags(self, pane, bufs, tags, starts, ranges):
+        """Schedule inline highlight ranges to be tagged in batches
+
+        :param pane: the pane the middle pane's chunk is compared with;
+            any earlier tagging for the same chunk is cancelled
+        :param starts: iters at the start of the chunk in each buffer,
+            from which the range offsets are counted
+        :param ranges: a pair of (start, end) offset lists, as given by
+            `highlight_ranges`
+        """
+        self._cancel_inline_tags(pane, starts[0].get_line())
+        marks = [buf.create_mark(None, start, True)
+                 for buf, start in zip(bufs, starts)]
+
+        def apply_tags():
+            for i in range(2):
+                side = ranges[i]
+                for batch in range(0, len(side), INLINE_TAG_BATCH_SIZE):
+                    self._apply_inline_tag_batch(
+                        bufs[i], tags[i], marks[i],
+                        side[batch:batch + INLINE_TAG_BATCH_SIZE])
+                    yield 1
+            del self._inline_tag_tasks[task]
+            for buf, mark in zip(bufs, marks):
+                buf.delete_mark(mark)
+
+        task = apply_tags()
+        self._inline_tag_tasks[task] = (pane, bufs, marks)
+        # Run ahead of the inline match result polling, which otherwise
+        # keeps the front of the queue until every match is finished
+        self.scheduler.add_task(task, atfront=True)
+
+    def _cancel_inline_tags(self, pane, line):
+        """Cancel tagging of the chunk starting at line of the middle pane
+
+        Tasks are found by their start marks rather than by chunk, so
+        that chunks moved by edits above them are still found.
+        """
+        for task, (task_pane, bufs, marks) in list(
+                self._inline_tag_tasks.items()):
+            if task_pane != pane:
+                continue
+            if bufs[0].get_iter_at_mark(marks[0]).get_line() != line:
+                continue
+            del self._inline_tag_tasks[task]
+            self.scheduler.remove_task(task)
+            for buf, mark in zip(bufs, marks):
+                buf.delete_mark(mark)
+
+    @performance_monitor
+    def _apply_inline_tag_batch(self, buf, tag, mark, ranges):
+        start = buf.get_iter_at_mark(mark)
+        end = start.copy()
+        offset = start.get_offset()
+        for start_offset, end_offset in ranges:
+            start.set_offset(offset + start_offset)
+            end.set_offset(offset + end_offset)
+
+            # Check whether the identified difference is just a
+            # combining diacritic. If so, we want to highlight
+            # the visual character it's a part of
+            if not start.is_cursor_position():
+                start.backward_cursor_position()
+            if not end.is_cursor_position():
+                end.forward_cursor_position()
+
+            buf.apply_tag(tag, start, end)
+
     @performance_monitor
     def on_diffs_changed(self, linediffer, chunk_changes):
         debug_print("Diffs changed")
@@ -2023,6 +2250,7 @@ class FileDiff(Gtk.Box, MeldDoc):
             list(added_chunks) + [modified_chunks], key=merged_chunk_order)
 
         alltags = [b.get_tag_table().lookup("inline") for b in self.textbuffer]
+        self._update_inline_visible_lines()
 
         for chunks in need_clearing:
             for i, chunk in enumerate(chunks):
@@ -2034,6 +2262,9 @@ class FileDiff(Gtk.Box, MeldDoc):
 
                 bufs[0].remove_tag(tags[0], *chunk.to_iters(buffer_a=bufs[0]))
                 bufs[1].remove_tag(tags[1], *chunk.to_iters(buffer_b=bufs[1]))
+                # Don't spend time highlighting chunks that no longer exist
+                self._cached_match.cancel((to_idx, tuple(chunk)))
+                self._cancel_inline_tags(to_idx, chunk.start_a)
 
         for chunks in need_highlighting:
             clear = chunks == modified_chunks
@@ -2052,8 +2283,10 @@ class FileDiff(Gtk.Box, MeldDoc):
                 text1 = bufs[0].get_text(*buf_from_iters, False)
                 textn = bufs[1].get_text(*buf_to_iters, False)
 
-                # Bail on long sequences, rather than try a slow comparison
-                inline_limit = 20000
+                # Bail on very long sequences, rather than try a slow
+                # comparison. Long texts are compared word by word first,
+                # so this can be much higher than a character-level limit.
+                inline_limit = 2000000
                 if len(text1) + len(textn) > inline_limit and \
                         not self.force_highlight:
 
@@ -2062,6 +2295,12 @@ class FileDiff(Gtk.Box, MeldDoc):
                     self._prompt_long_highlighting()
                     continue
 
+                def delete_marks(bufs, start_marks, end_marks):
+                    bufs[0].delete_mark(start_marks[0])
+                    bufs[0].delete_mark(end_marks[0])
+                    bufs[1].delete_mark(start_marks[1])
+                    bufs[1].delete_mark(end_marks[1])
+
                 def apply_highlight(
                         bufs, tags, start_marks, end_marks, texts, to_pane,
                         chunk, matches):
@@ -2070,10 +2309,7 @@ class FileDiff(Gtk.Box, MeldDoc):
                     ends = [bufs[0].get_iter_at_mark(end_marks[0]),
                             bufs[1].get_iter_at_mark(end_marks[1])]
 
-                    bufs[0].delete_mark(start_marks[0])
-                    bufs[0].delete_mark(end_marks[0])
-                    bufs[1].delete_mark(start_marks[1])
-                    bufs[1].delete_mark(end_marks[1])
+                    delete_marks(bufs, start_marks, end_marks)
 
                     if not self.linediffer.has_chunk(to_pane, chunk):
                         return
@@ -2088,42 +2324,12 @@ class FileDiff(Gtk.Box, MeldDoc):
                         bufs[0].remove_tag(tags[0], starts[0], ends[0])
                         bufs[1].remove_tag(tags[1], starts[1], ends[1])
 
-                    offsets = [ends[0].get_offset() - starts[0].get_offset(),
-                               ends[1].get_offset() - starts[1].get_offset()]
-
-                    def process_matches(match):
-                        if match.tag != "equal":
-                            return True
-                        # Always keep matches occurring at the start or end
-                        is_start = match.start_a == 0 and match.start_b == 0
-                        is_end = (
-                            match.end_a == offsets[0] and
-                            match.end_b == offsets[1])
-                        if is_start or is_end:
-                            return False
-                        # Remove equal matches of size less than 3
-                        too_short = ((match.end_a - match.start_a < 3) or
-                                     (match.end_b - match.start_b < 3))
-                        return too_short
-
-                    matches = [m for m in matches if process_matches(m)]
-
-                    for i in range(2):
-                        start, end = starts[i].copy(), starts[i].copy()
-                        offset = start.get_offset()
-                        for o in matches:
-                            start.set_offset(offset + o[1 + 2 * i])
-                            end.set_offset(offset + o[2 + 2 * i])
-
-                            # Check whether the identified difference is just a
-                            # combining diacritic. If so, we want to highlight
-                            # the visual character it's a part of
-                            if not start.is_cursor_position():
-                                start.backward_cursor_position()
-                            if not end.is_cursor_position():
-                                end.forward_cursor_position()
-
-                            bufs[i].apply_tag(tags[i], start, end)
+                    ranges = highlight_ranges(
+                        matches,
+                        ends[0].get_offset() - starts[0].get_offset(),
+                        ends[1].get_offset() - starts[1].get_offset())
+                    self._queue_inline_tags(
+                        to_pane, bufs, tags, starts, ranges)
 
                 start_marks = [
                     bufs[0].create_mark(None, buf_from_iters[0], True),
@@ -2136,9 +2342,12 @@ class FileDiff(Gtk.Box, MeldDoc):
                 match_cb = functools.partial(
                     apply_highlight, bufs, tags, start_marks, end_marks, (text1, textn),
                     to_pane, chunk)
-                self._cached_match.match(text1, textn, match_cb)
-
-        self._cached_match.clean(self.linediffer.diff_count())
+                cancel_cb = functools.partial(
+                    delete_marks, bufs, start_marks, end_marks)
+                self._cancel_inline_tags(to_pane, chunk.start_a)
+                self._cached_match.match(
+                    text1, textn, match_cb, key=(to_pane, tuple(chunk)),
+                    cancel_cb=cancel_cb)
 
         self._set_merge_action_sensitivity()
 
@@ -2241,6 +2450,17 @@ class FileDiff(Gtk.Box, MeldDoc):
                             on_msgarea_highlighting_response)
             msgarea.show_all()
 
+    def _show_approximate_message(self):
+        for mgr in self.msgarea_mgr[:self.num_panes]:
+            mgr.add_dismissable_msg(
+                'dialog-information-symbolic',
+                _("Differences are approximate"),
+                _("These files took too long to compare exactly, so some "
+                  "changes may be shown as larger than they really are."),
+                self.msgarea_mgr,
+            )
+            mgr.set_msg_id(FileDiff.MSG_APPROXIMATE)
+
     def on_msgarea_identical_response(self, msgarea, respid):
         for mgr in self.msgarea_mgr:
             mgr.clear()
@@ -2555,6 +2775,8 @@ class FileDiff(Gtk.Box, MeldDoc):
         for gutter in self.actiongutter:
             gutter.queue_draw()
 
+        self._update_inline_visible_lines()
+
     def set_num_panes(self, n):
         if n == self.num_panes or n not in (1, 2, 3):
             return
@@ -0,0 +1,448 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compact storage for large numbers of diff chunks
+
+Chunks are stored as a struct of arrays (a tag code and four line
+bounds per chunk) rather than as individual `DiffChunk` tuples. Callers
+get `ChunkView` objects that behave like read-only `DiffChunk`s, and
+that can present a chunk with its two sides swapped without copying it.
+"""
+
+import bisect
+from array import array
+
+from meld.matchers.myers import DiffChunk
+
+TAGS = ("equal", "replace", "insert", "delete", "conflict")
+TAG_CODES = {tag: code for code, tag in enumerate(TAGS)}
+#: Tag code used for empty slots in a `ChunkArray`
+NO_CHUNK = -1
+
+# Tag codes of each chunk type when seen from the other side
+REVERSED_TAG_CODES = tuple(
+    TAG_CODES[tag] for tag in
+    ("equal", "replace", "delete", "insert", "conflict")
+)
+
+
+class ChunkView:
+    """A read-only view of a single chunk in a `ChunkArray`
+
+    Views support the same attribute, index and unpacking access as
+    `DiffChunk`, and compare and hash equal to the equivalent tuple. A
+    reversed view swaps the a and b sides of its chunk, as for
+    `reverse_chunk`.
+
+    Views reference their array rather than copying the chunk, so they
+    should only be kept for arrays that are not modified afterwards.
+    The merge cache is modified in place, so `Differ` copies chunks
+    into `DiffChunk`s before handing them out.
+    """
+
+    __slots__ = ("store", "index", "reverse")
+
+    def __init__(self, store, index, reverse=False):
+        self.store = store
+        self.index = index
+        self.reverse = reverse
+
+    @property
+    def tag(self):
+        code = self.store.tags[self.index]
+        if self.reverse:
+            code = REVERSED_TAG_CODES[code]
+        return TAGS[code]
+
+    @property
+    def start_a(self):
+        store = self.store
+        return (store.start_b if self.reverse else store.start_a)[self.index]
+
+    @property
+    def end_a(self):
+        store = self.store
+        return (store.end_b if self.reverse else store.end_a)[self.index]
+
+    @property
+    def start_b(self):
+        store = self.store
+        return (store.start_a if self.reverse else store.start_b)[self.index]
+
+    @property
+    def end_b(self):
+        store = self.store
+        return (store.end_a if self.reverse else store.end_b)[self.index]
+
+    def __len__(self):
+        return 5
+
+    def __iter__(self):
+        yield self.tag
+        yield self.start_a
+        yield self.end_a
+        yield self.start_b
+        yield self.end_b
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return tuple(self)[index]
+        return getattr(self, DiffChunk._fields[index])
+
+    def __eq__(self, other):
+        if isinstance(other, (ChunkView, tuple)):
+            return tuple(self) == tuple(other)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return repr(DiffChunk._make(self))
+
+    def to_iters(self, *, buffer_a=None, buffer_b=None):
+        return DiffChunk.to_iters(self, buffer_a=buffer_a, buffer_b=buffer_b)
+
+
+class OffsetArray:
+    """An array of ints with lazily applied offsets
+
+    Offsetting every value from some index onwards only records a
+    breakpoint, so shifting the tail of a large array after an edit is
+    cheap. Stored values are only rewritten once too many breakpoints
+    have built up.
+
+    This isn't a logarithmic structure: a shift costs O(breakpoints),
+    and every `max_points` shifts the values are rewritten in O(n).
+    Values are kept in a contiguous array because slices are also
+    replaced as chunks are added and removed, which a Fenwick tree
+    can't do, and which costs an O(n) move of the array tail anyway.
+    The breakpoints only save rewriting every later value in Python on
+    each edit.
+    """
+
+    __slots__ = ("values", "points", "offsets")
+
+    #: Number of breakpoints after which offsets are applied in bulk
+    max_points = 32
+
+    def __init__(self, values=()):
+        self.values = array("i", values)
+        #: Sorted indices at which the offset changes
+        self.points = []
+        #: Offset applying from each breakpoint up to the next one
+        self.offsets = []
+
+    def offset_at(self, index):
+        j = bisect.bisect_right(self.points, index) - 1
+        return self.offsets[j] if j >= 0 else 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def __eq__(self, other):
+        if isinstance(other, (OffsetArray, list)):
+            return self.tolist() == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "OffsetArray(%r)" % self.tolist()
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.values)
+        value = self.values[index]
+        if self.points:
+            value += self.offset_at(index)
+        return value
+
+    def __setitem__(self, index, values):
+        """Replace a slice with new values, keeping later offsets"""
+        lo, hi, step = index.indices(len(self.values))
+        if step != 1:
+            raise ValueError("only contiguous slices can be assigned")
+        hi = max(lo, hi)
+        values = list(values)
+        new_hi = lo + len(values)
+        if self.points:
+            # Breakpoints inside the slice now apply from its end, and
+            # later breakpoints move with the values they apply to.
+            points = [
+                p + new_hi - hi if p > hi else new_hi if p > lo else p
+                for p in self.points
+            ]
+            # Only the last of any duplicate breakpoints has any effect
+            keep = [
+                j for j in range(len(points))
+                if j + 1 == len(points) or points[j] != points[j + 1]
+            ]
+            self.points = [points[j] for j in keep]
+            self.offsets = [self.offsets[j] for j in keep]
+            values = [v - self.offset_at(i) for i, v in enumerate(values, lo)]
+        self.values[lo:hi] = array("i", values)
+
+    def append(self, value):
+        if self.points:
+            value -= self.offset_at(len(self.values))
+        self.values.append(value)
+
+    def shift(self, start, offset):
+        """Add offset to every value from start onwards"""
+        if not offset or start >= len(self.values):
+            return
+        j = bisect.bisect_left(self.points, start)
+        if j == len(self.points) or self.points[j] != start:
+            self.points.insert(j, start)
+            self.offsets.insert(j, self.offsets[j - 1] if j else 0)
+        for k in range(j, len(self.offsets)):
+            self.offsets[k] += offset
+        if len(self.points) > self.max_points:
+            self.flatten()
+
+    def flatten(self):
+        """Apply all pending offsets to the stored values"""
+        values = self.values
+        ends = self.points[1:] + [len(values)]
+        for lo, hi, offset in zip(self.points, ends, self.offsets):
+            if offset:
+                values[lo:hi] = array("i", [v + offset for v in values[lo:hi]])
+        self.points = []
+        self.offsets = []
+
+    def tolist(self, lo=0, hi=None):
+        """Return the values from lo to hi as a list"""
+        if hi is None:
+            hi = len(self.values)
+        values = self.values[lo:hi].tolist()
+        if self.points:
+            values = [v + self.offset_at(i) for i, v in enumerate(values, lo)]
+        return values
+
+
+class ChunkArray:
+    """A sequence of chunks, stored as parallel arrays
+
+    Slots may be empty (i.e., None), so that an array can hold one side
+    of a list of merged chunk pairs. Line bounds are held in
+    `OffsetArray`s, so that all chunks after an edit can be offset
+    without rewriting them.
+    """
+
+    __slots__ = ("tags", "start_a", "end_a", "start_b", "end_b")
+
+    def __init__(self, chunks=()):
+        self.tags = array("b")
+        self.start_a = OffsetArray()
+        self.end_a = OffsetArray()
+        self.start_b = OffsetArray()
+        self.end_b = OffsetArray()
+        self.extend(chunks)
+
+    def append(self, chunk):
+        """Append a copy of chunk, which may be any 5-sequence or None"""
+        if chunk is None:
+            self.tags.append(NO_CHUNK)
+            chunk = (None, 0, 0, 0, 0)
+        else:
+            self.tags.append(TAG_CODES[chunk[0]])
+        self.start_a.append(chunk[1])
+        self.end_a.append(chunk[2])
+        self.start_b.append(chunk[3])
+        self.end_b.append(chunk[4])
+
+    def extend(self, chunks):
+        for chunk in chunks:
+            self.append(chunk)
+
+    def present(self, index):
+        """Return whether the slot at index holds a chunk"""
+        return self.tags[index] != NO_CHUNK
+
+    def view(self, index):
+        """Return a view of the chunk at index, or None for an empty slot"""
+        if self.tags[index] == NO_CHUNK:
+            return None
+        return ChunkView(self, index)
+
+    def reversed_view(self, index):
+        """Return a view of the chunk at index with its sides swapped"""
+        if self.tags[index] == NO_CHUNK:
+            return None
+        return ChunkView(self, index, True)
+
+    def offset(self, start, offset_a, offset_b):
+        """Shift the bounds of the chunks from start onwards in place"""
+        self.start_a.shift(start, offset_a)
+        self.end_a.shift(start, offset_a)
+        self.start_b.shift(start, offset_b)
+        self.end_b.shift(start, offset_b)
+
+    def __len__(self):
+        return len(self.tags)
+
+    def __iter__(self):
+        return (self.view(i) for i in range(len(self.tags)))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            lo, hi, step = index.indices(len(self.tags))
+            if step != 1:
+                raise ValueError("only contiguous slices are supported")
+            chunks = ChunkArray()
+            chunks.tags = self.tags[lo:hi]
+            for name in ("start_a", "end_a", "start_b", "end_b"):
+                values = getattr(self, name).tolist(lo, max(lo, hi))
+                setattr(chunks, name, OffsetArray(values))
+            return chunks
+        if index < 0:
+            index += len(self.tags)
+        if not 0 <= index < len(self.tags):
+            raise IndexError("chunk index out of range")
+        return self.view(index)
+
+    def __setitem__(self, index, chunks):
+        if not isinstance(index, slice):
+            raise TypeError("only slice assignment is supported")
+        if not isinstance(chunks, ChunkArray):
+            chunks = ChunkArray(chunks)
+        self.tags[index] = chunks.tags
+        for name in ("start_a", "end_a", "start_b", "end_b"):
+            getattr(self, name)[index] = getattr(chunks, name).tolist()
+
+    def __eq__(self, other):
+        if isinstance(other, (ChunkArray, list)):
+            return len(self) == len(other) and all(
+                a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "ChunkArray(%r)" % list(self)
+
+
+class ChunkPairArray:
+    """A sequence of merged (chunk, chunk) pairs for three-way diffs
+
+    Each side is held in its own `ChunkArray`, so either side can be
+    walked without building the pairs.
+    """
+
+    __slots__ = ("sides",)
+
+    def __init__(self, pairs=()):
+        self.sides = (ChunkArray(), ChunkArray())
+        for pair in pairs:
+            self.append(pair)
+
+    def append(self, pair):
+        self.sides[0].append(pair[0])
+        self.sides[1].append(pair[1])
+
+    def __len__(self):
+        return len(self.sides[0])
+
+    def __iter__(self):
+        side0, side1 = self.sides
+        return (
+            (side0.view(i), side1.view(i)) for i in range(len(side0)))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("chunk index out of range")
+        return (self.sides[0].view(index), self.sides[1].view(index))
+
+
+class ChunkLineIndex:
+    """Sorted interval index from the lines of one pane to merged chunks
+
+    Each entry is the line range in this pane of one chunk in the merge
+    cache, in merge cache order. Insert chunks claim the line after
+    them. If ranges overlap, a line belongs to the last chunk starting
+    at or before it; lines after that chunk's end but before the next
+    chunk are gaps between the two.
+    """
+
+    __slots__ = ("starts", "ends", "chunks", "length")
+
+    def __init__(self, length=-1):
+        #: Starting line of each chunk
+        self.starts = OffsetArray()
+        #: Ending line of each chunk, after claiming lines for inserts
+        self.ends = OffsetArray()
+        #: Index in the merge cache of each chunk
+        self.chunks = OffsetArray()
+        #: Number of lines in the pane
+        self.length = length
+
+    @staticmethod
+    def claim_lines(starts, ends):
+        return [e if e != s else s + 1 for s, e in zip(starts, ends)]
+
+    @classmethod
+    def from_bounds(cls, length, indices, starts, ends):
+        index = cls(length)
+        index.chunks = OffsetArray(indices)
+        index.starts = OffsetArray(starts)
+        index.ends = OffsetArray(cls.claim_lines(starts, ends))
+        return index
+
+    def replace(
+            self, first, last, chunk_offset, line_offset,
+            indices, starts, ends):
+        """Replace the entries for a range of merge cache indices
+
+        :param first: the first merge cache index being replaced
+        :param last: the merge cache index after the last replaced one
+        :param chunk_offset: the change in merge cache indices for
+            entries after those being replaced
+        :param line_offset: the change in line numbers for entries after
+            those being replaced
+        """
+        lo = bisect.bisect_left(self.chunks, first)
+        hi = bisect.bisect_left(self.chunks, last)
+        self.chunks.shift(hi, chunk_offset)
+        self.starts.shift(hi, line_offset)
+        self.ends.shift(hi, line_offset)
+        self.chunks[lo:hi] = indices
+        self.starts[lo:hi] = starts
+        self.ends[lo:hi] = self.claim_lines(starts, ends)
+
+    def locate(self, line):
+        """Return the (current, previous, next) chunk indices for line
+
+        As for `Differ.locate_chunk`, the current chunk is None if line
+        isn't in a chunk, and previous/next are None if there is no
+        such chunk. Negative lines count back from the end of the pane.
+        """
+        if line < 0:
+            line += self.length + 1
+        if not 0 <= line <= self.length:
+            return (None, None, None)
+        chunks = self.chunks
+        k = bisect.bisect_right(self.starts, line) - 1
+        next_chunk = chunks[k + 1] if k + 1 < len(chunks) else None
+        if k < 0:
+            return (None, None, next_chunk)
+        if line >= self.ends[k]:
+            return (None, chunks[k], next_chunk)
+        return (chunks[k], chunks[k - 1] if k > 0 else None, next_chunk)
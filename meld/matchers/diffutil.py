@@ -14,13 +14,38 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from gi.repository import GObject
-
+import bisect
+import contextlib
+import functools
+import logging
+import multiprocessing
+import queue
+
+from gi.repository import GLib, GObject
+
+from meld.matchers.chunks import (
+    NO_CHUNK,
+    TAG_CODES,
+    ChunkArray,
+    ChunkLineIndex,
+    ChunkPairArray,
+    OffsetArray,
+)
 from meld.matchers.myers import (
     DiffChunk,
+    LinearSpaceMyersSequenceMatcher,
+    LineInterner,
     MyersSequenceMatcher,
     SyncPointMyersSequenceMatcher,
 )
+from meld.matchers.parallel import (
+    AnchoredMyersSequenceMatcher,
+    match_concurrently,
+)
+from meld.matchers.patience import PatienceSequenceMatcher
+from meld.task import pause
+
+log = logging.getLogger(__name__)
 
 LO, HI = 1, 2
 
@@ -45,6 +70,11 @@ def reverse_chunk(chunk):
     return DiffChunk._make((tag, chunk[3], chunk[4], chunk[1], chunk[2]))
 
 
+def materialise_chunks(chunks):
+    """Copy a merged pair of chunks (or chunk views) into DiffChunks"""
+    return tuple(None if c is None else DiffChunk._make(c) for c in chunks)
+
+
 def consume_blank_lines(chunk, texts, pane1, pane2):
     if chunk is None:
         return None
@@ -69,6 +99,98 @@ def consume_blank_lines(chunk, texts, pane1, pane2):
     return DiffChunk._make((tag, c1, c2, c3, c4))
 
 
+def run_background_match(
+        differ_class, settings, sequences, results, cancelled):
+    """Match sequences for a `BackgroundMatch`, in a worker process"""
+    differ = differ_class()
+    differ.apply_match_settings(settings)
+    differ.num_sequences = len(sequences)
+    differ.seqlength = [len(s) for s in sequences]
+    try:
+        for pairs_done in differ._match_sequences_iter(sequences):
+            if cancelled.is_set():
+                return
+            if pairs_done is not None:
+                results.put(("progress", pairs_done))
+        results.put(("result", (differ.diffs, differ.approximate)))
+    except Exception as e:
+        log.error("Exception while running diff: %s", e)
+        results.put(("result", None))
+
+
+class BackgroundMatch:
+    """Pair matching for a `Differ`, run in a worker process
+
+    The worker matches a snapshot of the sequences, and posts progress
+    and its result back on a queue that is polled from the main loop.
+    """
+
+    #: Milliseconds between checks for a cancelled worker having exited
+    REAP_INTERVAL = 100
+
+    def __init__(self, differ, sequences):
+        self.results = multiprocessing.Queue()
+        self.cancelled = multiprocessing.Event()
+        #: Number of sequence pairs matched so far
+        self.pairs_done = 0
+        #: A (diffs, approximate) tuple once the worker has finished, or
+        #: None if matching failed or was cancelled
+        self.result = None
+        snapshot = [s[:] for s in sequences]
+        self.worker = multiprocessing.Process(
+            target=run_background_match,
+            args=(type(differ), differ.match_settings(), snapshot,
+                  self.results, self.cancelled),
+            daemon=True)
+        self.worker.start()
+
+    def poll(self):
+        """Handle messages from the worker, without waiting for any
+
+        If there are none, the current task is paused so that the main
+        loop doesn't spin while the worker runs. Returns True once the
+        worker has finished or been cancelled.
+        """
+        if self.cancelled.is_set():
+            return True
+        message = self._next_message()
+        if message is None:
+            if self.worker.exitcode is None:
+                pause()
+                return False
+            # The worker may have posted its result and exited since
+            # we last looked.
+            message = self._next_message()
+        if message is None:
+            log.error(
+                "Diff worker exited unexpectedly (%s)", self.worker.exitcode)
+            return True
+        kind, value = message
+        if kind == "progress":
+            self.pairs_done = value
+            return False
+        self.result = value
+        self.worker.join()
+        return True
+
+    def _next_message(self):
+        try:
+            return self.results.get_nowait()
+        except queue.Empty:
+            return None
+
+    def cancel(self):
+        """Stop the worker, without waiting for it to exit"""
+        self.cancelled.set()
+        if self.worker.is_alive():
+            self.worker.terminate()
+            GLib.timeout_add(self.REAP_INTERVAL, self._reap)
+
+    def _reap(self):
+        # Checking the exit code reaps the worker once it has exited
+        return self.worker.exitcode is None
+
+
 class Differ(GObject.GObject):
     """Utility class to hold diff2 or diff3 chunks"""
 
@@ -78,136 +200,198 @@ class Differ(GObject.GObject):
     }
 
     _matcher = MyersSequenceMatcher
+    _linear_matcher = LinearSpaceMyersSequenceMatcher
     _sync_matcher = SyncPointMyersSequenceMatcher
+    _patience_matcher = PatienceSequenceMatcher
+    _anchored_matcher = AnchoredMyersSequenceMatcher
+
+    #: Combined line count of a pair of sequences above which the initial
+    #: comparison is split at automatic anchors and matched in parallel
+    anchor_split_threshold = 200000
+    #: Combined line count of a pair of sequences (or of a slice, when
+    #: split at anchors) above which the linear-space matcher is used
+    linear_space_size_threshold = 1000000
+    #: Difference in line count of a pair of sequences above which the
+    #: linear-space matcher is used. This difference is a lower bound on
+    #: the edit distance, which is what drives the O(NP) memory use.
+    linear_space_distance_threshold = 100000
+    #: Combined line count of a three-way comparison above which both
+    #: pair comparisons are matched concurrently in worker processes
+    parallel_pair_threshold = 30000
+    #: Combined line count above which `set_sequences_iter` matches in a
+    #: worker process, when asked to match in the background
+    background_match_threshold = 20000
 
     def __init__(self):
         # Internally, diffs are stored from text1 -> text0 and text1 -> text2.
         super().__init__()
         self.num_sequences = 0
         self.seqlength = [0, 0, 0]
-        self.diffs = [[], []]
+        self.diffs = [ChunkArray(), ChunkArray()]
         self.syncpoints = []
-        self.conflicts = []
-        self._old_merge_cache = set()
-        self._changed_chunks = tuple()
-        self._merge_cache = []
-        self._line_cache = [[], [], []]
+        self.conflicts = OffsetArray()
+        self._merge_cache = ChunkPairArray()
+        self._mergeable_counts = [0, 0]
+        self._line_index = [ChunkLineIndex() for i in range(3)]
         self.ignore_blanks = False
+        #: Name of the comparison algorithm; either "myers" or "patience"
+        self.algorithm = "myers"
+        #: Opt-in limits on the cost of the initial comparison, after which
+        #: the matcher approximates rather than finding a minimal diff
+        self.cost_limit = None
+        self.time_limit = None
+        #: Whether the current diffs are an approximation
+        self.approximate = False
         self._initialised = False
         self._has_mergeable_changes = (False, False, False, False)
+        self._background_match = None
+        #: Generator for a comparison being matched in this process, whose
+        #: slices or pairs may be running in the process pool
+        self._foreground_match = None
+
+    def _consume_blank_lines(self, merged, texts):
+        if not self.ignore_blanks:
+            return merged
+        # We don't handle altering the chunk-type of conflicts in three-way
+        # comparisons where e.g., pane 1 and 3 differ in blank lines
+        merged = ((consume_blank_lines(c[0], texts, 1, 0),
+                   consume_blank_lines(c[1], texts, 1, 2)) for c in merged)
+        return (x for x in merged if any(x))
 
     def _update_merge_cache(self, texts):
         if self.num_sequences == 3:
-            self._merge_cache = [c for c in self._merge_diffs(self.diffs[0],
-                                                              self.diffs[1],
-                                                              texts)]
+            merged = self._merge_diffs(self.diffs[0], self.diffs[1], texts)
         else:
-            self._merge_cache = [(c, None) for c in self.diffs[0]]
-
-        if self.ignore_blanks:
-            # We don't handle altering the chunk-type of conflicts in three-way
-            # comparisons where e.g., pane 1 and 3 differ in blank lines
-            for i, c in enumerate(self._merge_cache):
-                self._merge_cache[i] = (consume_blank_lines(c[0], texts, 1, 0),
-                                        consume_blank_lines(c[1], texts, 1, 2))
-            self._merge_cache = [x for x in self._merge_cache if any(x)]
+            merged = ((c, None) for c in self.diffs[0])
+        merged = self._consume_blank_lines(merged, texts)
+        merged = [materialise_chunks(pair) for pair in merged]
 
         # Calculate chunks that were added (in the new but not the old merge
-        # cache), removed (in the old but not the new merge cache) and changed
-        # (where the edit actually occurred, *and* the chunk is still around).
-        # This information is used by the inline highlighting mechanism to
-        # avoid re-highlighting existing chunks.
-        removed_chunks = self._old_merge_cache - set(self._merge_cache)
-        added_chunks = set(self._merge_cache) - self._old_merge_cache
-        modified_chunks = self._changed_chunks
-        if modified_chunks in removed_chunks:
-            modified_chunks = tuple()
-        chunk_changes = (removed_chunks, added_chunks, modified_chunks)
-
-        mergeable0, mergeable1 = False, False
-        for (c0, c1) in self._merge_cache:
-            mergeable0 = mergeable0 or (c0 is not None and c0[0] != 'conflict')
-            mergeable1 = mergeable1 or (c1 is not None and c1[0] != 'conflict')
-            if mergeable0 and mergeable1:
-                break
-        self._has_mergeable_changes = (False, mergeable0, mergeable1, False)
+        # cache) and removed (in the old but not the new merge cache). This
+        # information is used by the inline highlighting mechanism to avoid
+        # re-highlighting existing chunks.
+        old_merge_cache = set(map(materialise_chunks, self._merge_cache))
+        self._merge_cache = ChunkPairArray(merged)
+        removed_chunks = old_merge_cache - set(merged)
+        added_chunks = set(merged) - old_merge_cache
+        chunk_changes = (removed_chunks, added_chunks, tuple())
+
+        tags0, tags1 = (side.tags for side in self._merge_cache.sides)
+        unmergeable = (NO_CHUNK, TAG_CODES["conflict"])
+        self._mergeable_counts = [
+            sum(code not in unmergeable for code in tags0),
+            sum(code not in unmergeable for code in tags1),
+        ]
+        self._update_mergeable_changes()
 
         # Conflicts can only occur when there are three panes, and will always
         # involve the middle pane.
-        self.conflicts = []
-        for i, (c1, c2) in enumerate(self._merge_cache):
-            if (c1 is not None and c1[0] == 'conflict') or \
-               (c2 is not None and c2[0] == 'conflict'):
-                self.conflicts.append(i)
+        conflict = TAG_CODES["conflict"]
+        self.conflicts = OffsetArray(
+            i for i, (code1, code2) in enumerate(zip(tags0, tags1))
+            if code1 == conflict or code2 == conflict
+        )
+
+        pane_bounds = self._pane_bounds(merged)
+        self._line_index = [ChunkLineIndex() for i in range(3)]
+        for pane, length in enumerate(self.seqlength):
+            self._line_index[pane] = ChunkLineIndex.from_bounds(
+                length, *pane_bounds[pane])
 
-        self._update_line_cache()
         self.emit("diffs-changed", chunk_changes)
 
-    def _update_line_cache(self):
-        """Cache a mapping from line index to per-pane chunk indices
-
-        This cache exists so that the UI can quickly query for current,
-        next and previous chunks when the current cursor line changes,
-        enabling better action sensitivity feedback.
-        """
-        for i, length in enumerate(self.seqlength):
-            # seqlength + 1 for after-last-line requests, which we do
-            self._line_cache[i] = [(None, None, None)] * (length + 1)
+    def _update_mergeable_changes(self):
+        mergeable0, mergeable1 = (n > 0 for n in self._mergeable_counts)
+        self._has_mergeable_changes = (False, mergeable0, mergeable1, False)
 
-        last_chunk = len(self._merge_cache)
+    @staticmethod
+    def _pane_bounds(merged, first=0):
+        """Get the line range of each merged chunk in every pane
 
-        def find_next(diff, seq, current):
-            next_chunk = None
-            if seq == 1 and current + 1 < last_chunk:
-                next_chunk = current + 1
-            else:
-                for j in range(current + 1, last_chunk):
-                    if self._merge_cache[j][diff] is not None:
-                        next_chunk = j
-                        break
-            return next_chunk
-
-        prev = [None, None, None]
-        next = [find_next(0, 0, -1), find_next(0, 1, -1), find_next(1, 2, -1)]
-        old_end = [0, 0, 0]
-
-        for i, c in enumerate(self._merge_cache):
-            seq_params = ((0, 0, 3, 4), (0, 1, 1, 2), (1, 2, 3, 4))
-            for (diff, seq, lo, hi) in seq_params:
-                if c[diff] is None:
-                    if seq == 1:
-                        diff = 1
-                    else:
-                        continue
-
-                start, end, last = c[diff][lo], c[diff][hi], old_end[seq]
-                if (start > last):
-                    chunk_ids = [(None, prev[seq], next[seq])] * (start - last)
-                    self._line_cache[seq][last:start] = chunk_ids
-
-                # For insert chunks, claim the subsequent line.
-                if start == end:
-                    end += 1
-
-                next[seq] = find_next(diff, seq, i)
-                chunk_ids = [(i, prev[seq], next[seq])] * (end - start)
-                self._line_cache[seq][start:end] = chunk_ids
-                prev[seq], old_end[seq] = i, end
-
-        for seq in range(3):
-            last, end = old_end[seq], len(self._line_cache[seq])
-            if (last < end):
-                chunk_ids = [(None, prev[seq], next[seq])] * (end - last)
-                self._line_cache[seq][last:end] = chunk_ids
+        The line index exists so that the UI can quickly query for
+        current, next and previous chunks when the current cursor line
+        changes, enabling better action sensitivity feedback. This
+        collects the (merge cache indices, starts, ends) that it
+        needs for each pane.
+        """
+        pane_bounds = tuple(([], [], []) for i in range(3))
+        for i, (c0, c1) in enumerate(merged, first):
+            # The middle pane uses whichever side of each chunk is present
+            sides = ((0, c0, 3), (1, c0 or c1, 1), (2, c1, 3))
+            for pane, chunk, lo in sides:
+                if chunk is not None:
+                    indices, starts, ends = pane_bounds[pane]
+                    indices.append(i)
+                    starts.append(chunk[lo])
+                    ends.append(chunk[lo + 1])
+        return pane_bounds
 
     def change_sequence(self, sequence, startidx, sizechange, texts):
         assert sequence in (0, 1, 2)
+        changed = []
         if sequence == 0 or sequence == 1:
-            self._change_sequence(0, sequence, startidx, sizechange, texts)
+            changed.append(self._change_sequence(
+                0, sequence, startidx, sizechange, texts))
         if sequence == 2 or (sequence == 1 and self.num_sequences == 3):
-            self._change_sequence(1, sequence, startidx, sizechange, texts)
+            changed.append(self._change_sequence(
+                1, sequence, startidx, sizechange, texts))
         self.seqlength[sequence] += sizechange
 
+        lo = min(start for start, end in changed)
+        hi = max(end for start, end in changed)
+        self._update_merge_cache_range(
+            sequence, startidx, sizechange, lo, hi, texts)
+
+    def _find_merge_boundary(self, line, forwards):
+        """Find a middle pane line that no chunk in either diff crosses
+
+        Merged chunks never span such a line, so merging before it and
+        after it can be done independently. Starting at line, this
+        searches backwards or forwards for the nearest such line.
+        """
+        clean = False
+        while not clean:
+            clean = True
+            for diffs in self.diffs[:self.num_sequences - 1]:
+                k = bisect.bisect_left(diffs.start_a, line) - 1
+                if k >= 0 and diffs.end_a[k] >= line:
+                    line = diffs.end_a[k] + 1 if forwards else diffs.start_a[k]
+                    clean = False
+        return line
+
+    def _update_merge_cache_range(
+            self, sequence, startidx, sizechange, lo, hi, texts):
+        """Update the merge cache after an edit
+
+        Only merged chunks between the merge boundaries around the
+        re-compared lines lo to hi of the middle pane are rebuilt. Later
+        chunks are offset lazily, so the cost of an edit depends on the
+        number of nearby chunks rather than on the size of the files.
+        """
+        middle_offset = sizechange if sequence == 1 else 0
+        start = self._find_merge_boundary(lo, forwards=False)
+        end = self._find_merge_boundary(hi + 1, forwards=True)
+        # Merged chunks in the middle pane index are in merge cache order
+        middle_starts = self._line_index[1].starts
+        first = bisect.bisect_left(middle_starts, start)
+        last = bisect.bisect_left(middle_starts, end - middle_offset)
+
+        old = [
+            materialise_chunks(self._merge_cache[i])
+            for i in range(first, last)
+        ]
+        regions = []
+        for diffs in self.diffs[:self.num_sequences - 1]:
+            region_start = bisect.bisect_left(diffs.start_a, start)
+            region_end = bisect.bisect_left(diffs.start_a, end)
+            regions.append(list(diffs[region_start:region_end]))
+        if self.num_sequences == 3:
+            merged = self._merge_diffs(regions[0], regions[1], texts)
+        else:
+            merged = ((c, None) for c in regions[0])
+        merged = self._consume_blank_lines(merged, texts)
+        new = [materialise_chunks(pair) for pair in merged]
+
         def offset(c, start, o1, o2):
             """Offset a chunk by o1/o2 if it's after the inserted lines"""
             if c is None:
@@ -219,11 +403,13 @@ class Differ(GObject.GObject):
             return DiffChunk._make((c.tag, start_a, end_a, start_b, end_b))
 
         # Calculate the expected differences in the chunk set if no cascading
-        # changes occur, making sure to not include the changed chunk itself
-        self._old_merge_cache = set()
-        self._changed_chunks = tuple()
+        # changes occur, making sure to not include the changed chunk itself.
+        # Merged chunks outside of the rebuilt range are unchanged but for
+        # their offsets, and so can't be added or removed.
+        expected = set()
+        changed_chunks = tuple()
         chunk_changed = False
-        for (c1, c2) in self._merge_cache:
+        for (c1, c2) in old:
             if sequence == 0:
                 if c1 and c1.start_b <= startidx < c1.end_b:
                     chunk_changed = True
@@ -240,20 +426,63 @@ class Differ(GObject.GObject):
                 if self.num_sequences == 3:
                     c2 = offset(c2, startidx, sizechange, 0)
             if chunk_changed:
-                assert not self._changed_chunks
-                self._changed_chunks = (c1, c2)
+                assert not changed_chunks
+                changed_chunks = (c1, c2)
                 chunk_changed = False
-            self._old_merge_cache.add((c1, c2))
+            expected.add((c1, c2))
+
+        removed_chunks = expected - set(new)
+        added_chunks = set(new) - expected
+        if changed_chunks in removed_chunks:
+            changed_chunks = tuple()
+        chunk_changes = (removed_chunks, added_chunks, changed_chunks)
+
+        # Splice the new merged chunks in, and offset those after them
+        chunk_offset = len(new) - (last - first)
+        sides = self._merge_cache.sides
+        if sequence == 1:
+            sides[0].offset(last, sizechange, 0)
+            sides[1].offset(last, sizechange, 0)
+        else:
+            sides[sequence // 2].offset(last, 0, sizechange)
+        for i, side in enumerate(sides):
+            side[first:last] = [pair[i] for pair in new]
+
+        for pairs, sign in ((old, -1), (new, 1)):
+            for c0, c1 in pairs:
+                if c0 is not None and c0.tag != "conflict":
+                    self._mergeable_counts[0] += sign
+                if c1 is not None and c1.tag != "conflict":
+                    self._mergeable_counts[1] += sign
+        self._update_mergeable_changes()
+
+        # Later conflicts are offset lazily, as for the merge cache
+        conflicts = self.conflicts
+        conflicts_first = bisect.bisect_left(conflicts, first)
+        conflicts_last = bisect.bisect_left(conflicts, last)
+        conflicts.shift(conflicts_last, chunk_offset)
+        conflicts[conflicts_first:conflicts_last] = [
+            i for i, (c0, c1) in enumerate(new, first)
+            if (c0 is not None and c0.tag == "conflict") or
+               (c1 is not None and c1.tag == "conflict")
+        ]
+
+        pane_bounds = self._pane_bounds(new, first)
+        for pane, length in enumerate(self.seqlength):
+            line_offset = sizechange if pane == sequence else 0
+            index = self._line_index[pane]
+            index.replace(
+                first, last, chunk_offset, line_offset, *pane_bounds[pane])
+            index.length = length
 
-        self._update_merge_cache(texts)
+        self.emit("diffs-changed", chunk_changes)
 
     def _locate_chunk(self, whichdiffs, sequence, line):
         """Find the index of the chunk which contains line."""
-        high_index = 2 + 2 * int(sequence != 1)
-        for i, c in enumerate(self.diffs[whichdiffs]):
-            if line < c[high_index]:
-                return i
-        return len(self.diffs[whichdiffs])
+        diffs = self.diffs[whichdiffs]
+        # Chunks are ordered and don't overlap, so their ends are sorted
+        ends = diffs.end_a if sequence == 1 else diffs.end_b
+        return bisect.bisect_right(ends, line)
 
     def has_chunk(self, to_pane, chunk):
         """Return whether the pane/chunk exists in the current Differ"""
@@ -261,7 +490,7 @@ class Differ(GObject.GObject):
         chunk_index, _, _ = self.locate_chunk(1, chunk.start_a)
         if chunk_index is None:
             return False
-        return self._merge_cache[chunk_index][sequence] == chunk
+        return self._merge_cache.sides[sequence].view(chunk_index) == chunk
 
     def get_chunk(self, index, from_pane, to_pane=None):
         """Return the index-th change in from_pane
@@ -270,23 +499,23 @@ class Differ(GObject.GObject):
         are considered, otherwise all changes starting at from_pane are used.
         """
         sequence = int(from_pane == 2 or to_pane == 2)
-        chunk = self._merge_cache[index][sequence]
+        sides = self._merge_cache.sides
         if from_pane in (0, 2):
-            if chunk is None:
-                return None
-            return reverse_chunk(chunk)
+            chunk = sides[sequence].reversed_view(index)
         else:
+            chunk = sides[sequence].view(index)
             if to_pane is None and chunk is None:
-                chunk = self._merge_cache[index][1]
-            return chunk
+                chunk = sides[1].view(index)
+        return None if chunk is None else DiffChunk._make(chunk)
 
     def get_chunk_starts(self, index):
         """Return the starting lines of all chunks at an index"""
-        chunks = self._merge_cache[index]
+        side0, side1 = self._merge_cache.sides
+        present0 = side0.present(index)
         chunk_starts = [
-            chunks[0].start_b if chunks[0] else None,
-            chunks[0].start_a if chunks[0] else None,
-            chunks[1].start_b if chunks[1] else None,
+            side0.start_b[index] if present0 else None,
+            side0.start_a[index] if present0 else None,
+            side1.start_b[index] if side1.present(index) else None,
         ]
         return chunk_starts
 
@@ -299,10 +528,7 @@ class Differ(GObject.GObject):
         previous/next chunks then None will be returned as the
         second/third elements.
         """
-        try:
-            return self._line_cache[pane][line]
-        except IndexError:
-            return (None, None, None)
+        return self._line_index[pane].locate(line)
 
     def diff_count(self):
         return len(self._merge_cache)
@@ -337,17 +563,16 @@ class Differ(GObject.GObject):
         lines1 = texts[1][range1[0]:range1[1]]
 
         def offset(c, o1, o2):
-            return DiffChunk._make((c[0], c[1] + o1, c[2] + o1,
-                                    c[3] + o2, c[4] + o2))
+            return (c[0], c[1] + o1, c[2] + o1, c[3] + o2, c[4] + o2)
 
-        newdiffs = self._matcher(None, lines1, linesx).get_difference_opcodes()
+        matcher_class = self._algorithm_matcher()
+        newdiffs = matcher_class(None, lines1, linesx).get_difference_opcodes()
         newdiffs = [offset(c, range1[0], rangex[0]) for c in newdiffs]
 
-        if hiidx < len(self.diffs[which]):
-            offset_diffs = [offset(c, lines_added[1], lines_added[x])
-                            for c in self.diffs[which][hiidx:]]
-            self.diffs[which][hiidx:] = offset_diffs
-        self.diffs[which][loidx:hiidx] = newdiffs
+        if hiidx < len(diffs):
+            diffs.offset(hiidx, lines_added[1], lines_added[x])
+        diffs[loidx:hiidx] = newdiffs
+        return range1
 
     def _range_from_lines(self, textindex, lines):
         lo_line, hi_line = lines
@@ -362,7 +587,22 @@ class Differ(GObject.GObject):
         return start, end
 
     def all_changes(self):
-        return iter(self._merge_cache)
+        return (materialise_chunks(pair) for pair in self._merge_cache)
+
+    def _side_changes(self, seq, reverse, start=0, end=None):
+        """Yield the chunks on one side of the merge cache
+
+        The merge cache is updated in place on edits, so callers get
+        copies of its chunks rather than views that could change under
+        them.
+        """
+        side = self._merge_cache.sides[seq]
+        view = side.reversed_view if reverse else side.view
+        if end is None:
+            end = len(side)
+        for i in range(start, end):
+            if side.present(i):
+                yield DiffChunk._make(view(i))
 
     def pair_changes(self, fromindex, toindex, lines=(None, None, None, None)):
         """Give all changes between file1 and either file0 or file2.
@@ -375,33 +615,17 @@ class Differ(GObject.GObject):
                 return
             start = min([x for x in (start1, start2) if x is not None])
             end = max([x for x in (end1, end2) if x is not None])
-            merge_cache = self._merge_cache[start:end + 1]
+            bounds = (start, min(end + 1, len(self._merge_cache)))
         else:
-            merge_cache = self._merge_cache
+            bounds = ()
 
         if fromindex == 1:
-            seq = toindex // 2
-            for c in merge_cache:
-                if c[seq]:
-                    yield c[seq]
+            yield from self._side_changes(toindex // 2, False, *bounds)
         else:
-            seq = fromindex // 2
-            for c in merge_cache:
-                if c[seq]:
-                    yield reverse_chunk(c[seq])
+            yield from self._side_changes(fromindex // 2, True, *bounds)
 
-    # FIXME: This is gratuitous copy-n-paste at this point
     def paired_all_single_changes(self, fromindex, toindex):
-        if fromindex == 1:
-            seq = toindex // 2
-            for c in self._merge_cache:
-                if c[seq]:
-                    yield c[seq]
-        else:
-            seq = fromindex // 2
-            for c in self._merge_cache:
-                if c[seq]:
-                    yield reverse_chunk(c[seq])
+        return self.pair_changes(fromindex, toindex)
 
     def single_changes(self, textindex, lines=(None, None)):
         """Give changes for single file only. do not return 'equal' hunks.
@@ -410,21 +634,19 @@ class Differ(GObject.GObject):
             start, end = self._range_from_lines(textindex, lines)
             if start is None or end is None:
                 return
-            merge_cache = self._merge_cache[start:end + 1]
+            bounds = (start, min(end + 1, len(self._merge_cache)))
         else:
-            merge_cache = self._merge_cache
+            bounds = (0, len(self._merge_cache))
         if textindex in (0, 2):
-            seq = textindex // 2
-            for cs in merge_cache:
-                if cs[seq]:
-                    yield reverse_chunk(cs[seq])
+            yield from self._side_changes(textindex // 2, True, *bounds)
         else:
-            for cs in merge_cache:
-                yield cs[0] or cs[1]
+            side0, side1 = self._merge_cache.sides
+            for i in range(*bounds):
+                yield DiffChunk._make(side0.view(i) or side1.view(i))
 
     def sequences_identical(self):
         # check so that we don't call an uninitialised comparison 'identical'
-        return self.diffs == [[], []] and self._initialised
+        return not any(self.diffs) and self._initialised
 
     def _merge_blocks(self, using):
         lowc = min(using[0][0][LO], using[1][0][LO])
@@ -455,30 +677,35 @@ class Differ(GObject.GObject):
         yield out0, out1
 
     def _merge_diffs(self, seq0, seq1, texts):
-        seq0, seq1 = seq0[:], seq1[:]
+        # Both sequences are walked with a cursor each, rather than by
+        # popping chunks from their fronts.
         seq = seq0, seq1
-        while len(seq0) or len(seq1):
-            if not seq0:
+        pos = [0, 0]
+        ends = [len(seq0), len(seq1)]
+        while pos[0] < ends[0] or pos[1] < ends[1]:
+            if pos[0] == ends[0]:
                 high_seq = 1
-            elif not seq1:
+            elif pos[1] == ends[1]:
                 high_seq = 0
             else:
-                high_seq = int(seq0[0].start_a > seq1[0].start_a)
-                if seq0[0].start_a == seq1[0].start_a:
-                    if seq0[0].tag == "insert":
+                head0, head1 = seq0[pos[0]], seq1[pos[1]]
+                high_seq = int(head0.start_a > head1.start_a)
+                if head0.start_a == head1.start_a:
+                    if head0.tag == "insert":
                         high_seq = 0
-                    elif seq1[0].tag == "insert":
+                    elif head1.tag == "insert":
                         high_seq = 1
 
-            high_diff = seq[high_seq].pop(0)
+            high_diff = seq[high_seq][pos[high_seq]]
+            pos[high_seq] += 1
             high_mark = high_diff.end_a
             other_seq = 0 if high_seq == 1 else 1
 
             using = [[], []]
             using[high_seq].append(high_diff)
 
-            while seq[other_seq]:
-                other_diff = seq[other_seq][0]
+            while pos[other_seq] < ends[other_seq]:
+                other_diff = seq[other_seq][pos[other_seq]]
                 if high_mark < other_diff.start_a:
                     break
                 if high_mark == other_diff.start_a and \
@@ -486,7 +713,7 @@ class Differ(GObject.GObject):
                     break
 
                 using[other_seq].append(other_diff)
-                seq[other_seq].pop(0)
+                pos[other_seq] += 1
 
                 if high_mark < other_diff.end_a:
                     high_seq, other_seq = other_seq, high_seq
@@ -502,31 +729,258 @@ class Differ(GObject.GObject):
                 for c in self._auto_merge(using, texts):
                     yield c
 
-    def set_sequences_iter(self, sequences):
+    def _algorithm_matcher(self):
+        """Return the matcher class for the current comparison algorithm"""
+        if self.algorithm == "patience":
+            return self._patience_matcher
+        return self._matcher
+
+    def _select_matcher(self, seq_a, seq_b):
+        """Choose the matcher to use for a full pair comparison"""
+        matcher_class = self._algorithm_matcher()
+        if matcher_class is not self._matcher:
+            return matcher_class
+        len_a, len_b = len(seq_a), len(seq_b)
+        if abs(len_a - len_b) > self.linear_space_distance_threshold:
+            return self._linear_matcher
+        if len_a + len_b > self.anchor_split_threshold:
+            return functools.partial(
+                self._anchored_matcher,
+                linear_space_threshold=self.linear_space_size_threshold,
+            )
+        if len_a + len_b > self.linear_space_size_threshold:
+            return self._linear_matcher
+        return matcher_class
+
+    def match_settings(self):
+        """Get the settings that pair matching depends on
+
+        Sync point positions are resolved, so that the settings can be
+        sent to another process and used with `apply_match_settings`.
+        """
+        return {
+            "algorithm": self.algorithm,
+            "cost_limit": self.cost_limit,
+            "time_limit": self.time_limit,
+            "syncpoints": [
+                [(pair[0](), pair[1]()) for pair in s]
+                for s in self.syncpoints
+            ],
+        }
+
+    def apply_match_settings(self, settings):
+        self.algorithm = settings["algorithm"]
+        self.cost_limit = settings["cost_limit"]
+        self.time_limit = settings["time_limit"]
+        self.syncpoints = [
+            [(lambda a=a: a, lambda b=b: b) for a, b in s]
+            for s in settings["syncpoints"]
+        ]
+
+    def _pair_matcher(self, sequences, i, matcher_kwargs):
+        """Create the matcher comparing the middle sequence to sequence i*2"""
+        if self.syncpoints:
+            syncpoints = [(s[i][0](), s[i][1]()) for s in self.syncpoints]
+            return self._sync_matcher(None,
+                                      sequences[1], sequences[i * 2],
+                                      syncpoints=syncpoints,
+                                      **matcher_kwargs)
+        matcher_class = self._select_matcher(sequences[1], sequences[i * 2])
+        return matcher_class(None, sequences[1], sequences[i * 2],
+                             **matcher_kwargs)
+
+    def _can_match_pairs_concurrently(self, sequences):
+        if self.num_sequences != 3 or self.syncpoints:
+            return False
+        if sum(self.seqlength) <= self.parallel_pair_threshold:
+            return False
+        # Comparisons that are split at anchors already use the process
+        # pool for their slices, and workers can't start pools of their own.
+        matcher_classes = [
+            self._select_matcher(sequences[1], sequences[i]) for i in (0, 2)
+        ]
+        return all(isinstance(c, type) for c in matcher_classes)
+
+    def _can_match_in_background(self, sequences):
+        if self.num_sequences < 2:
+            return False
+        if sum(self.seqlength) <= self.background_match_threshold:
+            return False
+        # Comparisons that already use the process pool for their slices
+        # or pairs are left as they are, since workers can't start pools
+        # of their own.
+        if self._can_match_pairs_concurrently(sequences):
+            return False
+        if self.syncpoints:
+            return True
+        return all(
+            isinstance(self._select_matcher(sequences[1], sequences[i]), type)
+            for i in range(0, self.num_sequences, 2))
+
+    def _match_pairs_concurrently(self, sequences, matcher_kwargs):
+        """Compare the middle sequence to both others in worker processes
+
+        Each sequence is interned exactly once, so the middle sequence's
+        identifiers are shared by both comparisons, and only the interned
+        arrays are sent to the workers.
+        """
+        interner = matcher_kwargs["interner"]
+        ids = [interner.intern(sequence) for sequence in sequences]
+        tasks = []
+        for i in (0, 2):
+            matcher_class = self._select_matcher(sequences[1], sequences[i])
+            tasks.append((matcher_class, ids[1], ids[i],
+                          self.cost_limit, self.time_limit))
+
+        work = match_concurrently(tasks)
+        with contextlib.closing(work):
+            for results in work:
+                if results is None:
+                    yield None
+
+        for i, (task, (blocks, approximate)) in enumerate(zip(tasks, results)):
+            matcher_class, ids_a, ids_b = task[:3]
+            # Opcodes only depend on the matching blocks and the sequence
+            # lengths, so the interned arrays can stand in for the lines.
+            matcher = matcher_class(None, ids_a, ids_b)
+            matcher.matching_blocks = blocks
+            self.diffs[i] = ChunkArray(matcher.get_difference_opcodes())
+            self.approximate = self.approximate or approximate
+
+    def _match_sequences_iter(self, sequences, stream=False):
+        """Match the middle sequence against each other one
+
+        Yields None while matching, and the number of pairs matched so
+        far as each pair is finished.
+
+        :param stream: if True, chunks for the start of a two-way
+            comparison are set as soon as they are settled, while the
+            rest is still being matched
+        """
+        # Share line identifiers between both comparisons in three-way mode
+        matcher_kwargs = {
+            "interner": LineInterner(),
+            "cost_limit": self.cost_limit,
+            "time_limit": self.time_limit,
+        }
+        if self._can_match_pairs_concurrently(sequences):
+            work = self._match_pairs_concurrently(sequences, matcher_kwargs)
+            with contextlib.closing(work):
+                for i in work:
+                    yield None
+            yield self.num_sequences - 1
+        else:
+            for i in range(self.num_sequences - 1):
+                matcher = self._pair_matcher(sequences, i, matcher_kwargs)
+                work = matcher.initialise()
+                settled = 0
+                with contextlib.closing(work):
+                    while next(work) is None:
+                        if stream and self.num_sequences == 2:
+                            settled = self._show_settled_chunks(
+                                matcher, sequences, settled)
+                        yield None
+                self.diffs[i] = ChunkArray(matcher.get_difference_opcodes())
+                self.approximate = self.approximate or matcher.approximate
+                yield i + 1
+
+    def _show_settled_chunks(self, matcher, sequences, settled):
+        """Set the chunks of any newly settled slices of a comparison
+
+        Only matchers that split their sequences into slices settle part
+        of a comparison early; for others, this does nothing.
+
+        :param settled: the number of slices already set
+        :returns: the number of slices now set
+        """
+        slices = len(getattr(matcher, "split_matching_blocks", ()))
+        if slices > settled:
+            self.diffs[0] = ChunkArray(
+                c for c in matcher.settled_opcodes() if c.tag != "equal")
+            self._update_merge_cache(sequences)
+        return slices
+
+    def _start_background_match(self, sequences):
+        try:
+            return BackgroundMatch(self, sequences)
+        except (ImportError, NotImplementedError, OSError) as e:
+            log.warning("Couldn't start diff worker: %s", e)
+            return None
+
+    @property
+    def pairs_matched(self):
+        """Number of sequence pairs matched by the current comparison"""
+        if self._background_match is not None:
+            return self._background_match.pairs_done
+        return None
+
+    def cancel_background_match(self):
+        """Stop any comparison running in a worker process or pool
+
+        Comparisons matched in this process are stopped too, cancelling
+        any of their slices or pairs that are still queued in the
+        process pool. The `set_sequences_iter` generator for the
+        comparison then finishes without setting any chunks.
+        """
+        if self._background_match is not None:
+            self._background_match.cancel()
+            self._background_match = None
+        if self._foreground_match is not None:
+            self._foreground_match.close()
+            self._foreground_match = None
+
+    def set_sequences_iter(self, sequences, background=False, stream=False):
+        """Compare sequences, yielding None while work is in progress
+
+        Yields 1 once the comparison is finished. If it is cancelled
+        with `cancel_background_match`, whether or not it was matched in
+        the background, the generator finishes without yielding 1.
+
+        :param background: if True, large comparisons that don't already
+            use the process pool are matched in a worker process on a
+            snapshot of sequences, and only setting the resulting chunks
+            happens here
+        :param stream: if True, chunks for the start of a two-way
+            comparison that is split into slices are set, and
+            diffs-changed emitted, as soon as they are settled
+        """
         assert 0 <= len(sequences) <= 3
-        self.diffs = [[], []]
+        self.cancel_background_match()
+        self.diffs = [ChunkArray(), ChunkArray()]
         self.num_sequences = len(sequences)
         self.seqlength = [len(s) for s in sequences]
+        self.approximate = False
 
-        for i in range(self.num_sequences - 1):
-            if self.syncpoints:
-                syncpoints = [(s[i][0](), s[i][1]()) for s in self.syncpoints]
-                matcher = self._sync_matcher(None,
-                                             sequences[1], sequences[i * 2],
-                                             syncpoints=syncpoints)
-            else:
-                matcher = self._matcher(None, sequences[1], sequences[i * 2])
-            work = matcher.initialise()
-            while next(work) is None:
+        match = None
+        if background and self._can_match_in_background(sequences):
+            match = self._start_background_match(sequences)
+
+        if match is not None:
+            self._background_match = match
+            while not match.poll():
+                yield None
+            if match.cancelled.is_set():
+                return
+            self._background_match = None
+
+        if match is not None and match.result is not None:
+            self.diffs, self.approximate = match.result
+        else:
+            work = self._match_sequences_iter(sequences, stream)
+            self._foreground_match = work
+            for i in work:
                 yield None
-            self.diffs[i] = matcher.get_difference_opcodes()
+            if self._foreground_match is not work:
+                return
+            self._foreground_match = None
         self._initialised = True
         self._update_merge_cache(sequences)
         yield 1
 
     def clear(self):
-        self.diffs = [[], []]
+        self.cancel_background_match()
+        self.diffs = [ChunkArray(), ChunkArray()]
         self.seqlength = [0] * self.num_sequences
         self._initialised = False
-        self._old_merge_cache = set()
+        self.approximate = False
         self._update_merge_cache([""] * self.num_sequences)
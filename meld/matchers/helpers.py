@@ -1,21 +1,128 @@
 
+import collections
+import hashlib
+import heapq
 import logging
 import multiprocessing
+import os
 import queue
+import sys
 import time
+import typing
+from array import array
 
 from gi.repository import GLib
 
 from meld.matchers import myers
+from meld.matchers.chunks import TAG_CODES, TAGS
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    shared_memory = None
 
 log = logging.getLogger(__name__)
 
+#: Combined length of texts above which they are sent to workers
+#: through shared memory rather than being pickled
+SHARED_TEXT_MIN_LENGTH = 64 * 1024
+
+
+class SharedTexts(typing.NamedTuple):
+    """A pair of UTF-8 encoded texts in a shared memory block"""
+
+    name: str
+    size1: int
+    sizen: int
+
+    @classmethod
+    def create(cls, texts):
+        """Copy texts into a new shared memory block
+
+        Returns the block and its description; the caller is responsible
+        for unlinking the block once the task is finished.
+        """
+        text1, textn = (t.encode('utf-8', 'surrogatepass') for t in texts)
+        size = len(text1) + len(textn)
+        block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        block.buf[:len(text1)] = text1
+        block.buf[len(text1):size] = textn
+        return block, cls(block.name, len(text1), len(textn))
+
+    def attach(self):
+        if sys.version_info >= (3, 13):
+            return shared_memory.SharedMemory(name=self.name, track=False)
+        block = shared_memory.SharedMemory(name=self.name)
+        # The block belongs to the process that created it, so we stop
+        # this process' resource tracker from unlinking it on exit.
+        resource_tracker.unregister(block._name, 'shared_memory')
+        return block
+
+    def read(self):
+        block = self.attach()
+        try:
+            size = self.size1 + self.sizen
+            text1 = bytes(block.buf[:self.size1])
+            textn = bytes(block.buf[self.size1:size])
+        finally:
+            block.close()
+        return (
+            text1.decode('utf-8', 'surrogatepass'),
+            textn.decode('utf-8', 'surrogatepass'),
+        )
+
+
+def pack_opcodes(opcodes):
+    """Pack opcodes into a flat integer array for sending to another process"""
+    packed = array('i')
+    for tag, i1, i2, j1, j2 in opcodes:
+        packed.extend((TAG_CODES[tag], i1, i2, j1, j2))
+    return packed
+
+
+def unpack_opcodes(packed):
+    """Unpack an array from `pack_opcodes` into a list of `DiffChunk`"""
+    values = packed.tolist()
+    return [
+        myers.DiffChunk(TAGS[values[i]], *values[i + 1:i + 5])
+        for i in range(0, len(values), 5)
+    ]
+
+
+def highlight_ranges(opcodes, len_a, len_b):
+    """Get the ranges of two texts to highlight as inline changes
+
+    Equal runs shorter than three characters are highlighted along with
+    the changes around them, unless they are at the start or end of the
+    texts. Touching ranges are merged, so that a run of small changes
+    is highlighted as a single range.
+
+    :returns: a pair of lists of (start, end) offsets, one for each text
+    """
+    ranges = ([], [])
+    for tag, start_a, end_a, start_b, end_b in opcodes:
+        if tag == "equal":
+            if start_a == 0 and start_b == 0:
+                continue
+            if end_a == len_a and end_b == len_b:
+                continue
+            if end_a - start_a >= 3 and end_b - start_b >= 3:
+                continue
+        for side, start, end in (
+                (ranges[0], start_a, end_a), (ranges[1], start_b, end_b)):
+            if side and side[-1][1] >= start:
+                if end > side[-1][1]:
+                    side[-1] = (side[-1][0], end)
+            else:
+                side.append((start, end))
+    return ranges
+
 
 class MatcherWorker(multiprocessing.Process):
 
     END_TASK = -1
 
-    matcher_class = myers.InlineMyersSequenceMatcher
+    matcher_class = myers.TokenInlineMyersSequenceMatcher
 
     def __init__(self, tasks, results):
         super().__init__()
@@ -25,36 +132,46 @@ class MatcherWorker(multiprocessing.Process):
 
     def run(self):
         while True:
-            task_id, (text1, textn) = self.tasks.get()
+            task_id, texts = self.tasks.get()
             if task_id == self.END_TASK:
                 break
 
+            # Failed tasks still get a result, so that their worker slot
+            # is freed up for the next task.
+            opcodes = None
             try:
+                if isinstance(texts, SharedTexts):
+                    texts = texts.read()
+                text1, textn = texts
                 matcher = self.matcher_class(None, text1, textn)
-                self.results.put((task_id, matcher.get_opcodes()))
+                opcodes = pack_opcodes(matcher.get_opcodes())
             except Exception as e:
                 log.error("Exception while running diff: %s", e)
+            self.results.put((task_id, opcodes))
             time.sleep(0)
 
 
-class CachedSequenceMatcher:
-    """Simple class for caching diff results, with LRU-based eviction
+class MatcherPool:
+    """A pool of matcher worker processes shared between comparisons
 
-    Results from the SequenceMatcher are cached and timestamped, and
-    subsequently evicted based on least-recent generation/usage. The LRU-based
-    eviction is overly simplistic, but is okay for our usage pattern.
+    Tasks are held in this process until a worker is free to take them,
+    so that they can be replaced or cancelled right up until they are
+    computed. Each task has a key (e.g., the chunk it is highlighting)
+    and only the newest task for each key is ever sent to a worker.
+
+    Waiting tasks are sent to workers in order of priority, as given by
+    their owner's `task_priority` method, and then in the order they were
+    submitted. Owners call `reprioritise` when their priorities change.
     """
 
     TASK_GRACE_PERIOD = 1
 
-    def __init__(self, scheduler):
-        """Create a new caching sequence matcher
+    def __init__(self, size):
+        """Create a new worker pool
 
-        :param scheduler: a `meld.task.SchedulerBase` used to schedule
-            sequence comparison result checks
+        :param size: the number of worker processes to use
         """
-        self.scheduler = scheduler
-        self.cache = {}
+        self.size = size
         self.tasks = multiprocessing.Queue()
         self.tasks.cancel_join_thread()
         # Limiting the result queue here has the effect of giving us
@@ -63,55 +180,362 @@ class CachedSequenceMatcher:
         # delayed until we're almost completely finished.
         self.results = multiprocessing.Queue(5)
         self.results.cancel_join_thread()
-        self.thread = MatcherWorker(self.tasks, self.results)
-        self.task_id = 1
+        self.workers = []
+        self.next_task_id = 1
+        #: Tasks not yet sent to a worker, as
+        #: (owner, key) -> (id, texts, digest)
+        self.pending = {}
+        #: Heap of (priority, task id, owner, key) for pending tasks;
+        #: entries for replaced or cancelled tasks are skipped when popped
+        self.queue = []
+        #: Owners whose task priorities have changed
+        self.reprioritised = set()
+        #: Tasks sent to a worker, as task id -> (owner, texts, digest)
+        self.running = {}
+        #: Shared memory blocks for running tasks, by task id
+        self.shared_blocks = {}
+
+    def start(self):
+        self.workers = [
+            MatcherWorker(self.tasks, self.results) for i in range(self.size)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self) -> None:
+        for worker in self.workers:
+            self.tasks.put((MatcherWorker.END_TASK, ('', '')))
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.join(self.TASK_GRACE_PERIOD)
+                if worker.exitcode is None:
+                    worker.terminate()
+        self.workers = []
+        self.pending.clear()
+        self.queue = []
+        self.reprioritised.clear()
+        self.running.clear()
+        for task_id in list(self.shared_blocks):
+            self.release_shared_block(task_id)
+
+    def submit(self, owner, key, texts, digest=None):
+        """Queue a comparison of texts, replacing any pending one for key
+
+        If given, digest is passed back to the owner with the result.
+        Returns the id of the new task.
+        """
+        task_id = self.next_task_id
+        self.next_task_id += 1
+        self.pending[(owner, key)] = (task_id, texts, digest)
+        heapq.heappush(
+            self.queue, (owner.task_priority(key), task_id, owner, key))
+        self.dispatch()
+        return task_id
+
+    def cancel(self, owner, key):
+        """Drop the pending task for key, if it hasn't been started"""
+        self.pending.pop((owner, key), None)
+
+    def cancel_owner(self, owner):
+        """Drop all pending tasks, and ignore all results, for owner"""
+        for owner_key in [k for k in self.pending if k[0] is owner]:
+            del self.pending[owner_key]
+        self.reprioritised.discard(owner)
+        for task_id, (task_owner, texts, digest) in self.running.items():
+            if task_owner is owner:
+                self.running[task_id] = (None, texts, digest)
+
+    def reprioritise(self, owner):
+        """Re-order owner's pending tasks before the next dispatch"""
+        self.reprioritised.add(owner)
+
+    def rebuild_queue(self):
+        self.queue = [
+            (owner.task_priority(key), task_id, owner, key)
+            for (owner, key), (task_id, texts, digest) in self.pending.items()
+        ]
+        heapq.heapify(self.queue)
+        self.reprioritised.clear()
+
+    def dispatch(self):
+        if not self.workers:
+            self.start()
+        if self.reprioritised or len(self.queue) > 2 * len(self.pending) + 64:
+            self.rebuild_queue()
+        # Only as many tasks as there are workers are handed over at
+        # once, since tasks can't be cancelled once they are queued.
+        while self.queue and len(self.running) < self.size:
+            priority, task_id, owner, key = heapq.heappop(self.queue)
+            pending = self.pending.get((owner, key))
+            if pending is None or pending[0] != task_id:
+                continue
+            del self.pending[(owner, key)]
+            texts, digest = pending[1:]
+            self.running[task_id] = (owner, texts, digest)
+            self.tasks.put((task_id, self.share_texts(task_id, texts)))
+
+    def share_texts(self, task_id, texts):
+        """Return texts in the form they should be sent to a worker"""
+        if (
+            shared_memory is None or
+            len(texts[0]) + len(texts[1]) < SHARED_TEXT_MIN_LENGTH
+        ):
+            return texts
+        try:
+            block, shared_texts = SharedTexts.create(texts)
+        except OSError as e:
+            log.warning("Couldn't share texts with matcher: %s", e)
+            return texts
+        self.shared_blocks[task_id] = block
+        return shared_texts
+
+    def release_shared_block(self, task_id):
+        block = self.shared_blocks.pop(task_id, None)
+        if block is not None:
+            block.close()
+            block.unlink()
+
+    def poll(self, timeout):
+        """Wait up to timeout seconds for a result, and pass it on"""
+        try:
+            task_id, packed = self.results.get(block=True, timeout=timeout)
+        except queue.Empty:
+            return
+        self.release_shared_block(task_id)
+        owner, texts, digest = self.running.pop(task_id, (None, None, None))
+        self.dispatch()
+        if owner is None:
+            return
+        if packed is None:
+            owner.task_failed(task_id)
+        else:
+            owner.task_finished(
+                task_id, texts, unpack_opcodes(packed), digest=digest)
+
+
+_matcher_pool = None
+_matcher_pool_users = 0
+
+
+def get_matcher_pool(size=0):
+    """Get the shared matcher pool, creating it if necessary
+
+    :param size: the number of workers for a newly-created pool; if 0,
+        a size is chosen based on the number of CPUs
+    """
+    global _matcher_pool, _matcher_pool_users
+    if _matcher_pool is None:
+        if size <= 0:
+            size = max(1, min(4, (os.cpu_count() or 2) - 1))
+        _matcher_pool = MatcherPool(size)
+    _matcher_pool_users += 1
+    return _matcher_pool
+
+
+def release_matcher_pool():
+    """Release the shared matcher pool, stopping it if it's unused"""
+    global _matcher_pool, _matcher_pool_users
+    _matcher_pool_users -= 1
+    if _matcher_pool_users <= 0 and _matcher_pool is not None:
+        _matcher_pool.stop()
+        _matcher_pool = None
+        _matcher_pool_users = 0
+
+
+class MatchCache:
+    """LRU cache of inline comparison results, bounded by size
+
+    Results are keyed by a digest of the compared texts, so that cache
+    entries don't keep the texts themselves alive. The size of each
+    entry is estimated from its opcodes, and least-recently used entries
+    are evicted once the total exceeds `max_bytes`.
+    """
+
+    #: Estimated size of a single cached opcode and its integers
+    OPCODE_BYTES = 200
+
+    #: Estimated size of a cache entry, excluding its opcodes
+    ENTRY_BYTES = 200
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def digest(texts):
+        text1, textn = (t.encode('utf-8', 'surrogatepass') for t in texts)
+        digest = hashlib.blake2b(digest_size=16)
+        # Include a length so that moving text between the two sides
+        # can't give the same digest.
+        digest.update(len(text1).to_bytes(8, 'little'))
+        digest.update(text1)
+        digest.update(textn)
+        return digest.digest()
+
+    def get(self, digest):
+        """Return the cached opcodes for digest, or None"""
+        entry = self.entries.get(digest)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(digest)
+        return entry[0]
+
+    def put(self, digest, opcodes):
+        old_entry = self.entries.pop(digest, None)
+        if old_entry is not None:
+            self.size -= old_entry[1]
+        size = (
+            self.ENTRY_BYTES + sys.getsizeof(opcodes) +
+            len(opcodes) * self.OPCODE_BYTES)
+        if size > self.max_bytes:
+            return
+        self.entries[digest] = (opcodes, size)
+        self.size += size
+        while self.size > self.max_bytes:
+            _digest, (_opcodes, old_size) = self.entries.popitem(last=False)
+            self.size -= old_size
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self):
+        """Return a dictionary of cache usage counters"""
+        return {
+            'entries': len(self.entries),
+            'bytes': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+#: Inline comparison results, shared between all comparisons
+match_cache = MatchCache()
+
+
+class CachedSequenceMatcher:
+    """Inline sequence matcher with cached, asynchronous results
+
+    Results are cached in a `MatchCache`, by default shared with all
+    other matchers, so that the same comparison is never run twice
+    while its result is still cached.
+
+    Comparisons are run in the shared `MatcherPool`. Each request can
+    be given a key, so that a newer request with the same key supersedes
+    any older one, and requests can be cancelled by key when they are no
+    longer needed. Requests are run in order of the priority given to
+    their keys by `priority_func`.
+    """
+
+    def __init__(
+            self, scheduler, pool_size=0, priority_func=None, cache=None):
+        """Create a new caching sequence matcher
+
+        :param scheduler: a `meld.task.SchedulerBase` used to schedule
+            sequence comparison result checks
+        :param pool_size: the number of worker processes to use, if the
+            shared pool hasn't already been created
+        :param priority_func: a callable giving the priority of a
+            request's key, with lower priorities run first
+        :param cache: the `MatchCache` for results; if None, the shared
+            cache is used
+        """
+        self.scheduler = scheduler
+        self.priority_func = priority_func
+        self.cache = match_cache if cache is None else cache
+        self.pool = get_matcher_pool(pool_size)
+        #: Callbacks for our unfinished tasks, as
+        #: task id -> (key, cb, cancel_cb)
         self.queued_matches = {}
-        GLib.idle_add(self.thread.start)
+        #: The newest task for each key
+        self.latest_tasks = {}
 
     def stop(self) -> None:
-        self.tasks.put((MatcherWorker.END_TASK, ('', '')))
-        if self.thread.is_alive():
-            self.thread.join(self.TASK_GRACE_PERIOD)
-            if self.thread.exitcode is None:
-                self.thread.terminate()
-        self.cache = {}
+        if self.pool is not None:
+            self.pool.cancel_owner(self)
+            self.pool = None
+            release_matcher_pool()
         self.queued_matches = {}
+        self.latest_tasks = {}
 
-    def match(self, text1, textn, cb):
+    def match(self, text1, textn, cb, key=None, cancel_cb=None):
+        """Compare two texts, passing the resulting opcodes to cb
+
+        :param key: identifies what the comparison is for; a newer
+            request with the same key supersedes this one
+        :param cancel_cb: called instead of cb if the request is
+            superseded or cancelled
+        """
         texts = (text1, textn)
-        try:
-            self.cache[texts][1] = time.time()
-            opcodes = self.cache[texts][0]
+        digest = self.cache.digest(texts)
+        if key is None:
+            key = digest
+        opcodes = self.cache.get(digest)
+        if opcodes is not None:
+            self.cancel(key)
             GLib.idle_add(lambda: cb(opcodes))
-        except KeyError:
-            GLib.idle_add(lambda: self.enqueue_task(texts, cb))
+        else:
+            self.enqueue_task(key, texts, cb, cancel_cb, digest)
 
-    def enqueue_task(self, texts, cb):
+    def enqueue_task(self, key, texts, cb, cancel_cb=None, digest=None):
         if not bool(self.queued_matches):
             self.scheduler.add_task(self.check_results)
-        self.queued_matches[self.task_id] = (texts, cb)
-        self.tasks.put((self.task_id, texts))
-        self.task_id += 1
+        self._discard_task(self.latest_tasks.get(key))
+        task_id = self.pool.submit(self, key, texts, digest)
+        self.latest_tasks[key] = task_id
+        self.queued_matches[task_id] = (key, cb, cancel_cb)
 
-    def check_results(self):
-        try:
-            task_id, opcodes = self.results.get(block=True, timeout=0.01)
-            texts, cb = self.queued_matches.pop(task_id)
-            self.cache[texts] = [opcodes, time.time()]
-            GLib.idle_add(lambda: cb(opcodes))
-        except queue.Empty:
-            pass
+    def cancel(self, key):
+        """Cancel the request for key, if there is one"""
+        task_id = self.latest_tasks.pop(key, None)
+        if task_id is not None:
+            self._discard_task(task_id)
+            self.pool.cancel(self, key)
 
-        return bool(self.queued_matches)
+    def task_priority(self, key):
+        if self.priority_func is None:
+            return 0
+        return self.priority_func(key)
 
-    def clean(self, size_hint):
-        """Clean the cache if necessary
+    def reprioritise(self):
+        """Re-order waiting requests after their priorities change"""
+        if self.pool is not None and self.queued_matches:
+            self.pool.reprioritise(self)
 
-        @param size_hint: the recommended minimum number of cache entries
-        """
-        if len(self.cache) <= size_hint * 3:
+    def _discard_task(self, task_id):
+        key, cb, cancel_cb = self.queued_matches.pop(
+            task_id, (None, None, None))
+        if cancel_cb:
+            cancel_cb()
+
+    def task_finished(self, task_id, texts, opcodes, digest=None):
+        if digest is None:
+            digest = self.cache.digest(texts)
+        self.cache.put(digest, opcodes)
+        # Results for superseded or cancelled tasks are still cached,
+        # but their callbacks are never run.
+        if task_id not in self.queued_matches:
             return
-        items = list(self.cache.items())
-        items.sort(key=lambda it: it[1][1])
-        for item in items[:-size_hint * 2]:
-            del self.cache[item[0]]
+        key, cb, cancel_cb = self.queued_matches.pop(task_id)
+        del self.latest_tasks[key]
+        GLib.idle_add(lambda: cb(opcodes))
+
+    def task_failed(self, task_id):
+        if task_id in self.queued_matches:
+            key = self.queued_matches[task_id][0]
+            del self.latest_tasks[key]
+            self._discard_task(task_id)
+
+    def check_results(self):
+        if self.pool is None:
+            return False
+        self.pool.poll(timeout=0.01)
+        return bool(self.queued_matches)
@@ -14,8 +14,13 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import bisect
 import difflib
+import itertools
+import re
+import time
 import typing
+from array import array
 
 if typing.TYPE_CHECKING:
     from gi.repository import Gtk
@@ -83,9 +88,44 @@ class DiffChunk(typing.NamedTuple):
         )
 
 
+class LineInterner:
+    """Map lines to compact integer identifiers
+
+    Every distinct line seen by an interner is assigned a small integer,
+    so that the matchers can compare and hash integers rather than full
+    line strings. A single interner can be shared between several
+    sequences (e.g., all panes of a three-way comparison) so that their
+    identifiers are directly comparable.
+    """
+
+    def __init__(self):
+        self.ids = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def intern(self, sequence) -> array:
+        ids = self.ids
+        # The default is evaluated before insertion, so new lines are
+        # assigned the next unused identifier.
+        return array('i', [ids.setdefault(line, len(ids)) for line in sequence])
+
+
 class MyersSequenceMatcher(difflib.SequenceMatcher):
 
-    def __init__(self, isjunk=None, a="", b=""):
+    def __init__(
+            self, isjunk=None, a="", b="", *, interner=None,
+            cost_limit=None, time_limit=None):
+        """Create a new matcher
+
+        :param interner: a `LineInterner` to share line identifiers with
+            other matchers
+        :param cost_limit: the number of search iterations after which
+            the comparison gives up on finding a minimal diff and instead
+            approximates the remainder
+        :param time_limit: the number of seconds after which the
+            comparison falls back to an approximation, as for cost_limit
+        """
         if isjunk is not None:
             raise NotImplementedError('isjunk is not supported yet')
         # The sequences we're comparing must be considered immutable;
@@ -93,9 +133,15 @@ class MyersSequenceMatcher(difflib.SequenceMatcher):
         # isn't really a thing we can or should do.
         self.a = a[:]
         self.b = b[:]
+        self.interner = interner
+        self.cost_limit = cost_limit
+        self.time_limit = time_limit
+        #: Whether the result was approximated because it was too expensive
+        self.approximate = False
         self.matching_blocks = self.opcodes = None
         self.aindex = []
         self.bindex = []
+        self.ids_a = self.ids_b = None
         self.common_prefix = self.common_suffix = 0
         self.lines_discarded = False
 
@@ -155,13 +201,83 @@ class MyersSequenceMatcher(difflib.SequenceMatcher):
             b = indexed_b
         return (a, b)
 
+    def preprocess_intern_lines(self, a, b):
+        # replace lines with integer identifiers, so that all subsequent
+        # comparison and hashing is done on ints rather than strings
+        interner = self.interner
+        if interner is None:
+            interner = LineInterner()
+        return interner.intern(a), interner.intern(b)
+
+    def get_deadline(self):
+        if self.time_limit is None:
+            return None
+        return time.monotonic() + self.time_limit
+
+    def too_expensive(self, cost, deadline):
+        """Return whether the comparison has exceeded its budget"""
+        if self.cost_limit is not None and cost >= self.cost_limit:
+            return True
+        return deadline is not None and time.monotonic() > deadline
+
+    def find_greedy_snakes(self, a, alo, ahi, b, blo, bhi):
+        """Find a valid but non-minimal set of snakes between a and b
+
+        Each line in a is greedily matched against its next occurrence in
+        b, so this is roughly O((N+M) log M) regardless of how different
+        the sequences are. It is used to approximate the remainder of a
+        comparison that has become too expensive.
+        """
+        positions = {}
+        for j in range(blo, bhi):
+            positions.setdefault(b[j], []).append(j)
+
+        snakes = []
+        x, y = alo, blo
+        while x < ahi and y < bhi:
+            candidates = positions.get(a[x])
+            j = bisect.bisect_left(candidates, y) if candidates else 0
+            if not candidates or j == len(candidates):
+                x += 1
+                continue
+            y = candidates[j]
+            start_x, start_y = x, y
+            while x < ahi and y < bhi and a[x] == b[y]:
+                x += 1
+                y += 1
+            snakes.append((start_x, start_y, x - start_x))
+        return snakes
+
+    def approximate_snakes(self, a, b, fp, middle):
+        """Approximate the remainder of an O(NP) comparison
+
+        The furthest-reaching path explored so far is kept, and the rest
+        of the sequences are greedily matched.
+        """
+        m, n = len(a), len(b)
+        best_x = best_y = 0
+        best_node = None
+        for km, (y, node) in enumerate(fp):
+            x = y - km + middle
+            if 0 <= x <= m and 0 <= y <= n and x + y > best_x + best_y:
+                best_x, best_y, best_node = x, y, node
+
+        self.approximate = True
+        lastsnake = best_node
+        for x, y, snake in self.find_greedy_snakes(
+                a, best_x, m, b, best_y, n):
+            lastsnake = (lastsnake, x, y, snake)
+        return lastsnake
+
     def preprocess(self):
         """
         Pre-processing optimizations:
-        1) remove common prefix and common suffix
-        2) remove lines that do not match
+        1) intern lines to integer identifiers
+        2) remove common prefix and common suffix
+        3) remove lines that do not match
         """
-        a, b = self.preprocess_remove_prefix_suffix(self.a, self.b)
+        self.ids_a, self.ids_b = self.preprocess_intern_lines(self.a, self.b)
+        a, b = self.preprocess_remove_prefix_suffix(self.ids_a, self.ids_b)
         return self.preprocess_discard_nonmatching_lines(a, b)
 
     def postprocess(self):
@@ -171,6 +287,7 @@ class MyersSequenceMatcher(difflib.SequenceMatcher):
         algorithm backward scanning of matching chunks might reveal
         some smaller chunks that can be combined together.
         """
+        a, b = self.ids_a, self.ids_b
         mb = [self.matching_blocks[-1]]
         i = len(self.matching_blocks) - 2
         while i >= 0:
@@ -179,8 +296,8 @@ class MyersSequenceMatcher(difflib.SequenceMatcher):
             while i >= 0:
                 prev_a, prev_b, prev_len = self.matching_blocks[i]
                 if prev_b + prev_len == cur_b or prev_a + prev_len == cur_a:
-                    prev_slice_a = self.a[cur_a - prev_len:cur_a]
-                    prev_slice_b = self.b[cur_b - prev_len:cur_b]
+                    prev_slice_a = a[cur_a - prev_len:cur_a]
+                    prev_slice_b = b[cur_b - prev_len:cur_b]
                     if prev_slice_a == prev_slice_b:
                         cur_b -= prev_len
                         cur_a -= prev_len
@@ -191,6 +308,8 @@ class MyersSequenceMatcher(difflib.SequenceMatcher):
             mb.append((cur_a, cur_b, cur_len))
         mb.reverse()
         self.matching_blocks = mb
+        # clean-up to free memory
+        self.ids_a = self.ids_b = None
 
     def build_matching_blocks(self, lastsnake):
         """Build list of matching blocks based on snakes
@@ -201,7 +320,9 @@ class MyersSequenceMatcher(difflib.SequenceMatcher):
          * shift positions and split blocks based on the list of discarded
            non-matching lines
         """
-        self.matching_blocks = matching_blocks = []
+        # Snakes are chained from last to first, so blocks are collected
+        # in reverse and put in order at the end.
+        matching_blocks = []
 
         common_prefix = self.common_prefix
         common_suffix = self.common_suffix
@@ -223,19 +344,21 @@ class MyersSequenceMatcher(difflib.SequenceMatcher):
                         xnext = aindex[x] + common_prefix
                         ynext = bindex[y] + common_prefix
                         if (xprev - xnext != 1) or (yprev - ynext != 1):
-                            matching_blocks.insert(0, (xprev, yprev, newsnake))
+                            matching_blocks.append((xprev, yprev, newsnake))
                             newsnake = 0
                         xprev = xnext
                         yprev = ynext
                         newsnake += 1
-                    matching_blocks.insert(0, (xprev, yprev, newsnake))
+                    matching_blocks.append((xprev, yprev, newsnake))
                 else:
-                    matching_blocks.insert(0, (xprev, yprev, snake))
+                    matching_blocks.append((xprev, yprev, snake))
             else:
-                matching_blocks.insert(0, (x + common_prefix,
-                                           y + common_prefix, snake))
+                matching_blocks.append((x + common_prefix,
+                                        y + common_prefix, snake))
         if common_prefix:
-            matching_blocks.insert(0, (0, 0, common_prefix))
+            matching_blocks.append((0, 0, common_prefix))
+        matching_blocks.reverse()
+        self.matching_blocks = matching_blocks
         if common_suffix:
             matching_blocks.append((len(self.a) - common_suffix,
                                     len(self.b) - common_suffix,
@@ -260,6 +383,7 @@ class MyersSequenceMatcher(difflib.SequenceMatcher):
         delta = n - m + middle
         dmin = min(middle, delta)
         dmax = max(middle, delta)
+        deadline = self.get_deadline()
         if n > 0 and m > 0:
             size = n + m + 2
             fp = [(-1, None)] * size
@@ -268,6 +392,9 @@ class MyersSequenceMatcher(difflib.SequenceMatcher):
                 p += 1
                 if not p % 100:
                     yield None
+                    if self.too_expensive(p, deadline):
+                        lastsnake = self.approximate_snakes(a, b, fp, middle)
+                        break
                 # move along vertical edge
                 yv = -1
                 node = None
@@ -332,8 +459,142 @@ class MyersSequenceMatcher(difflib.SequenceMatcher):
         yield 1
 
 
+class LinearSpaceMyersSequenceMatcher(MyersSequenceMatcher):
+    """Linear-space variant of the Myers matcher
+
+    Rather than keeping the trail of every snake explored, this matcher
+    uses the bidirectional "middle snake" search from Eugene W. Myers,
+    ("An O(ND) Difference Algorithm and Its Variations", 1986) to split
+    the comparison into independent halves, in the style of Hirschberg.
+    Memory use is therefore O(N+M) however different the sequences are,
+    at the cost of some extra comparison work.
+
+    The result is a minimal diff, though equal-cost alternatives may be
+    chosen differently from `MyersSequenceMatcher`. If a cost or time
+    limit is exceeded, ranges that have not yet been split are matched
+    greedily instead.
+    """
+
+    def find_middle_snake(self, a, alo, ahi, b, blo, bhi, deadline):
+        """Find the middle snake of an optimal path through a and b
+
+        This is a generator that yields None to indicate progress, and
+        returns a tuple of the snake's start and end points, and the
+        edit distance of the given ranges. If the search exceeds its
+        budget, None is returned instead.
+        """
+        n = ahi - alo
+        m = bhi - blo
+        delta = n - m
+        odd = delta & 1
+        max_d = (n + m + 1) // 2
+        offset = max_d + 1
+        # Furthest reaching x (counted from the start and end of the
+        # ranges respectively) for each forward and reverse diagonal
+        vf = [0] * (2 * offset + 1)
+        vb = [0] * (2 * offset + 1)
+        for d in range(max_d + 1):
+            if not d % 100:
+                if d:
+                    yield None
+                if self.too_expensive(d, deadline):
+                    return None
+            for k in range(-d, d + 1, 2):
+                if k == -d or (k != d and vf[offset + k - 1] <
+                               vf[offset + k + 1]):
+                    x = vf[offset + k + 1]
+                else:
+                    x = vf[offset + k - 1] + 1
+                y = x - k
+                x0, y0 = x, y
+                while x < n and y < m and a[alo + x] == b[blo + y]:
+                    x += 1
+                    y += 1
+                vf[offset + k] = x
+                if odd and -d < delta - k < d:
+                    if x + vb[offset + delta - k] >= n:
+                        return (alo + x0, blo + y0, alo + x, blo + y,
+                                2 * d - 1)
+            for k in range(-d, d + 1, 2):
+                if k == -d or (k != d and vb[offset + k - 1] <
+                               vb[offset + k + 1]):
+                    x = vb[offset + k + 1]
+                else:
+                    x = vb[offset + k - 1] + 1
+                y = x - k
+                x0, y0 = x, y
+                while x < n and y < m and a[ahi - 1 - x] == b[bhi - 1 - y]:
+                    x += 1
+                    y += 1
+                vb[offset + k] = x
+                if not odd and -d <= delta - k <= d:
+                    if x + vf[offset + delta - k] >= n:
+                        return (ahi - x, bhi - y, ahi - x0, bhi - y0, 2 * d)
+        raise AssertionError("No middle snake found")
+
+    def initialise(self):
+        a, b = self.preprocess()
+        deadline = self.get_deadline()
+        snakes = []
+        # Pending work is kept on an explicit stack so that deep splits
+        # can't exhaust the recursion limit. Entries are either ranges
+        # still to be compared, or snakes to record once every range to
+        # their left has been handled.
+        pending = [(0, len(a), 0, len(b))]
+        while pending:
+            item = pending.pop()
+            if len(item) == 3:
+                snakes.append(item)
+                continue
+
+            alo, ahi, blo, bhi = item
+            start_a, start_b = alo, blo
+            while alo < ahi and blo < bhi and a[alo] == b[blo]:
+                alo += 1
+                blo += 1
+            if alo > start_a:
+                snakes.append((start_a, start_b, alo - start_a))
+            end_a = ahi
+            while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+                ahi -= 1
+                bhi -= 1
+            if ahi < end_a:
+                pending.append((ahi, bhi, end_a - ahi))
+            # With common ends removed, a distance of one or less leaves
+            # one of the ranges empty, so any remaining work is a split.
+            if alo == ahi or blo == bhi:
+                continue
+
+            if not self.approximate:
+                middle_snake = yield from self.find_middle_snake(
+                    a, alo, ahi, b, blo, bhi, deadline)
+                self.approximate = middle_snake is None
+            if self.approximate:
+                snakes.extend(
+                    self.find_greedy_snakes(a, alo, ahi, b, blo, bhi))
+                continue
+
+            x, y, u, v, d = middle_snake
+            pending.append((u, ahi, v, bhi))
+            if u > x:
+                pending.append((x, y, u - x))
+            pending.append((alo, x, blo, y))
+
+        lastsnake = None
+        for x, y, snake in snakes:
+            lastsnake = (lastsnake, x, y, snake)
+        self.build_matching_blocks(lastsnake)
+        self.postprocess()
+        yield 1
+
+
 class InlineMyersSequenceMatcher(MyersSequenceMatcher):
 
+    def preprocess_intern_lines(self, a, b):
+        # Characters are already cheap to hash and compare, and the k-mer
+        # discarding below relies on slicing the original strings.
+        return a, b
+
     def preprocess_discard_nonmatching_lines(self, a, b):
 
         if len(a) <= 2 and len(b) <= 2:
@@ -369,64 +630,166 @@ class InlineMyersSequenceMatcher(MyersSequenceMatcher):
         return (a, b)
 
 
+#: Words, runs of whitespace, and single other characters
+INLINE_TOKEN_RE = re.compile(r'\w+|\s+|[^\w\s]')
+
+
+class TokenInlineMyersSequenceMatcher(InlineMyersSequenceMatcher):
+    """Inline matcher that compares words before characters
+
+    Long texts are split into tokens (words, runs of whitespace and
+    other single characters) and the token sequences are compared
+    first. Only the replaced tokens are then compared character by
+    character, so the cost of a comparison depends mostly on how much
+    has changed rather than on the length of the texts.
+
+    Texts shorter than `refine_limit` are compared character by
+    character, exactly as by `InlineMyersSequenceMatcher`.
+    """
+
+    #: Combined length of texts, or of a run of replaced tokens, up to
+    #: which a character-level comparison is used
+    refine_limit = 2000
+
+    #: Time limit for the token comparison if no limit is given; past
+    #: this the result is approximated
+    token_time_limit = 2
+
+    def initialise(self):
+        if len(self.a) + len(self.b) <= self.refine_limit:
+            yield from super().initialise()
+            return
+
+        tokens_a = INLINE_TOKEN_RE.findall(self.a)
+        tokens_b = INLINE_TOKEN_RE.findall(self.b)
+        time_limit = self.time_limit
+        if time_limit is None:
+            time_limit = self.token_time_limit
+        token_matcher = MyersSequenceMatcher(
+            None, tokens_a, tokens_b,
+            cost_limit=self.cost_limit, time_limit=time_limit)
+        for i in token_matcher.initialise():
+            yield None
+        self.approximate = token_matcher.approximate
+
+        offsets_a = [0, *itertools.accumulate(map(len, tokens_a))]
+        offsets_b = [0, *itertools.accumulate(map(len, tokens_b))]
+        blocks = []
+
+        def add_block(x, y, size):
+            if blocks:
+                last_x, last_y, last_size = blocks[-1]
+                if last_x + last_size == x and last_y + last_size == y:
+                    blocks[-1] = (last_x, last_y, last_size + size)
+                    return
+            blocks.append((x, y, size))
+
+        for tag, i1, i2, j1, j2 in token_matcher.get_opcodes():
+            a1, a2 = offsets_a[i1], offsets_a[i2]
+            b1, b2 = offsets_b[j1], offsets_b[j2]
+            if tag == 'equal':
+                add_block(a1, b1, a2 - a1)
+            elif tag == 'replace' and a2 - a1 + b2 - b1 <= self.refine_limit:
+                matcher = InlineMyersSequenceMatcher(
+                    None, self.a[a1:a2], self.b[b1:b2])
+                for i in matcher.initialise():
+                    yield None
+                for x, y, size in matcher.get_matching_blocks():
+                    if size:
+                        add_block(a1 + x, b1 + y, size)
+
+        blocks.append((len(self.a), len(self.b), 0))
+        self.matching_blocks = blocks
+        yield 1
+
+
 class SyncPointMyersSequenceMatcher(MyersSequenceMatcher):
 
-    def __init__(self, isjunk=None, a="", b="", syncpoints=None):
-        super().__init__(isjunk, a, b)
+    def __init__(self, isjunk=None, a="", b="", syncpoints=None, **kwargs):
+        super().__init__(isjunk, a, b, **kwargs)
         self.isjunk = isjunk
         self.syncpoints = syncpoints
+        self.matcher_kwargs = kwargs
+        self.split_matching_blocks = []
+
+    def split_sequences(self, a, b):
+        """Split a and b into slices at our sync points
+
+        Returns a list of (a offset, b offset, a slice, b slice) tuples.
+        """
+        chunks = []
+        ai = 0
+        bi = 0
+        for aj, bj in self.syncpoints:
+            chunks.append((ai, bi, a[ai:aj], b[bi:bj]))
+            ai = aj
+            bi = bj
+        if ai < len(a) or bi < len(b):
+            chunks.append((ai, bi, a[ai:], b[bi:]))
+        return chunks
+
+    def add_split_blocks(self, ai, bi, len_a, len_b, blocks):
+        """Record the matching blocks for a slice starting at (ai, bi)"""
+        matching_blocks = []
+        mb_len = len(matching_blocks) - 1
+        if mb_len >= 0 and len(blocks) > 1:
+            aj = matching_blocks[mb_len][0]
+            bj = matching_blocks[mb_len][1]
+            bl = matching_blocks[mb_len][2]
+            if (aj + bl == ai and bj + bl == bi and
+                    blocks[0][0] == 0 and blocks[0][1] == 0):
+                block = blocks.pop(0)
+                matching_blocks[mb_len] = (aj, bj, bl + block[2])
+        for x, y, length in blocks[:-1]:
+            matching_blocks.append((ai + x, bi + y, length))
+        self.matching_blocks.extend(matching_blocks)
+        # Split matching blocks each need to be terminated to get our
+        # split chunks correctly created
+        self.split_matching_blocks.append(
+            matching_blocks + [(ai + len_a, bi + len_b, 0)])
 
     def initialise(self):
         if self.syncpoints is None or len(self.syncpoints) == 0:
             for i in super().initialise():
                 yield i
         else:
-            chunks = []
-            ai = 0
-            bi = 0
-            for aj, bj in self.syncpoints:
-                chunks.append((ai, bi, self.a[ai:aj], self.b[bi:bj]))
-                ai = aj
-                bi = bj
-            if ai < len(self.a) or bi < len(self.b):
-                chunks.append((ai, bi, self.a[ai:], self.b[bi:]))
+            chunks = self.split_sequences(self.a, self.b)
 
             self.split_matching_blocks = []
             self.matching_blocks = []
             for ai, bi, a, b in chunks:
-                matching_blocks = []
-                matcher = MyersSequenceMatcher(self.isjunk, a, b)
+                matcher = MyersSequenceMatcher(
+                    self.isjunk, a, b, **self.matcher_kwargs)
                 for i in matcher.initialise():
                     yield None
-                blocks = matcher.get_matching_blocks()
-                mb_len = len(matching_blocks) - 1
-                if mb_len >= 0 and len(blocks) > 1:
-                    aj = matching_blocks[mb_len][0]
-                    bj = matching_blocks[mb_len][1]
-                    bl = matching_blocks[mb_len][2]
-                    if (aj + bl == ai and bj + bl == bi and
-                            blocks[0][0] == 0 and blocks[0][1] == 0):
-                        block = blocks.pop(0)
-                        matching_blocks[mb_len] = (aj, bj, bl + block[2])
-                for x, y, length in blocks[:-1]:
-                    matching_blocks.append((ai + x, bi + y, length))
-                self.matching_blocks.extend(matching_blocks)
-                # Split matching blocks each need to be terminated to get our
-                # split chunks correctly created
-                self.split_matching_blocks.append(
-                    matching_blocks + [(ai + len(a), bi + len(b), 0)])
+                self.approximate = self.approximate or matcher.approximate
+                self.add_split_blocks(
+                    ai, bi, len(a), len(b), matcher.get_matching_blocks())
             self.matching_blocks.append((len(self.a), len(self.b), 0))
             yield 1
 
     def get_opcodes(self):
-        # This is just difflib.SequenceMatcher.get_opcodes in which we instead
-        # iterate over our internal set of split matching blocks.
         if self.opcodes is not None:
             return self.opcodes
-        i = j = 0
-        self.opcodes = opcodes = []
         self.get_matching_blocks()
-        for matching_blocks in self.split_matching_blocks:
+        self.opcodes = self.split_opcodes(self.split_matching_blocks)
+        return self.opcodes
+
+    def settled_opcodes(self):
+        """Return the opcodes for the slices matched so far
+
+        Opcodes never span slices, so these are final even while later
+        slices are still being matched.
+        """
+        return self.split_opcodes(self.split_matching_blocks)
+
+    @staticmethod
+    def split_opcodes(split_matching_blocks):
+        # This is just difflib.SequenceMatcher.get_opcodes in which we instead
+        # iterate over our internal set of split matching blocks.
+        i = j = 0
+        opcodes = []
+        for matching_blocks in split_matching_blocks:
             for ai, bj, size in matching_blocks:
                 tag = ''
                 if i < ai and j < bj:
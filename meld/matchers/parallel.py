@@ -0,0 +1,216 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import concurrent.futures
+import contextlib
+import logging
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+from meld.matchers.myers import (
+    LinearSpaceMyersSequenceMatcher,
+    LineInterner,
+    MyersSequenceMatcher,
+    SyncPointMyersSequenceMatcher,
+)
+from meld.matchers.patience import unique_anchors
+from meld.task import pause
+
+log = logging.getLogger(__name__)
+
+_process_pool = None
+_process_pool_failed = False
+
+
+def get_process_pool():
+    """Return the shared matcher process pool, creating it if necessary
+
+    If worker processes can't be created on this platform, a warning is
+    logged the first time and None is returned; callers should do their
+    work in-process instead.
+    """
+    global _process_pool, _process_pool_failed
+    if _process_pool is None and not _process_pool_failed:
+        try:
+            _process_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=os.cpu_count())
+        except (ImportError, NotImplementedError, OSError) as e:
+            log.warning("Couldn't start matcher process pool: %s", e)
+            _process_pool_failed = True
+    return _process_pool
+
+
+def discard_process_pool(pool):
+    """Shut down a broken process pool, so that a new one is started
+
+    A pool breaks if one of its workers dies, e.g., if it's killed for
+    running out of memory; after that, it can't run any more tasks.
+    """
+    global _process_pool
+    if _process_pool is pool:
+        _process_pool = None
+    pool.shutdown(wait=False)
+
+
+def match_slice(matcher_class, a, b, cost_limit=None, time_limit=None):
+    """Match a single pair of sequences, for use in a worker process"""
+    matcher = matcher_class(
+        None, a, b, cost_limit=cost_limit, time_limit=time_limit)
+    return matcher.get_matching_blocks(), matcher.approximate
+
+
+def match_concurrently(tasks, result_cb=None):
+    """Match several pairs of sequences at once in the shared process pool
+
+    :param tasks: a list of (matcher class, a, b, cost limit, time limit)
+        tuples, as arguments for `match_slice`
+    :param result_cb: if given, called with the index and result of each
+        task as soon as it and all tasks before it have finished, so that
+        results can be used in order while later tasks are still running
+
+    This is a generator that yields None while matching is in progress,
+    and finally yields a list of (matching blocks, approximate) results
+    in the same order as `tasks`. If there is only one task or no pool
+    is available, tasks are matched in-process instead, as are any
+    unfinished tasks if the pool breaks. Closing the generator early
+    cancels any tasks that haven't started.
+    """
+    results = []
+    pool = get_process_pool() if len(tasks) > 1 else None
+    if pool:
+        futures = []
+        reported = 0
+        try:
+            futures = [pool.submit(match_slice, *task) for task in tasks]
+            while True:
+                done, pending = concurrent.futures.wait(futures, timeout=0)
+                if result_cb:
+                    while (reported < len(futures) and
+                           futures[reported].done()):
+                        result_cb(reported, futures[reported].result())
+                        reported += 1
+                if not pending:
+                    break
+                # Rather than waiting here and holding up the main loop,
+                # check back shortly.
+                pause()
+                yield None
+            yield [future.result() for future in futures]
+            return
+        except BrokenProcessPool as e:
+            log.warning(
+                "Matcher process pool failed; matching in-process: %s", e)
+            discard_process_pool(pool)
+            # Results already passed to result_cb are kept, and the
+            # rest are matched below.
+            results = [future.result() for future in futures[:reported]]
+        finally:
+            # If we're closed early, don't leave our slices holding up
+            # the shared pool for later comparisons.
+            for future in futures:
+                future.cancel()
+
+    for matcher_class, a, b, cost_limit, time_limit in tasks[len(results):]:
+        matcher = matcher_class(
+            None, a, b, cost_limit=cost_limit, time_limit=time_limit)
+        for i in matcher.initialise():
+            yield None
+        results.append((matcher.get_matching_blocks(), matcher.approximate))
+        if result_cb:
+            result_cb(len(results) - 1, results[-1])
+    yield results
+
+
+class AnchoredMyersSequenceMatcher(SyncPointMyersSequenceMatcher):
+    """Myers matcher that splits large comparisons at automatic anchors
+
+    Lines that are unique in both sequences are used as sync points, so
+    that the comparison is split into independent slices of at least
+    `min_slice_lines` lines. Each slice is then matched in the shared
+    process pool, and the results stitched together as for user-placed
+    sync points.
+
+    Splitting at anchors means that the result is not always minimal,
+    but for large inputs the difference is rarely noticeable.
+
+    Slices are added as they finish, in order, so `settled_opcodes`
+    gives final results for the start of the sequences while the rest
+    is still being matched. The first slice is kept small so that these
+    are available quickly.
+    """
+
+    #: Minimum number of lines from the first sequence in each slice
+    min_slice_lines = 10000
+
+    def __init__(
+            self, isjunk=None, a="", b="", *,
+            linear_space_threshold=1000000, **kwargs):
+        """Create a new matcher
+
+        :param linear_space_threshold: the combined length of a slice
+            above which the slice is matched using the linear-space
+            matcher
+        """
+        super().__init__(isjunk, a, b, None, **kwargs)
+        self.linear_space_threshold = linear_space_threshold
+
+    def find_syncpoints(self, a, b):
+        """Choose evenly spread anchors at which to split a and b"""
+        workers = os.cpu_count() or 1
+        slice_lines = max(self.min_slice_lines, len(a) // (2 * workers))
+
+        syncpoints = []
+        last_a = 0
+        for i, j in unique_anchors(a, 0, len(a), b, 0, len(b)):
+            min_lines = slice_lines if syncpoints else self.min_slice_lines
+            if i - last_a >= min_lines and len(a) - i >= slice_lines:
+                syncpoints.append((i, j))
+                last_a = i
+        return syncpoints
+
+    def slice_matcher(self, a, b):
+        if len(a) + len(b) > self.linear_space_threshold:
+            return LinearSpaceMyersSequenceMatcher
+        return MyersSequenceMatcher
+
+    def initialise(self):
+        interner = self.interner
+        if interner is None:
+            interner = LineInterner()
+        ids_a, ids_b = interner.intern(self.a), interner.intern(self.b)
+        self.syncpoints = self.find_syncpoints(ids_a, ids_b)
+
+        self.split_matching_blocks = []
+        self.matching_blocks = []
+        chunks = self.split_sequences(ids_a, ids_b)
+        # Slices are matched on their interned lines, which are much
+        # cheaper to send to worker processes than the lines themselves.
+        tasks = [
+            (self.slice_matcher(a, b), a, b, self.cost_limit, self.time_limit)
+            for ai, bi, a, b in chunks
+        ]
+
+        def add_slice_result(index, result):
+            ai, bi, a, b = chunks[index]
+            blocks, approximate = result
+            self.approximate = self.approximate or approximate
+            self.add_split_blocks(ai, bi, len(a), len(b), blocks)
+
+        work = match_concurrently(tasks, add_slice_result)
+        with contextlib.closing(work):
+            for results in work:
+                if results is None:
+                    yield None
+        self.matching_blocks.append((len(self.a), len(self.b), 0))
+        yield 1
@@ -0,0 +1,137 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import bisect
+
+from meld.matchers.myers import MyersSequenceMatcher
+
+
+def unique_anchors(a, alo, ahi, b, blo, bhi):
+    """Find in-order matches of lines that are unique in both ranges
+
+    Lines that occur exactly once in each range are paired up, and the
+    longest increasing subsequence of those pairs (by their position in
+    b) is returned as a list of (a index, b index) anchors.
+    """
+    # line -> [count in a, index in a, count in b, index in b]
+    occurrences = {}
+    for i in range(alo, ahi):
+        entry = occurrences.get(a[i])
+        if entry is None:
+            occurrences[a[i]] = [1, i, 0, -1]
+        else:
+            entry[0] += 1
+    for j in range(blo, bhi):
+        entry = occurrences.get(b[j])
+        if entry is not None:
+            entry[2] += 1
+            entry[3] = j
+
+    pairs = [
+        (i, j) for count_a, i, count_b, j in occurrences.values()
+        if count_a == 1 and count_b == 1
+    ]
+    pairs.sort()
+
+    # Patience sorting: piles hold the b index of their top card, and
+    # each card keeps a back-pointer to the top of the previous pile.
+    piles = []
+    pile_tops = []
+    backpointers = []
+    for n, (i, j) in enumerate(pairs):
+        pile = bisect.bisect_left(piles, j)
+        backpointers.append(pile_tops[pile - 1] if pile else -1)
+        if pile == len(piles):
+            piles.append(j)
+            pile_tops.append(n)
+        else:
+            piles[pile] = j
+            pile_tops[pile] = n
+
+    anchors = []
+    n = pile_tops[-1] if pile_tops else -1
+    while n != -1:
+        anchors.append(pairs[n])
+        n = backpointers[n]
+    anchors.reverse()
+    return anchors
+
+
+class PatienceSequenceMatcher(MyersSequenceMatcher):
+    """Sequence matcher using the patience diff algorithm
+
+    Lines that are unique in both sequences are matched in order and used
+    as anchors, with the ranges between anchors compared recursively.
+    When a range has no unique common lines, it is compared using the
+    Myers O(NP) algorithm instead.
+
+    Patience diffs are not always minimal, but tend to keep functions and
+    other structural blocks together, and so often read better for source
+    code that has been heavily refactored.
+    """
+
+    def initialise(self):
+        a, b = self.preprocess()
+        snakes = []
+        # As for the linear-space matcher, pending entries are either
+        # ranges still to be compared or snakes waiting to be recorded.
+        pending = [(0, len(a), 0, len(b))]
+        while pending:
+            item = pending.pop()
+            if len(item) == 3:
+                snakes.append(item)
+                continue
+
+            alo, ahi, blo, bhi = item
+            start_a, start_b = alo, blo
+            while alo < ahi and blo < bhi and a[alo] == b[blo]:
+                alo += 1
+                blo += 1
+            if alo > start_a:
+                snakes.append((start_a, start_b, alo - start_a))
+            end_a = ahi
+            while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+                ahi -= 1
+                bhi -= 1
+            if ahi < end_a:
+                pending.append((ahi, bhi, end_a - ahi))
+            if alo == ahi or blo == bhi:
+                continue
+
+            anchors = unique_anchors(a, alo, ahi, b, blo, bhi)
+            if anchors:
+                next_a, next_b = ahi, bhi
+                for i, j in reversed(anchors):
+                    pending.append((i + 1, next_a, j + 1, next_b))
+                    pending.append((i, j, 1))
+                    next_a, next_b = i, j
+                pending.append((alo, next_a, blo, next_b))
+                continue
+
+            matcher = MyersSequenceMatcher(
+                None, a[alo:ahi], b[blo:bhi],
+                cost_limit=self.cost_limit, time_limit=self.time_limit)
+            for i in matcher.initialise():
+                yield None
+            self.approximate = self.approximate or matcher.approximate
+            for x, y, size in matcher.get_matching_blocks():
+                if size:
+                    snakes.append((alo + x, blo + y, size))
+
+        lastsnake = None
+        for x, y, snake in snakes:
+            lastsnake = (lastsnake, x, y, snake)
+        self.build_matching_blocks(lastsnake)
+        self.postprocess()
+        yield 1
@@ -16,6 +16,7 @@
 
 import enum
 import logging
+import re
 from typing import Any, List, Optional
 
 from gi.repository import Gio, GLib, GObject, GtkSource
@@ -25,6 +26,9 @@ from meld.settings import bind_settings
 
 log = logging.getLogger(__name__)
 
+#: Line breaks as recognised by Gtk.TextBuffer
+LINE_BREAK_RE = re.compile("\r\n|[\n\r\u2029]")
+
 
 class MeldBuffer(GtkSource.Buffer):
 
@@ -261,6 +265,9 @@ class BufferLines:
     This class allows a Gtk.TextBuffer to be treated as a list of lines of
     possibly-filtered text. If no filter is given, the raw output from the
     Gtk.TextBuffer is used.
+
+    Long runs of uncached lines are fetched with a single get_text call
+    and split, rather than line by line.
     """
 
     #: Cached copy of the (possibly filtered) text in a single line,
@@ -268,14 +275,33 @@ class BufferLines:
     #: available.
     lines: List[Optional[str]]
 
-    def __init__(self, buf, textfilter=None, *, cache_debug: bool = False):
+    #: Minimum number of consecutive uncached lines to fetch in bulk
+    bulk_fetch_lines = 32
+
+    def __init__(
+            self, buf, textfilter=None, *, bulk_textfilter=None,
+            cache_debug: bool = False):
+        """Wrap buf as a list of lines
+
+        :param textfilter: a callable taking a line's text, the buffer
+            and iters at the start and end of the line, and returning
+            the filtered line
+        :param bulk_textfilter: a callable taking a list of lines, the
+            buffer and the line number of the first of them, and
+            returning the filtered lines. If not given, lines fetched in
+            bulk are passed through textfilter one by one.
+        """
         self.buf = buf
+        self.filtered = textfilter is not None
         if textfilter is not None:
             self.textfilter = textfilter
         else:
             self.textfilter = lambda x, buf, start_iter, end_iter: x
+        self.bulk_textfilter = bulk_textfilter
 
         self.lines = [None] * self.buf.get_line_count()
+        #: Filtered views of these lines, whose caches follow ours
+        self.views = []
         self.mark = buf.create_mark(
             "bufferlines-insert", buf.get_start_iter(), True,
         )
@@ -296,6 +322,8 @@ class BufferLines:
 
     def clear_cache(self) -> None:
         self.lines = [None] * self.buf.get_line_count()
+        for view in self.views:
+            view.clear_cache()
 
     def on_insert_text(self, buf, it, text, textlen):
         buf.move_mark(self.mark, it)
@@ -308,19 +336,65 @@ class BufferLines:
         # substitution; for multi-line inserts, we will replace the
         # single insertion point line with several empty cache lines.
         self.lines[start_idx:start_idx + 1] = [None] * (end_idx - start_idx)
+        for view in self.views:
+            view.invalidate(start_idx, start_idx + 1, end_idx - start_idx)
 
     def on_delete_range(self, buf, it0, it1):
         start_idx = it0.get_line()
         end_idx = it1.get_line() + 1
         self.lines[start_idx:end_idx] = [None]
+        for view in self.views:
+            view.invalidate(start_idx, end_idx, 1)
+
+    def _line_iters(self, line):
+        line_start = self.buf.get_iter_at_line_or_eof(line)
+        line_end = line_start.copy()
+        if not line_end.ends_line():
+            line_end.forward_to_line_end()
+        return line_start, line_end
+
+    def _fetch_lines(self, lo, hi):
+        """Cache lines lo to hi using a single get_text call
+
+        Returns False if the text couldn't be split into the expected
+        lines (e.g., because of hidden line breaks), in which case
+        nothing is cached.
+        """
+        start = self.buf.get_iter_at_line_or_eof(lo)
+        end = self._line_iters(hi - 1)[1]
+        text = self.buf.get_text(start, end, False)
+        lines = LINE_BREAK_RE.split(text)
+        if len(lines) != hi - lo:
+            return False
+
+        if self.bulk_textfilter is not None:
+            lines = self.bulk_textfilter(lines, self.buf, lo)
+        elif self.filtered:
+            for i, txt in enumerate(lines):
+                lines[i] = self.textfilter(
+                    txt, self.buf, *self._line_iters(lo + i))
+        self.lines[lo:hi] = lines
+        return True
 
     def __getitem__(self, key):
         if isinstance(key, slice):
             lo, hi, _ = key.indices(self.buf.get_line_count())
 
-            for idx in range(lo, hi):
-                if self.lines[idx] is None:
-                    self.lines[idx] = self[idx]
+            lines = self.lines
+            idx = lo
+            while idx < hi:
+                try:
+                    start = lines.index(None, idx, hi)
+                except ValueError:
+                    break
+                end = start + 1
+                while end < hi and lines[end] is None:
+                    end += 1
+                if end - start < self.bulk_fetch_lines or \
+                        not self._fetch_lines(start, end):
+                    for line in range(start, end):
+                        lines[line] = self[line]
+                idx = end
 
             return self.lines[lo:hi]
 
@@ -329,10 +403,7 @@ class BufferLines:
                 raise IndexError
 
             if self.lines[key] is None:
-                line_start = self.buf.get_iter_at_line_or_eof(key)
-                line_end = line_start.copy()
-                if not line_end.ends_line():
-                    line_end.forward_to_line_end()
+                line_start, line_end = self._line_iters(key)
                 txt = self.buf.get_text(line_start, line_end, False)
                 txt = self.textfilter(txt, self.buf, line_start, line_end)
                 self.lines[key] = txt
@@ -343,6 +414,105 @@ class BufferLines:
         return self.buf.get_line_count()
 
 
+class FilteredBufferLines:
+    """Filtered line-based access to a `BufferLines`
+
+    Raw lines are read from, and cached by, the wrapped `BufferLines`,
+    which also keeps our cache in step with buffer edits. Only lines
+    that the filter actually changes are stored here, and while the
+    filter is inactive nothing is stored and raw lines are used as is.
+    """
+
+    #: Cache entry for a line that the filter leaves unchanged
+    UNCHANGED = object()
+
+    #: Minimum number of consecutive unfiltered lines to filter in bulk
+    bulk_filter_lines = 32
+
+    def __init__(self, raw, textfilter, bulk_textfilter=None, active=None):
+        """Create a filtered view of raw
+
+        :param textfilter: as for `BufferLines`
+        :param bulk_textfilter: as for `BufferLines`
+        :param active: a callable returning whether filtering is needed
+            at all; if not given, lines are always filtered
+        """
+        self.raw = raw
+        self.buf = raw.buf
+        self.textfilter = textfilter
+        self.bulk_textfilter = bulk_textfilter
+        self.active = active or (lambda: True)
+        #: Cached filtered lines; entries are None if the line hasn't
+        #: been filtered and UNCHANGED if it's the same as the raw line.
+        #: The whole cache is None while the filter is inactive.
+        self.lines: Optional[List[Any]] = None
+        raw.views.append(self)
+
+    def clear_cache(self) -> None:
+        self.lines = None
+
+    def invalidate(self, lo, hi, count):
+        """Replace cache entries lo to hi with count unfiltered entries"""
+        if self.lines is not None:
+            self.lines[lo:hi] = [None] * count
+
+    def _filter_lines(self, lo, hi, raw_lines):
+        if self.bulk_textfilter is not None and \
+                hi - lo >= self.bulk_filter_lines:
+            filtered = self.bulk_textfilter(raw_lines, self.buf, lo)
+        else:
+            filtered = [
+                self.textfilter(txt, self.buf, *self.raw._line_iters(line))
+                for line, txt in enumerate(raw_lines, lo)
+            ]
+        unchanged = self.UNCHANGED
+        self.lines[lo:hi] = [
+            unchanged if txt == raw_txt else txt
+            for txt, raw_txt in zip(filtered, raw_lines)
+        ]
+
+    def __getitem__(self, key):
+        if not self.active():
+            self.lines = None
+            return self.raw[key]
+        if self.lines is None:
+            self.lines = [None] * len(self.raw)
+
+        if isinstance(key, slice):
+            lo, hi, _ = key.indices(len(self.raw))
+            raw_lines = self.raw[lo:hi]
+
+            lines = self.lines
+            idx = lo
+            while idx < hi:
+                try:
+                    start = lines.index(None, idx, hi)
+                except ValueError:
+                    break
+                end = start + 1
+                while end < hi and lines[end] is None:
+                    end += 1
+                self._filter_lines(
+                    start, end, raw_lines[start - lo:end - lo])
+                idx = end
+
+            unchanged = self.UNCHANGED
+            return [
+                raw_txt if txt is unchanged else txt
+                for txt, raw_txt in zip(lines[lo:hi], raw_lines)
+            ]
+
+        elif isinstance(key, int):
+            raw_txt = self.raw[key]
+            if self.lines[key] is None:
+                self._filter_lines(key, key + 1, [raw_txt])
+            txt = self.lines[key]
+            return raw_txt if txt is self.UNCHANGED else txt
+
+    def __len__(self):
+        return len(self.raw)
+
+
 class BufferAction:
     """A helper to undo/redo text insertion/deletion into/from a text buffer"""
 
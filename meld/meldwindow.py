@@ -39,7 +39,7 @@ from meld.misc import guess_if_remote_x11, debug_print, performance_monitor
 from meld.newdifftab import NewDiffTab
 from meld.recent import RecentType, recent_comparisons
 from meld.settings import get_meld_settings
-from meld.task import LifoScheduler
+from meld.task import LifoScheduler, take_pause
 from meld.ui.notebooklabel import NotebookLabel
 from meld.vcview import VcView
 from meld.windowstate import SavedWindowState
@@ -245,6 +245,7 @@ class MeldWindow(Gtk.ApplicationWindow):
             debug_print(f"Idle handler pending tasks: {[t.__name__ for t in self.scheduler._tasks]}")
         
         ret = self.scheduler.iteration()
+        interval = take_pause()
         if ret and isinstance(ret, str):
             timestamp = time.strftime("%H:%M:%S")
             tooltip_text = f"[{timestamp}] {ret}"
@@ -261,7 +262,12 @@ class MeldWindow(Gtk.ApplicationWindow):
         if pending:
             debug_print(f"Idle handler tasks still pending: {pending}")
             self.spinner.start()
-            self.idle_hooked = GLib.idle_add(self.on_idle)
+            if interval:
+                # The current task is waiting on work elsewhere, so
+                # check back later rather than spinning the main loop.
+                self.idle_hooked = GLib.timeout_add(interval, self.on_idle)
+            else:
+                self.idle_hooked = GLib.idle_add(self.on_idle)
         else:
             debug_print("Idle handler no more pending tasks")
             self.spinner.stop()
@@ -277,7 +283,8 @@ class MeldWindow(Gtk.ApplicationWindow):
                 stop_action.set_enabled(False)
         
         debug_print(f"Idle handler took {time.time() - start_time:.3f} seconds")
-        return pending
+        # The next iteration, if any, has been scheduled above
+        return False
 
     def on_scheduler_runnable(self, sched):
         debug_print("Scheduler runnable triggered")
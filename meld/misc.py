@@ -388,22 +388,11 @@ def merge_intervals(
     return merged_intervals
 
 
-def apply_text_filters(
+def text_filter_ranges(
     txt: AnyStr,
     regexes: Sequence[Pattern],
-    apply_fn: Optional[Callable[[int, int], None]] = None
-) -> AnyStr:
-    """Apply text filters
-
-    Text filters "regexes", resolved as regular expressions are applied
-    to "txt". "txt" may be either strings or bytes, but the supplied
-    regexes must match the type.
-
-    "apply_fn" is a callable run for each filtered interval
-    """
-    empty_string = b"" if isinstance(txt, bytes) else ""
-    newline = b"\n" if isinstance(txt, bytes) else "\n"
-
+) -> List[Tuple[int, int]]:
+    """Find the sorted, merged ranges of txt matched by text filters"""
     filter_ranges = []
     for r in regexes:
         if not r:
@@ -425,7 +414,26 @@ def apply_text_filters(
                 if span != (-1, -1) and span[0] != span[1]:
                     filter_ranges.append(span)
 
-    filter_ranges = merge_intervals(filter_ranges)
+    return merge_intervals(filter_ranges)
+
+
+def apply_text_filters(
+    txt: AnyStr,
+    regexes: Sequence[Pattern],
+    apply_fn: Optional[Callable[[int, int], None]] = None
+) -> AnyStr:
+    """Apply text filters
+
+    Text filters "regexes", resolved as regular expressions are applied
+    to "txt". "txt" may be either strings or bytes, but the supplied
+    regexes must match the type.
+
+    "apply_fn" is a callable run for each filtered interval
+    """
+    empty_string = b"" if isinstance(txt, bytes) else ""
+    newline = b"\n" if isinstance(txt, bytes) else "\n"
+
+    filter_ranges = text_filter_ranges(txt, regexes)
 
     if apply_fn:
         for (start, end) in reversed(filter_ranges):
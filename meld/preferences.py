@@ -269,10 +269,12 @@ class PreferencesDialog(Gtk.Dialog):
     checkbutton_show_overview_map = Gtk.Template.Child()
     checkbutton_show_whitespace = Gtk.Template.Child()
     checkbutton_spaces_instead_of_tabs = Gtk.Template.Child()
+    checkbutton_speed_large_files = Gtk.Template.Child()
     checkbutton_use_syntax_highlighting = Gtk.Template.Child()
     checkbutton_wrap_text = Gtk.Template.Child()
     checkbutton_wrap_word = Gtk.Template.Child()
     column_list_vbox = Gtk.Template.Child()
+    combo_diff_algorithm = Gtk.Template.Child()
     combo_file_order = Gtk.Template.Child()
     combo_merge_order = Gtk.Template.Child()
     combo_overview_map = Gtk.Template.Child()
@@ -310,6 +312,7 @@ class PreferencesDialog(Gtk.Dialog):
             ('vc-commit-margin', self.spinbutton_commit_margin, 'value'),
             ('vc-break-commit-message', self.checkbutton_break_commit_lines, 'active'),  # noqa: E501
             ('ignore-blank-lines', self.checkbutton_ignore_blank_lines, 'active'),  # noqa: E501
+            ('speed-large-files', self.checkbutton_speed_large_files, 'active'),  # noqa: E501
             # Sensitivity bindings must come after value bindings, or the key
             # writability in gsettings overrides manual sensitivity setting.
             ('vc-show-commit-margin', self.spinbutton_commit_margin, 'sensitive'),  # noqa: E501
@@ -352,6 +355,7 @@ class PreferencesDialog(Gtk.Dialog):
         self.column_list_vbox.pack_start(columnlist, True, True, 0)
 
         self.combo_timestamp.bind_to('folder-time-resolution')
+        self.combo_diff_algorithm.bind_to('diff-algorithm')
         self.combo_file_order.bind_to('vc-left-is-local')
         self.combo_overview_map.bind_to('overview-map-style')
         self.combo_merge_order.bind_to('vc-merge-file-order')
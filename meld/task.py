@@ -18,6 +18,29 @@
 
 import traceback
 
+#: Milliseconds to wait before the next iteration, as requested by `pause`
+_pause_interval = None
+
+
+def pause(interval=10):
+    """Ask for the next iteration of the current task to be delayed
+
+    Tasks that are only waiting on work elsewhere, e.g., in worker
+    processes, call this before yielding, so that the main loop checks
+    back after `interval` milliseconds instead of either blocking on
+    the work or resuming the task straight away.
+    """
+    global _pause_interval
+    if _pause_interval is None or interval < _pause_interval:
+        _pause_interval = interval
+
+
+def take_pause():
+    """Return and clear the delay requested with `pause`, if any"""
+    global _pause_interval
+    interval, _pause_interval = _pause_interval, None
+    return interval
+
 
 class SchedulerBase:
     """Base class with common functionality for schedulers
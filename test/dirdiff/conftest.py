@@ -50,3 +50,23 @@ def populate(definition, path):
 def create_sample_dir(tmp_path):
     populate(diff_definition, tmp_path)
     yield tmp_path
+
+
+@pytest.fixture
+def cmp_args():
+    """Content comparison arguments, ignoring blank lines and filtering"""
+    return {
+        "shallow-comparison": False,
+        "time-resolution": 10000000000,
+        "ignore_blank_lines": True,
+        "apply-text-filters": True,
+    }
+
+
+@pytest.fixture
+def no_ignore_args(cmp_args):
+    """Content comparison arguments, comparing contents as they are"""
+    return dict(cmp_args, **{
+        "ignore_blank_lines": False,
+        "apply-text-filters": False,
+    })
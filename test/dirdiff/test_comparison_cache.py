@@ -0,0 +1,58 @@
+import os
+
+
+def make_key(*files):
+    return (tuple(files), False, (), False)
+
+
+def test_comparison_cache_lru():
+    from meld.dirdiff import CacheResult, ComparisonCache
+
+    key_size = ComparisonCache.ENTRY_BYTES + 2 * 60
+    cache = ComparisonCache(max_bytes=key_size * 2)
+    keys = [make_key("a/%s" % i, "b/%s" % i) for i in range(3)]
+
+    cache.put(keys[0], CacheResult(None, 0))
+    cache.put(keys[1], CacheResult(None, 1))
+    assert cache.get(keys[0]) == CacheResult(None, 0)
+
+    # keys[1] is now least recently used, so it's the one evicted
+    cache.put(keys[2], CacheResult(None, 2))
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == CacheResult(None, 0)
+    assert cache.get(keys[2]) == CacheResult(None, 2)
+
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["bytes"] <= cache.max_bytes
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 3
+    assert stats["misses"] == 1
+    assert set(cache.keys_by_path) == {
+        "a/0", "b/0", "a/2", "b/2"}
+
+
+def test_comparison_cache_invalidate():
+    from meld.dirdiff import CacheResult, ComparisonCache
+
+    cache = ComparisonCache()
+    inside = make_key(os.path.join("a", "d", "x"), os.path.join("b", "d", "x"))
+    sibling = make_key(os.path.join("a", "dd", "x"), os.path.join("b", "dd", "x"))
+    exact = make_key(os.path.join("a", "y"), os.path.join("b", "y"))
+    for key in (inside, sibling, exact):
+        cache.put(key, CacheResult(None, 0))
+
+    cache.invalidate([os.path.join("b", "d")])
+    assert cache.get(inside) is None
+    assert cache.get(sibling) is not None
+
+    cache.invalidate([os.path.join("a", "y")])
+    assert cache.get(exact) is None
+    assert cache.stats()["invalidations"] == 2
+    assert cache.stats()["entries"] == 1
+
+    # Once every entry is gone, so is the path index
+    cache.invalidate([os.path.join("a", "dd") + os.sep])
+    assert cache.stats()["entries"] == 0
+    assert cache.keys_by_path == {}
+    assert cache.children == {}
@@ -0,0 +1,82 @@
+import os
+import re
+from unittest import mock
+
+import pytest
+
+
+@pytest.fixture
+def digest_store(tmp_path):
+    from meld.digeststore import DigestStore
+
+    store = DigestStore(str(tmp_path / "digests.sqlite3"))
+    yield store
+    store.close()
+
+
+def test_digest_store_roundtrip(create_sample_dir, digest_store):
+    from meld.digeststore import RAW, content_digest
+
+    path = create_sample_dir / "a" / "a.txt"
+    other = create_sample_dir / "b" / "b.txt"
+    stat_result = os.stat(path)
+    digest = content_digest(b"")
+
+    assert digest_store.get([stat_result]) == [None]
+    digest_store.put([(stat_result, digest)], RAW)
+    assert digest_store.get([stat_result, os.stat(other)]) == [digest, None]
+    assert digest_store.get([stat_result], "other-variant") == [None]
+
+    # Modifying the file means its digest no longer applies
+    path.write_bytes(b"changed")
+    os.utime(path, ns=(0, stat_result.st_mtime_ns + 1))
+    assert digest_store.get([os.stat(path)]) == [None]
+
+
+@pytest.mark.parametrize(
+    "files, regexes, expected",
+    [
+        (("a/d/d.txt", "b/d/d.txt"), [], 0),  # Same
+        (("a/crlf.txt", "b/lf.txt"), [], 1),  # SameFiltered
+        (("a/crlf.txt", "a/crlftrailing.txt"), [re.compile(b"foo")], 1),
+        (("a/e/g/g.txt", "b/e/g/g.txt"), [], 4),  # Different
+        (("a/c/c.txt", "b/c/c.txt", "b/b.txt"), [], 0),
+        (("a/crlf.txt", "b/lf.txt", "b/lftrailing.txt"), [], 1),
+        (("a/d/d.txt", "b/d/d.txt", "b/d/d.1.txt"), [], 4),
+    ],
+)
+def test_files_same_from_digests(
+        create_sample_dir, digest_store, cmp_args, files, regexes, expected):
+    from meld import dirdiff
+
+    files = [str(create_sample_dir / f) for f in files]
+    result = dirdiff._files_same(
+        files, regexes, cmp_args, digest_store=digest_store)
+    assert result == expected
+
+    # With digests stored, comparing again doesn't need the contents
+    dirdiff._cache.clear()
+    with mock.patch("builtins.open", side_effect=AssertionError):
+        result = dirdiff._files_same(
+            files, regexes, cmp_args, digest_store=digest_store)
+    assert result == expected
+
+
+def test_files_same_hashes_while_comparing(
+        create_sample_dir, digest_store, cmp_args):
+    from meld import dirdiff
+    from meld.digeststore import content_digest
+
+    files = [str(create_sample_dir / f) for f in ("a/d/d.txt", "b/d/d.txt")]
+    dirdiff._cache.clear()
+    # Identical files are hashed as they're compared, not read again
+    with mock.patch.object(
+            dirdiff, "content_digest", side_effect=AssertionError):
+        result = dirdiff._files_same(
+            files, [], cmp_args, digest_store=digest_store)
+    assert result == dirdiff.Same
+
+    with open(files[0], "rb") as f:
+        digest = content_digest(f.read())
+    stats = [os.stat(f) for f in files]
+    assert digest_store.get(stats) == [digest, digest]
@@ -80,6 +80,36 @@ dodgy_args["shallow-comparison"] = True
             no_ignore_args,
             DiffResult.Different,
         ),
+        # three-way empty files
+        (("a/a.txt", "a/c/c.txt", "b/c/c.txt"), [], cmp_args, DiffResult.Same),
+        # three-way 4.1kb files, same
+        (
+            ("a/d/d.txt", "b/d/d.txt", "b/d/d.txt"),
+            [],
+            cmp_args,
+            DiffResult.Same,
+        ),
+        # three-way 4.1kb files, last one different
+        (
+            ("a/d/d.txt", "b/d/d.txt", "b/d/d.2.txt"),
+            [],
+            cmp_args,
+            DiffResult.Different,
+        ),
+        # three-way CRLF and LF, ignoring blank lines
+        (
+            ("a/crlf.txt", "b/lf.txt", "b/lftrailing.txt"),
+            [],
+            cmp_args,
+            DiffResult.SameFiltered,
+        ),
+        # three-way CRLF and LF, not ignoring blank lines
+        (
+            ("a/crlf.txt", "b/lf.txt", "b/lftrailing.txt"),
+            [],
+            no_ignore_args,
+            DiffResult.Different,
+        ),
     ],
 )
 def test_files_same(create_sample_dir, files, regexes, comparison_args, expected):
@@ -0,0 +1,49 @@
+import concurrent.futures
+
+
+def test_pending_rows_results():
+    from meld.dirdiff import Different, PendingRows, Same
+
+    future = concurrent.futures.Future()
+    rows = [
+        (["a/x", "b/x"], [True, True], future),
+        (["a/y", "b/y"], [True, False], None),
+        (["a/z", "b/z"], [True, True], Same),
+    ]
+    listing = PendingRows(None, ["a", "b"], False, False, rows)
+
+    assert not listing.done()
+    assert listing.futures() == [future]
+
+    future.set_result(Different)
+    assert listing.done()
+    assert listing.futures() == []
+    assert [result for *_, result in listing.results()] == [
+        Different, None, Same]
+
+
+def test_comparison_pool_files_same(create_sample_dir, no_ignore_args):
+    from meld.dirdiff import (
+        Different,
+        Same,
+        StatCache,
+        _files_same,
+        get_comparison_pool,
+    )
+
+    stat_cache = StatCache()
+    rows = [
+        ("a/d/d.txt", "b/d/d.txt", Same),
+        ("a/d/d.txt", "b/d/d.1.txt", Different),
+        ("a/d/d.txt", "b/d/d.2.txt", Different),
+        ("a/c/c.txt", "b/c/c.txt", Same),
+    ]
+    pool = get_comparison_pool()
+    futures = [
+        pool.submit(
+            _files_same,
+            [str(create_sample_dir / a), str(create_sample_dir / b)],
+            [], no_ignore_args, stat_cache=stat_cache)
+        for a, b, _expected in rows
+    ]
+    assert [f.result() for f in futures] == [e for *_, e in rows]
@@ -0,0 +1,60 @@
+import os
+from unittest import mock
+
+import pytest
+
+
+def test_stat_cache_scandir_entries(create_sample_dir):
+    from meld.dirdiff import StatCache
+
+    stat_cache = StatCache()
+    root = os.fspath(create_sample_dir / "a")
+    with os.scandir(root) as scanner:
+        for entry in scanner:
+            stat_cache.add_entry(entry)
+
+    with mock.patch("os.stat") as os_stat, mock.patch("os.lstat") as os_lstat:
+        assert stat_cache.isdir(os.path.join(root, "c"))
+        assert not stat_cache.isdir(os.path.join(root, "a.txt"))
+        assert stat_cache.exists(os.path.join(root, "crlf.txt"))
+        assert stat_cache.lstat(os.path.join(root, "a.txt")).st_size == 0
+    os_stat.assert_not_called()
+    os_lstat.assert_not_called()
+
+
+def test_stat_cache_snapshot(create_sample_dir):
+    from meld.dirdiff import StatCache
+
+    stat_cache = StatCache()
+    path = create_sample_dir / "a" / "a.txt"
+    missing = create_sample_dir / "a" / "missing.txt"
+
+    assert stat_cache.exists(path)
+    assert not stat_cache.exists(missing)
+
+    path.unlink()
+    missing.write_bytes(b"")
+
+    # Results, including failures, are kept for the cache's lifetime
+    assert stat_cache.exists(path)
+    assert not stat_cache.exists(missing)
+    with pytest.raises(FileNotFoundError):
+        stat_cache.stat(missing)
+
+
+def test_files_same_uses_stat_cache(create_sample_dir, no_ignore_args):
+    from meld.dirdiff import Same, StatCache, _files_same
+
+    files = [
+        os.fspath(create_sample_dir / "a" / "d" / "d.txt"),
+        os.fspath(create_sample_dir / "b" / "d" / "d.txt"),
+    ]
+    stat_cache = StatCache()
+    for f in files:
+        stat_cache.stat(f)
+
+    with mock.patch("os.stat") as os_stat:
+        result = _files_same(
+            files, [], no_ignore_args, stat_cache=stat_cache)
+    assert result == Same
+    os_stat.assert_not_called()
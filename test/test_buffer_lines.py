@@ -3,7 +3,7 @@ from unittest import mock
 
 import pytest
 
-from meld.meldbuffer import BufferLines, MeldBuffer
+from meld.meldbuffer import BufferLines, FilteredBufferLines, MeldBuffer
 
 text = ("""0
 1
@@ -144,3 +144,65 @@ def test_meld_buffer_cache_debug(caplog, buffer_setup):
     )
     assert len(caplog.records) == 1
     assert caplog.records[0].msg.startswith("Cache line count does not match")
+
+
+@pytest.mark.parametrize("newline", ["\n", "\r\n", "\r"])
+def test_meld_buffer_bulk_fetch(newline):
+    buf = MeldBuffer()
+    buf.set_text(newline.join(text.splitlines()))
+    buffer_lines = BufferLines(buf)
+    buffer_lines.bulk_fetch_lines = 2
+
+    # Line 5 is already cached, so lines are fetched in two runs
+    assert buffer_lines[5] == "5"
+    assert buffer_lines[:] == text.splitlines()
+    assert buffer_lines.lines == text.splitlines()
+
+
+def test_meld_buffer_bulk_textfilter(buffer_setup):
+    buf, _ = buffer_setup
+    calls = []
+
+    def textfilter(txt, buf, start_iter, end_iter):
+        return txt + "!"
+
+    def bulk_textfilter(lines, buf, first_line):
+        calls.append((first_line, len(lines)))
+        return [txt + "!" for txt in lines]
+
+    buffer_lines = BufferLines(
+        buf, textfilter, bulk_textfilter=bulk_textfilter)
+    buffer_lines.bulk_fetch_lines = 3
+
+    # Runs shorter than bulk_fetch_lines use the per-line filter
+    assert buffer_lines[0:2] == ["0!", "1!"]
+    assert buffer_lines[:] == [t + "!" for t in text.splitlines()]
+    assert calls == [(2, 9)]
+
+
+def test_filtered_buffer_lines(buffer_setup):
+    buf, buffer_lines = buffer_setup
+    active = True
+
+    def textfilter(txt, buf, start_iter, end_iter):
+        return txt.replace("1", "")
+
+    filtered = FilteredBufferLines(
+        buffer_lines, textfilter, active=lambda: active)
+
+    assert filtered[:] == ["0", "", "2", "3", "4", "5", "6", "7", "8", "9",
+                           "0"]
+    # Only lines changed by the filter are stored
+    unchanged = FilteredBufferLines.UNCHANGED
+    assert [i for i, txt in enumerate(filtered.lines)
+            if txt is not unchanged] == [1, 10]
+
+    # Edits invalidate the filtered cache along with the raw one
+    buf.insert(buf.get_iter_at_line(1), "1\n")
+    assert filtered.lines[0:4] == [unchanged, None, None, unchanged]
+    assert filtered[1:3] == ["", ""]
+
+    # While inactive, raw lines are used and nothing is stored
+    active = False
+    assert filtered[1] == "1"
+    assert filtered.lines is None
@@ -1,7 +1,20 @@
 
+import concurrent.futures
+import queue
+import time
 import unittest
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
 
-from meld.matchers import myers
+from meld.matchers import (
+    chunks,
+    diffutil,
+    helpers,
+    myers,
+    parallel,
+    patience,
+)
+from meld.task import take_pause
 
 
 class MatchersTests(unittest.TestCase):
@@ -30,6 +43,24 @@ class MatchersTests(unittest.TestCase):
         blocks = matcher.get_matching_blocks()
         self.assertEqual(blocks, r)
 
+    def test_token_inline_matcher(self):
+        a = 'the quick brown fox ' * 200 + 'jumps over'
+        b = 'the quick brown fox ' * 200 + 'jumped over'
+        matcher = myers.TokenInlineMyersSequenceMatcher(None, a, b)
+        matcher.refine_limit = 100
+        start = len(a) - len('jumps over')
+        self.assertEqual(matcher.get_opcodes(), [
+            ('equal', 0, start + 4, 0, start + 4),
+            ('replace', start + 4, start + 5, start + 4, start + 6),
+            ('equal', start + 5, len(a), start + 6, len(b)),
+        ])
+
+    def test_token_inline_matcher_short_texts(self):
+        a, b = 'abcdef', 'xbcdfy'
+        matcher = myers.TokenInlineMyersSequenceMatcher(None, a, b)
+        expected = myers.InlineMyersSequenceMatcher(None, a, b)
+        self.assertEqual(matcher.get_opcodes(), expected.get_opcodes())
+
     def test_sync_point_matcher0(self):
         a = list('012a3456c789')
         b = list('0a3412b5678')
@@ -54,3 +85,579 @@ class MatchersTests(unittest.TestCase):
             None, a, b, [(3, 2), (8, 6)])
         blocks = matcher.get_matching_blocks()
         self.assertEqual(blocks, r)
+
+    def test_line_interner_shared_ids(self):
+        interner = myers.LineInterner()
+        a = interner.intern(['foo', 'bar', 'foo', 'baz'])
+        b = interner.intern(['baz', 'qux', 'bar'])
+        self.assertEqual(list(a), [0, 1, 0, 2])
+        self.assertEqual(list(b), [2, 3, 1])
+        self.assertEqual(len(interner), 4)
+
+    def test_interned_matcher_opcodes(self):
+        a = ['def foo():', '    pass', '', 'def bar():', '    return 1']
+        b = ['def foo():', '    return 2', '', 'def bar():', '    pass']
+        r = [
+            ('equal', 0, 1, 0, 1),
+            ('replace', 1, 2, 1, 2),
+            ('equal', 2, 4, 2, 4),
+            ('replace', 4, 5, 4, 5),
+        ]
+        matcher = myers.MyersSequenceMatcher(
+            None, a, b, interner=myers.LineInterner())
+        self.assertEqual(matcher.get_opcodes(), r)
+
+    def test_linear_space_matcher(self):
+        a = list('abcbdefgabcdefg')
+        b = list('gfabcdefcd')
+        matcher = myers.LinearSpaceMyersSequenceMatcher(None, a, b)
+        blocks = matcher.get_matching_blocks()
+        # Equal-cost alternatives may differ, but the diff must be minimal
+        self.assertEqual(sum(size for _, _, size in blocks), 8)
+        self.assertEqual(blocks[-1], (15, 10, 0))
+        for ai, bj, size in blocks:
+            self.assertEqual(a[ai:ai + size], b[bj:bj + size])
+
+    def test_linear_space_matcher_opcodes(self):
+        a = ['a', 'b', 'c', 'd', 'e', 'f', 'g']
+        b = ['a', 'x', 'c', 'd', 'y', 'z', 'f', 'g']
+        r = [
+            ('equal', 0, 1, 0, 1),
+            ('replace', 1, 2, 1, 2),
+            ('equal', 2, 4, 2, 4),
+            ('replace', 4, 5, 4, 6),
+            ('equal', 5, 7, 6, 8),
+        ]
+        matcher = myers.LinearSpaceMyersSequenceMatcher(None, a, b)
+        self.assertEqual(matcher.get_opcodes(), r)
+
+    def test_cost_limited_matcher_approximates(self):
+        a = list('abcbdefgabcdefg')
+        b = list('gfabcdefcd')
+        for matcher_class in (
+                myers.MyersSequenceMatcher,
+                myers.LinearSpaceMyersSequenceMatcher):
+            matcher = matcher_class(None, a, b, cost_limit=0)
+            blocks = matcher.get_matching_blocks()
+            self.assertTrue(matcher.approximate)
+            self.assertEqual(blocks[-1], (15, 10, 0))
+            for ai, bj, size in blocks:
+                self.assertEqual(a[ai:ai + size], b[bj:bj + size])
+
+    def test_unlimited_matcher_is_exact(self):
+        a = list('abcbdefgabcdefg')
+        b = list('gfabcdefcd')
+        matcher = myers.MyersSequenceMatcher(None, a, b, time_limit=60)
+        matcher.get_matching_blocks()
+        self.assertFalse(matcher.approximate)
+
+    def test_patience_matcher_unique_anchors(self):
+        a = ['a', '}', 'b', '}', 'c']
+        b = ['c', '}', 'a', '}', 'b']
+        anchors = patience.unique_anchors(a, 0, len(a), b, 0, len(b))
+        self.assertEqual(anchors, [(0, 2), (2, 4)])
+
+    def test_patience_matcher(self):
+        a = [
+            'def foo():', '    x = 1', '}',
+            'def bar():', '    y = 2', '}',
+        ]
+        b = [
+            'def bar():', '    y = 2', '}',
+            'def foo():', '    x = 1', '}',
+        ]
+        r = [(3, 0, 2), (5, 5, 1), (6, 6, 0)]
+        matcher = patience.PatienceSequenceMatcher(None, a, b)
+        blocks = matcher.get_matching_blocks()
+        self.assertEqual(blocks, r)
+
+    def test_anchored_matcher(self):
+        a = ['line %d' % i for i in range(200)]
+        b = list(a)
+        b[5] = 'changed'
+        del b[30]
+        b.insert(150, 'inserted')
+        matcher = parallel.AnchoredMyersSequenceMatcher(None, a, b)
+        matcher.min_slice_lines = 10
+        blocks = matcher.get_matching_blocks()
+        self.assertTrue(matcher.syncpoints)
+        self.assertEqual(blocks[-1], (200, 200, 0))
+        self.assertEqual(sum(size for ai, bj, size in blocks), 198)
+        for ai, bj, size in blocks:
+            self.assertEqual(a[ai:ai + size], b[bj:bj + size])
+
+    def test_anchored_matcher_settles_in_order(self):
+        a = ['line %d' % i for i in range(200)]
+        b = list(a)
+        b[5] = 'changed'
+        b.insert(120, 'inserted')
+        matcher = parallel.AnchoredMyersSequenceMatcher(None, a, b)
+        matcher.min_slice_lines = 10
+        settled = []
+        for i in matcher.initialise():
+            settled.append(matcher.settled_opcodes())
+        opcodes = matcher.get_opcodes()
+        self.assertGreater(len(matcher.split_matching_blocks), 1)
+        self.assertEqual(settled[-1], opcodes)
+        for partial in settled:
+            self.assertEqual(partial, opcodes[:len(partial)])
+
+    def test_match_concurrently_cancels_on_close(self):
+        futures = []
+
+        class StalledPool:
+            def submit(self, *args):
+                futures.append(concurrent.futures.Future())
+                return futures[-1]
+
+        task = (myers.MyersSequenceMatcher, 'abc', 'abd', None, None)
+        with mock.patch.object(
+                parallel, 'get_process_pool', return_value=StalledPool()):
+            take_pause()
+            step = parallel.match_concurrently([task, task])
+            self.assertIsNone(next(step))
+            self.assertEqual(take_pause(), 10)
+            step.close()
+        self.assertEqual(len(futures), 2)
+        self.assertTrue(all(f.cancelled() for f in futures))
+
+    def test_match_concurrently_survives_broken_pool(self):
+        class BrokenPool:
+            def __init__(self):
+                self.shut_down = False
+
+            def submit(self, *args):
+                future = concurrent.futures.Future()
+                future.set_exception(BrokenProcessPool())
+                return future
+
+            def shutdown(self, wait=True):
+                self.shut_down = True
+
+        pool = BrokenPool()
+        task = (myers.MyersSequenceMatcher, 'abc', 'abd', None, None)
+        expected = parallel.match_slice(*task)
+        with mock.patch.object(parallel, '_process_pool', pool):
+            results = list(parallel.match_concurrently([task, task]))
+            self.assertIsNone(parallel._process_pool)
+        self.assertEqual(results[-1], [expected, expected])
+        self.assertTrue(pool.shut_down)
+
+    def test_process_pool_failure_is_remembered(self):
+        with mock.patch.object(parallel, '_process_pool', None), \
+                mock.patch.object(parallel, '_process_pool_failed', False), \
+                mock.patch.object(
+                    concurrent.futures, 'ProcessPoolExecutor',
+                    side_effect=OSError) as executor:
+            self.assertIsNone(parallel.get_process_pool())
+            self.assertIsNone(parallel.get_process_pool())
+        self.assertEqual(executor.call_count, 1)
+
+    def test_concurrent_three_way_diffs(self):
+        middle = ['line %d' % i for i in range(100)]
+        left = list(middle)
+        left[10:12] = ['left']
+        right = list(middle)
+        right[50] = 'right'
+        right.insert(80, 'inserted')
+        sequences = [left, middle, right]
+
+        diffs = []
+        for threshold in (1000, 10):
+            differ = diffutil.Differ()
+            differ.parallel_pair_threshold = threshold
+            for i in differ.set_sequences_iter(sequences):
+                pass
+            diffs.append(differ.diffs)
+        self.assertEqual(diffs[0], diffs[1])
+        self.assertEqual(diffs[1][0], [('replace', 10, 12, 10, 11)])
+        self.assertEqual(
+            diffs[1][1],
+            [('replace', 50, 51, 50, 51), ('insert', 80, 80, 80, 81)])
+
+    def test_background_diffs(self):
+        middle = ['line %d' % i for i in range(100)]
+        left = list(middle)
+        left[10:12] = ['left']
+        right = list(middle)
+        right[50] = 'right'
+        sequences = [left, middle, right]
+
+        diffs = []
+        for background in (False, True):
+            differ = diffutil.Differ()
+            differ.background_match_threshold = 10
+            for i in differ.set_sequences_iter(sequences, background):
+                pass
+            diffs.append([list(d) for d in differ.diffs])
+        self.assertEqual(diffs[0], diffs[1])
+
+        differ = diffutil.Differ()
+        differ.background_match_threshold = 10
+        step = differ.set_sequences_iter(sequences, background=True)
+        next(step)
+        differ.cancel_background_match()
+        self.assertEqual(list(step), [])
+        self.assertFalse(differ._initialised)
+
+    def test_cancel_pool_diffs(self):
+        futures = []
+
+        class StalledPool:
+            def submit(self, *args):
+                futures.append(concurrent.futures.Future())
+                return futures[-1]
+
+        middle = ['line %d' % i for i in range(100)]
+        sequences = [middle[10:], middle, middle[:90]]
+        differ = diffutil.Differ()
+        differ.parallel_pair_threshold = 10
+        differ.background_match_threshold = 10
+        with mock.patch.object(
+                parallel, 'get_process_pool', return_value=StalledPool()):
+            step = differ.set_sequences_iter(sequences, background=True)
+            next(step)
+            differ.cancel_background_match()
+        self.assertEqual(list(step), [])
+        self.assertFalse(differ._initialised)
+        self.assertEqual(len(futures), 2)
+        self.assertTrue(all(f.cancelled() for f in futures))
+
+    def test_background_match_result_after_exit(self):
+        # The worker can post its result and exit between the queue
+        # being found empty and its exit code being checked.
+        result = ([], False)
+        messages = [None, ("result", result)]
+
+        def get_nowait():
+            message = messages.pop(0)
+            if message is None:
+                raise queue.Empty
+            return message
+
+        match = diffutil.BackgroundMatch.__new__(diffutil.BackgroundMatch)
+        match.cancelled = mock.Mock(is_set=lambda: False)
+        match.results = mock.Mock(get_nowait=get_nowait)
+        match.worker = mock.Mock(exitcode=0)
+        match.result = None
+        self.assertTrue(match.poll())
+        self.assertEqual(match.result, result)
+
+    def test_chunk_array_views(self):
+        chunk = myers.DiffChunk('insert', 2, 2, 3, 5)
+        store = chunks.ChunkArray([chunk, None])
+        view = store.view(0)
+        self.assertEqual(view, chunk)
+        self.assertEqual(hash(view), hash(chunk))
+        self.assertEqual(view.tag, 'insert')
+        self.assertEqual(view[3], 3)
+        self.assertEqual(tuple(store.reversed_view(0)), ('delete', 3, 5, 2, 2))
+        self.assertEqual(store.reversed_view(0), diffutil.reverse_chunk(chunk))
+        self.assertIsNone(store.view(1))
+
+        store.offset(0, 1, 2)
+        store[1:] = [('replace', 4, 5, 7, 8)]
+        self.assertEqual(list(store), [
+            ('insert', 3, 3, 5, 7),
+            ('replace', 4, 5, 7, 8),
+        ])
+
+    def test_chunk_line_index(self):
+        # Chunks 0 and 2 are at lines 2-4 and 8-9; chunk 1 is an insert
+        # at line 6, and so claims that line.
+        index = chunks.ChunkLineIndex.from_bounds(
+            10, [0, 1, 2], [2, 6, 8], [4, 6, 9])
+        self.assertEqual(index.locate(0), (None, None, 0))
+        self.assertEqual(index.locate(3), (0, None, 1))
+        self.assertEqual(index.locate(4), (None, 0, 1))
+        self.assertEqual(index.locate(6), (1, 0, 2))
+        self.assertEqual(index.locate(7), (None, 1, 2))
+        self.assertEqual(index.locate(8), (2, 1, None))
+        self.assertEqual(index.locate(10), (None, 2, None))
+        self.assertEqual(index.locate(11), (None, None, None))
+
+    def test_incremental_change_sequence(self):
+        middle = ['line %d' % i for i in range(100)]
+        left = list(middle)
+        left[10] = 'left'
+        left[60] = 'left'
+        right = list(middle)
+        right[12] = 'right'
+        right[80] = 'right'
+        texts = [left, middle, right]
+
+        differ = diffutil.Differ()
+        for i in differ.set_sequences_iter(texts):
+            pass
+        changes = []
+        differ.connect('diffs-changed', lambda d, c: changes.append(c))
+        middle.insert(40, 'inserted')
+        differ.change_sequence(1, 40, 1, texts)
+
+        expected = diffutil.Differ()
+        for i in expected.set_sequences_iter(texts):
+            pass
+        self.assertEqual(list(differ.all_changes()),
+                         list(expected.all_changes()))
+        self.assertEqual(differ.conflicts, expected.conflicts)
+        for pane in range(3):
+            for line in range(len(texts[pane]) + 1):
+                self.assertEqual(differ.locate_chunk(pane, line),
+                                 expected.locate_chunk(pane, line))
+        removed, added, modified = changes[-1]
+        self.assertEqual(removed, set())
+        chunk = ('delete', 40, 41, 40, 40)
+        self.assertEqual(added, {(chunk, chunk)})
+
+    def test_conflicts_follow_edits(self):
+        middle = ['line %d' % i for i in range(200)]
+        left = list(middle)
+        right = list(middle)
+        for i in range(20, 200, 20):
+            left[i] = 'left'
+            right[i] = 'right'
+        texts = [left, middle, right]
+
+        differ = diffutil.Differ()
+        for i in differ.set_sequences_iter(texts):
+            pass
+        # Enough edits to apply the lazy offsets in bulk at least once
+        for edit in range(2 * chunks.OffsetArray.max_points):
+            line = (edit * 37) % 150
+            middle.insert(line, 'inserted %d' % edit)
+            differ.change_sequence(1, line, 1, texts)
+
+        expected = diffutil.Differ()
+        for i in expected.set_sequences_iter(texts):
+            pass
+        self.assertEqual(differ.conflicts, expected.conflicts)
+        self.assertEqual(list(differ.all_changes()),
+                         list(expected.all_changes()))
+
+    def test_chunks_survive_edits(self):
+        middle = ['line %d' % i for i in range(100)]
+        left = list(middle)
+        left[10] = 'left'
+        left[60] = 'left'
+        texts = [left, middle]
+
+        differ = diffutil.Differ()
+        for i in differ.set_sequences_iter(texts):
+            pass
+        chunk = differ.get_chunk(1, 0)
+        changes = list(differ.pair_changes(1, 0))
+        singles = list(differ.single_changes(0))
+        all_changes = list(differ.all_changes())
+        self.assertEqual(chunk, ('replace', 60, 61, 60, 61))
+
+        middle.insert(5, 'inserted')
+        differ.change_sequence(1, 5, 1, texts)
+        self.assertEqual(differ.get_chunk(2, 0), ('replace', 60, 61, 61, 62))
+        self.assertEqual(chunk, ('replace', 60, 61, 60, 61))
+        self.assertEqual(changes, [
+            ('replace', 10, 11, 10, 11), ('replace', 60, 61, 60, 61)])
+        self.assertEqual(singles, [
+            ('replace', 10, 11, 10, 11), ('replace', 60, 61, 60, 61)])
+        self.assertEqual(all_changes, [
+            (('replace', 10, 11, 10, 11), None),
+            (('replace', 60, 61, 60, 61), None)])
+
+    def test_merge_diffs_reads_each_chunk_once(self):
+        class CountingSequence:
+            """Read-only sequence that counts how often it's indexed"""
+
+            def __init__(self, items):
+                self.items = items
+                self.reads = 0
+
+            def __len__(self):
+                return len(self.items)
+
+            def __getitem__(self, index):
+                self.reads += 1
+                return self.items[index]
+
+            def __iter__(self):
+                raise AssertionError("Chunks should be read in place")
+
+        n = 1000
+        seq0 = CountingSequence([
+            myers.DiffChunk('replace', 4 * i, 4 * i + 1, i, i + 1)
+            for i in range(n)])
+        seq1 = CountingSequence([
+            myers.DiffChunk('delete', 4 * i + 2, 4 * i + 3, i, i)
+            for i in range(n)])
+        merged = list(diffutil.Differ()._merge_diffs(seq0, seq1, None))
+        self.assertEqual(len(merged), 2 * n)
+        # Walking both sequences reads each chunk a bounded number of
+        # times, rather than copying or shifting the remaining chunks.
+        self.assertLessEqual(seq0.reads + seq1.reads, 4 * 2 * n)
+
+    def test_build_matching_blocks_order(self):
+        n = 1000
+        matcher = myers.MyersSequenceMatcher(None, [], [])
+        lastsnake = None
+        for i in range(n):
+            lastsnake = (lastsnake, 2 * i, 2 * i, 1)
+        matcher.build_matching_blocks(lastsnake)
+        self.assertEqual(
+            matcher.matching_blocks,
+            [(2 * i, 2 * i, 1) for i in range(n)] + [(0, 0, 0)])
+
+    def test_matcher_pool_drops_superseded_tasks(self):
+        class Owner:
+            def __init__(self):
+                self.finished = []
+
+            def task_priority(self, key):
+                return 0
+
+            def task_finished(self, task_id, texts, opcodes, digest=None):
+                self.finished.append((task_id, texts))
+
+        owner = Owner()
+        pool = helpers.MatcherPool(1)
+        try:
+            first = pool.submit(owner, 'chunk', ('abc', 'abd'))
+            pool.submit(owner, 'chunk', ('abc', 'abe'))
+            last = pool.submit(owner, 'chunk', ('abc', 'abf'))
+            pool.submit(owner, 'other', ('xyz', 'xyy'))
+            pool.cancel(owner, 'other')
+
+            deadline = time.monotonic() + 30
+            while pool.running and time.monotonic() < deadline:
+                pool.poll(timeout=0.1)
+        finally:
+            pool.stop()
+
+        self.assertEqual(owner.finished, [
+            (first, ('abc', 'abd')),
+            (last, ('abc', 'abf')),
+        ])
+
+    def test_matcher_pool_returns_submitted_digest(self):
+        class Owner:
+            def __init__(self):
+                self.digests = []
+
+            def task_priority(self, key):
+                return 0
+
+            def task_finished(self, task_id, texts, opcodes, digest=None):
+                self.digests.append(digest)
+
+        owner = Owner()
+        pool = helpers.MatcherPool(1)
+        try:
+            pool.submit(owner, 'chunk', ('abc', 'abd'), b'digest')
+            deadline = time.monotonic() + 30
+            while pool.running and time.monotonic() < deadline:
+                pool.poll(timeout=0.1)
+        finally:
+            pool.stop()
+
+        self.assertEqual(owner.digests, [b'digest'])
+
+    def test_matcher_pool_runs_tasks_by_priority(self):
+        class Owner:
+            def __init__(self):
+                self.finished = []
+                self.visible = 0
+
+            def task_priority(self, key):
+                return abs(key - self.visible)
+
+            def task_finished(self, task_id, texts, opcodes, digest=None):
+                self.finished.append(texts[1])
+
+        owner = Owner()
+        pool = helpers.MatcherPool(1)
+        try:
+            for key in range(6):
+                pool.submit(owner, key, ('abc', str(key)))
+            # The first task was already running; the rest should follow
+            # the new visible region.
+            owner.visible = 4
+            pool.reprioritise(owner)
+
+            deadline = time.monotonic() + 30
+            while pool.running and time.monotonic() < deadline:
+                pool.poll(timeout=0.1)
+        finally:
+            pool.stop()
+
+        self.assertEqual(owner.finished, ['0', '4', '3', '5', '2', '1'])
+
+    def test_match_cache_evicts_least_recently_used(self):
+        opcodes = [myers.DiffChunk('replace', 0, 1, 0, 1)] * 10
+        cache = helpers.MatchCache()
+        cache.put(cache.digest(('a', 'b')), opcodes)
+        cache.max_bytes = cache.size * 2
+        cache.put(cache.digest(('c', 'd')), opcodes)
+
+        self.assertEqual(cache.get(cache.digest(('a', 'b'))), opcodes)
+        self.assertIsNone(cache.get(cache.digest(('ab', ''))))
+        cache.put(cache.digest(('e', 'f')), opcodes)
+
+        self.assertIsNone(cache.get(cache.digest(('c', 'd'))))
+        self.assertEqual(cache.get(cache.digest(('a', 'b'))), opcodes)
+        self.assertEqual(cache.get(cache.digest(('e', 'f'))), opcodes)
+        self.assertLessEqual(cache.size, cache.max_bytes)
+        self.assertEqual(cache.stats(), {
+            'entries': 2,
+            'bytes': cache.size,
+            'hits': 3,
+            'misses': 2,
+            'evictions': 1,
+        })
+
+    def test_matcher_pool_shares_large_texts(self):
+        class Owner:
+            def __init__(self):
+                self.finished = []
+
+            def task_priority(self, key):
+                return 0
+
+            def task_finished(self, task_id, texts, opcodes, digest=None):
+                self.finished.append(opcodes)
+
+        text1 = 'abcdefgh\u00e9' * 10000
+        textn = text1[:5000] + 'XYZ' + text1[5010:]
+        expected = helpers.MatcherWorker.matcher_class(
+            None, text1, textn).get_opcodes()
+
+        owner = Owner()
+        pool = helpers.MatcherPool(1)
+        try:
+            pool.submit(owner, 'chunk', (text1, textn))
+            deadline = time.monotonic() + 30
+            while pool.running and time.monotonic() < deadline:
+                pool.poll(timeout=0.1)
+        finally:
+            pool.stop()
+
+        self.assertEqual(owner.finished, [expected])
+        self.assertEqual(pool.shared_blocks, {})
+
+    def test_packed_opcodes(self):
+        opcodes = myers.InlineMyersSequenceMatcher(
+            None, 'abcdef', 'abXdeY').get_opcodes()
+        packed = helpers.pack_opcodes(opcodes)
+        self.assertEqual(len(packed), 5 * len(opcodes))
+        self.assertEqual(helpers.unpack_opcodes(packed), opcodes)
+
+    def test_highlight_ranges(self):
+        opcodes = [
+            myers.DiffChunk('equal', 0, 2, 0, 2),
+            myers.DiffChunk('replace', 2, 3, 2, 4),
+            # Short equal runs are highlighted with their neighbours
+            myers.DiffChunk('equal', 3, 4, 4, 5),
+            myers.DiffChunk('delete', 4, 6, 5, 5),
+            myers.DiffChunk('equal', 6, 10, 5, 9),
+            myers.DiffChunk('insert', 10, 10, 9, 11),
+            myers.DiffChunk('equal', 10, 11, 11, 12),
+        ]
+        self.assertEqual(
+            helpers.highlight_ranges(opcodes, 11, 12),
+            ([(2, 6), (10, 10)], [(2, 5), (9, 11)]))